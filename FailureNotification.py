@@ -2,15 +2,85 @@ import json
 import boto3
 import os
 from botocore.exceptions import ClientError
+from db_connection import connection
+import failure_digest
+import metrics
 
 # Initialize the SNS client
 sns_client = boto3.client('sns')
 TOPIC_ARN = os.environ['SNS_TOPIC_ARN']
 
+def publish(pdf_id, client_id, execution_id, is_pdf_chat, groups):
+    total, message = failure_digest.summary(pdf_id, client_id, execution_id, is_pdf_chat, groups)
+    # Send SNS notification
+    with metrics.span('SnsPublish'):
+        sns_response = sns_client.publish(
+            TopicArn=TOPIC_ARN,
+            Message=message,
+            Subject=f"PDF Processing Failure Alert: {total} failure{'s' if total != 1 else ''}"
+        )
+    metrics.add('NotificationsPublished')
+    return sns_response
+
+def notify(pdf_id, client_id, execution_id, is_pdf_chat, groups):
+    """Publish one summary unless these error classes were already notified within the window; None if suppressed"""
+    sns_response = None
+    try:
+        with connection() as conn:
+            try:
+                with metrics.span('FailureDedup'):
+                    pending = failure_digest.claim(conn, pdf_id, execution_id, groups)
+                if pending is not None:
+                    sns_response = publish(pdf_id, client_id, execution_id, is_pdf_chat, pending)
+                # Committed only after publishing, so a failed publish leaves the failures pending
+                conn.commit()
+                return sns_response
+            except Exception:
+                conn.rollback()
+                raise
+    except ClientError:
+        raise
+    except Exception as e:
+        if sns_response is not None:
+            return sns_response
+        # Losing deduplication is better than losing the alert, and the database may be what failed
+        print(f"Failure deduplication unavailable, publishing this run's failures: {e}")
+        return publish(pdf_id, client_id, execution_id, is_pdf_chat, groups)
+
+def flush():
+    """Publish failures that were suppressed and have no later failure to carry them; returns the summaries sent"""
+    published = 0
+    with connection() as conn:
+        try:
+            while True:
+                with metrics.span('FailureDedup'):
+                    due = failure_digest.claim_due(conn)
+                if due is None:
+                    conn.commit()
+                    return published
+                pdf_id, client_id, execution_id, groups = due
+                publish(pdf_id, client_id or 'Unknown', execution_id or 'Unknown', 'unknown', groups)
+                # One PDF per transaction, so a failed publish only leaves that PDF pending
+                conn.commit()
+                published += 1
+        except Exception:
+            conn.rollback()
+            raise
+
+@metrics.instrument('FailureNotification')
 def lambda_handler(event, context):
     print(f"Received event: {json.dumps(event)}")
     
     try:
+        # An EventBridge schedule flushes pending failures whose window has closed
+        if event.get('detail-type') == 'Scheduled Event' or event.get('action') == 'flush':
+            flushed = flush()
+            metrics.add('NotificationsFlushed', flushed)
+            return {
+                'statusCode': 200,
+                'body': json.dumps(f'Flushed {flushed} pending failure notification{"s" if flushed != 1 else ""}')
+            }
+        
         # Check if the event is from SNS or direct invocation
         if 'Records' in event and 'Sns' in event['Records'][0]:
             # Extract the SNS message
@@ -22,32 +92,38 @@ def lambda_handler(event, context):
         
         pdf_id = message_data.get('pdf_id', 'Unknown')
         client_id = message_data.get('client_id', 'Unknown')
-        error = message_data.get('error', 'Unknown error')
+        execution_id = message_data.get('execution_id', 'Unknown')
         is_pdf_chat = str(message_data.get('is_pdf_chat', False)).lower()
+        metrics.add('FailureReports')
         
-        # The error is already formatted in the state machine, so we can use it directly
-        error_message = error
+        # A Map state hands over all of its results at once, so one run of a failing PDF sends one summary;
+        # failed_count lets the state machine stop the run instead of storing an incomplete set of embeddings
+        groups = failure_digest.group(failure_digest.collect(message_data), message_data.get('stage'))
+        failure_count = sum(entry['count'] for entry in groups.values())
+        metrics.add('FailuresReceived', failure_count)
+        if not groups:
+            return {
+                'statusCode': 200,
+                'body': json.dumps('No failures to report'),
+                'failed_count': failure_count
+            }
         
-        message = f"""
-        PDF Processing Failure Notification:
-        PDF ID: {pdf_id}
-        Client ID: {client_id}
-        Error: {error_message}
-        Is PDF Chat: {is_pdf_chat}
-        """
-        
-        # Send SNS notification
-        sns_response = sns_client.publish(
-            TopicArn=TOPIC_ARN,
-            Message=message,
-            Subject='PDF Processing Failure Alert'
-        )
+        sns_response = notify(pdf_id, client_id, execution_id, is_pdf_chat, groups)
+        if sns_response is None:
+            metrics.add('NotificationsSuppressed')
+            print(f"Suppressed {failure_count} failures for PDF {pdf_id}: already notified within {failure_digest.FAILURE_WINDOW_SECONDS}s")
+            return {
+                'statusCode': 200,
+                'body': json.dumps('Failures recorded, notification suppressed'),
+                'failed_count': failure_count
+            }
         
         print(f"SNS notification sent: {json.dumps(sns_response)}")
         
         return {
             'statusCode': 200,
-            'body': json.dumps('Failure notification sent successfully')
+            'body': json.dumps('Failure notification sent successfully'),
+            'failed_count': failure_count
         }
     
     except KeyError as e:
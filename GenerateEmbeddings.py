@@ -4,6 +4,12 @@ import openai
 import json
 from botocore.exceptions import ClientError
 import time
+import struct
+from chunk_manifest import read_slice
+from embedding_cache import content_hash
+import embedding_format
+from tokenizer import count_tokens
+import metrics
 
 # Set the OpenAI API key using environment variables
 openai.api_key = os.getenv("OPENAI_API_KEY")
@@ -11,14 +17,27 @@ openai.api_key = os.getenv("OPENAI_API_KEY")
 # Initialize the AWS S3 client
 s3 = boto3.client('s3')
 
+EMBEDDING_MODEL = "text-embedding-3-large"
+EMBEDDING_DIMENSIONS = 1024
+
+# Limits for a single multi-input embedding request
+MAX_BATCH_TOKENS = int(os.getenv("EMBEDDING_BATCH_TOKENS", 50000))
+MAX_BATCH_INPUTS = int(os.getenv("EMBEDDING_BATCH_INPUTS", 256))
+# Reuse embeddings of identical chunk text from the chunk_embedding_store table
+DEDUP_ENABLED = os.getenv("EMBEDDING_DEDUP", "false").lower() == "true"
+# Batch output format: 'float32' or 'float16' packed binary, or 'json'
+EMBEDDING_FORMAT = os.getenv("EMBEDDING_FORMAT", "float32")
+# Resume partially failed runs from batch objects and pdf_chunks rows that already exist
+RESUME_ENABLED = os.getenv("INGEST_RESUME", "true").lower() == "true"
+
 def get_embedding(text: str, max_retries=3) -> list:
     for attempt in range(max_retries):
         try:
             # Obtain the embedding using the updated OpenAI API approach
             response = openai.Embedding.create(
                 input=text, 
-                model="text-embedding-3-large",
-                dimensions=1024
+                model=EMBEDDING_MODEL,
+                dimensions=EMBEDDING_DIMENSIONS
             )
             return response['data'][0]['embedding']
         except openai.error.RateLimitError:
@@ -30,8 +49,260 @@ def get_embedding(text: str, max_retries=3) -> list:
             print(f"Error generating embedding: {e}")
             raise
 
+def pack_batches(texts, max_tokens=MAX_BATCH_TOKENS, max_inputs=MAX_BATCH_INPUTS):
+    """Group text indexes into sub-batches that fit the token and input limits"""
+    batches = []
+    current = []
+    current_tokens = 0
+    for index, text in enumerate(texts):
+        tokens = count_tokens(text)
+        if current and (current_tokens + tokens > max_tokens or len(current) >= max_inputs):
+            batches.append(current)
+            current = []
+            current_tokens = 0
+        current.append(index)
+        current_tokens += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+def embed_batch(texts, max_retries=3) -> list:
+    for attempt in range(max_retries):
+        try:
+            with metrics.span('EmbeddingRequest'):
+                response = openai.Embedding.create(
+                    input=texts,
+                    model=EMBEDDING_MODEL,
+                    dimensions=EMBEDDING_DIMENSIONS
+                )
+            metrics.add('EmbeddedInputs', len(texts))
+            # The API may return items out of order, so sort by input index
+            data = sorted(response['data'], key=lambda item: item['index'])
+            return [item['embedding'] for item in data]
+        except openai.error.RateLimitError:
+            metrics.add('RateLimited')
+            if attempt < max_retries - 1:
+                time.sleep(2 ** attempt)  # Exponential backoff
+            elif len(texts) > 1:
+                # Split a rate-limited batch in half rather than failing all of it
+                middle = len(texts) // 2
+                print(f"Rate limited on a batch of {len(texts)} inputs, splitting in half")
+                return embed_batch(texts[:middle], max_retries) + embed_batch(texts[middle:], max_retries)
+            else:
+                raise
+        except Exception as e:
+            print(f"Error generating embeddings for batch of {len(texts)}: {e}")
+            raise
+
+def get_embeddings(texts, max_retries=3) -> list:
+    """Embed many texts with as few token-budgeted requests as possible"""
+    embeddings = [None] * len(texts)
+    for batch in pack_batches(texts):
+        vectors = embed_batch([texts[index] for index in batch], max_retries)
+        for index, vector in zip(batch, vectors):
+            embeddings[index] = vector
+    return embeddings
+
+def lookup_stored_embeddings(hashes) -> dict:
+    """Fetch already computed embeddings for all the given content hashes in one query"""
+    from db_connection import connection
+    with connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                "SELECT content_hash, embedding::real[] FROM chunk_embedding_store WHERE content_hash = ANY(%s)",
+                (list(set(hashes)),)
+            )
+            return dict(cur.fetchall())
+
+def save_embeddings(embeddings_by_hash):
+    from db_connection import connection
+    from psycopg2 import extras
+    with connection() as conn:
+        with conn.cursor() as cur:
+            extras.execute_values(
+                cur,
+                """
+                INSERT INTO chunk_embedding_store (content_hash, model, dimensions, embedding)
+                VALUES %s ON CONFLICT (content_hash) DO NOTHING
+                """,
+                [(key, EMBEDDING_MODEL, EMBEDDING_DIMENSIONS, embedding) for key, embedding in embeddings_by_hash.items()],
+                template="(%s, %s, %s, %s::vector)"
+            )
+        conn.commit()
+
+def get_embeddings_deduplicated(texts):
+    """Embed only texts whose content hash has not been embedded before, returning (embeddings, reused_count)"""
+    hashes = [content_hash(text, EMBEDDING_MODEL, EMBEDDING_DIMENSIONS) for text in texts]
+    stored = lookup_stored_embeddings(hashes)
+    text_by_hash = dict(zip(hashes, texts))
+    # Identical texts within the batch are embedded once
+    missing = [key for key in text_by_hash if key not in stored]
+    if missing:
+        fresh = dict(zip(missing, get_embeddings([text_by_hash[key] for key in missing])))
+        save_embeddings(fresh)
+        stored.update(fresh)
+    return [stored[key] for key in hashes], len(texts) - len(missing)
+
+def lookup_stored_chunks(pdf_id, chunks) -> dict:
+    """Embeddings already in pdf_chunks for these chunks, keyed by chunk_index, where the text is unchanged"""
+    from db_connection import connection
+    with connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                "SELECT chunk_index, content, content_embedding::real[] FROM pdf_chunks WHERE pdf_id = %s AND chunk_index = ANY(%s)",
+                (pdf_id, [chunk['chunk_index'] for chunk in chunks])
+            )
+            stored = {chunk_index: (content, embedding) for chunk_index, content, embedding in cur.fetchall()}
+    return {
+        chunk['chunk_index']: stored[chunk['chunk_index']][1]
+        for chunk in chunks
+        # StoreEmbeddings strips null bytes before writing
+        if chunk['chunk_index'] in stored and stored[chunk['chunk_index']][0] == chunk['text'].replace('\x00', '')
+    }
+
+def slice_source(event, chunks):
+    """What a batch object was embedded from: the manifest slice and a digest of its chunks, model and dimensions"""
+    text = '\x00'.join(f"{chunk['chunk_index']}:{chunk['text']}" for chunk in chunks)
+    return {
+        'byte_start': event.get('byte_start'),
+        'byte_end': event.get('byte_end'),
+        'chunks_sha256': content_hash(text, EMBEDDING_MODEL, EMBEDDING_DIMENSIONS)
+    }
+
+def stored_batch_metadata(bucket, key):
+    """Metadata of an existing batch object, or None when there is none or it cannot be read"""
+    try:
+        if key.endswith('.json'):
+            metadata = json.loads(s3.get_object(Bucket=bucket, Key=key)['Body'].read())
+        else:
+            # Two ranged GETs read the header and the metadata without the vectors
+            header_size = embedding_format.HEADER.size
+            header = s3.get_object(Bucket=bucket, Key=key, Range=f"bytes=0-{header_size - 1}")['Body'].read()
+            meta_length = embedding_format.metadata_length(header)
+            body = s3.get_object(Bucket=bucket, Key=key, Range=f"bytes={header_size}-{header_size + meta_length - 1}")['Body'].read()
+            metadata = json.loads(body.rstrip(b'\x00'))
+    except ClientError as e:
+        if e.response['Error']['Code'] in ('404', 'NoSuchKey', 'NotFound'):
+            return None
+        raise
+    except (ValueError, struct.error) as e:
+        print(f"Unreadable batch object {key}, embedding it again: {e}")
+        return None
+    return metadata
+
+def embed_chunks(texts):
+    if DEDUP_ENABLED:
+        embeddings, reused_count = get_embeddings_deduplicated(texts)
+        print(f"Reused {reused_count} of {len(texts)} embeddings ({reused_count / len(texts):.1%} deduplicated)")
+        return embeddings, reused_count
+    return get_embeddings(texts), 0
+
+def process_batch(event):
+    bucket = event['bucket']
+    embeddings_dir = event['embeddings_dir']
+
+    with metrics.span('S3Read'):
+        if event.get('manifest_key'):
+            # Read only this invocation's slice of the chunk manifest
+            chunks = read_slice(s3, bucket, event['manifest_key'], event['byte_start'], event['byte_end'])
+            metrics.add('ChunkBytes', event['byte_end'] - event['byte_start'], 'Bytes')
+        else:
+            chunks = []
+            for chunk_key in event['chunk_keys']:
+                chunk_data = s3.get_object(Bucket=bucket, Key=chunk_key)
+                chunks.append(json.loads(chunk_data['Body'].read()))
+                metrics.add('ChunkBytes', chunk_data['ContentLength'], 'Bytes')
+    metrics.add('Chunks', len(chunks))
+
+    print(f"Processing batch of {len(chunks)} chunks")
+
+    first_chunk = chunks[0]
+    source = slice_source(event, chunks)
+    extension = 'json' if EMBEDDING_FORMAT == 'json' else 'bin'
+    embedding_key = f"{embeddings_dir}embeddings_batch_{first_chunk['chunk_index']}.{extension}"
+    result = {
+        'statusCode': 200,
+        'embedding_key': embedding_key,
+        'chunk_count': len(chunks),
+        'bucket': bucket,
+        'pdf_id': first_chunk['pdf_id'],
+        'client_id': first_chunk.get('client_id'),
+        'is_pdf_chat': first_chunk.get('is_pdf_chat', False)
+    }
+
+    # A batch object from an earlier attempt is only reused if it was embedded from this exact slice;
+    # re-chunking the same PDF with other settings writes different chunks under the same key
+    if RESUME_ENABLED:
+        stored_metadata = stored_batch_metadata(bucket, embedding_key)
+        if stored_metadata is not None and stored_metadata.get('source') == source:
+            print(f"Batch already embedded, skipping: {embedding_key}")
+            metrics.add('ResumedBatches')
+            return dict(result, reused_count=len(chunks), dedup_ratio=1.0, resumed=True)
+        if stored_metadata is not None:
+            print(f"Batch object {embedding_key} was embedded from other chunks, embedding again")
+            metrics.add('StaleBatches')
+
+    with metrics.span('StoredChunkLookup'):
+        stored = lookup_stored_chunks(first_chunk['pdf_id'], chunks) if RESUME_ENABLED else {}
+    pending = [chunk for chunk in chunks if chunk['chunk_index'] not in stored]
+    if stored:
+        print(f"Resuming: {len(stored)} of {len(chunks)} chunks already stored")
+    with metrics.span('Embedding'):
+        fresh, reused_count = embed_chunks([chunk['text'] for chunk in pending]) if pending else ([], 0)
+    fresh_by_index = dict(zip([chunk['chunk_index'] for chunk in pending], fresh))
+    embeddings = [
+        stored[chunk['chunk_index']] if chunk['chunk_index'] in stored else fresh_by_index[chunk['chunk_index']]
+        for chunk in chunks
+    ]
+    reused_count += len(stored)
+    metrics.add('ReusedEmbeddings', reused_count)
+
+    metadata = {
+        'pdf_id': first_chunk['pdf_id'],
+        'client_id': first_chunk.get('client_id'),
+        'is_pdf_chat': first_chunk.get('is_pdf_chat', False),
+        'reused_count': reused_count,
+        'source': source,
+        'chunks': [
+            {
+                'text': chunk['text'],
+                'chunk_index': chunk['chunk_index'],
+                'page_start': chunk.get('page_start'),
+                'page_end': chunk.get('page_end')
+            }
+            for chunk in chunks
+        ]
+    }
+
+    # Store every vector of the batch in a single S3 object
+    if EMBEDDING_FORMAT == 'json':
+        for chunk, embedding in zip(metadata['chunks'], embeddings):
+            chunk['embedding'] = embedding
+        body = json.dumps(metadata)
+    else:
+        body = embedding_format.encode(metadata, embeddings, dtype=EMBEDDING_FORMAT)
+
+    with metrics.span('S3Write'):
+        s3.put_object(Bucket=bucket, Key=embedding_key, Body=body)
+    metrics.add('EmbeddingBytes', len(body), 'Bytes')
+
+    print(f"Batch embeddings generated and stored: {embedding_key}")
+
+    return dict(result, reused_count=reused_count, dedup_ratio=reused_count / len(chunks))
+
+@metrics.instrument('GenerateEmbeddings')
 def lambda_handler(event, context):
     try:
+        if event.get('chunk_keys') or event.get('manifest_key'):
+            try:
+                return process_batch(event)
+            except ClientError as e:
+                print(f"Error accessing S3 for batch: {e}")
+                return {
+                    'statusCode': 404,
+                    'body': json.dumps('Chunk batch not found in S3')
+                }
+
         bucket = event['bucket']
         chunk_key = event['chunk_key']
         embeddings_dir = event['embeddings_dir']
@@ -61,6 +332,8 @@ def lambda_handler(event, context):
             'embedding': embedding,
             'pdf_id': chunk_content['pdf_id'],
             'chunk_index': chunk_content['chunk_index'],
+            'page_start': chunk_content.get('page_start'),
+            'page_end': chunk_content.get('page_end'),
             'client_id': chunk_content.get('client_id'),
             'is_pdf_chat': chunk_content.get('is_pdf_chat', False)
         }
@@ -3,10 +3,150 @@ import fitz  # PyMuPDF
 import re
 import boto3
 import os
+import pickle
+import tempfile
+import multiprocessing
 from botocore.exceptions import ClientError
+from chunk_manifest import ManifestWriter, write_index
+from chunker import chunk_pages
+import metrics
 
 s3 = boto3.client('s3')
 
+# PDFs are spooled here instead of being held in memory
+SPOOL_DIR = os.getenv('SPLIT_SPOOL_DIR', '/tmp')
+# Documents with at least this many pages are extracted by SPLIT_WORKERS processes in parallel
+PARALLEL_MIN_PAGES = int(os.getenv('SPLIT_PARALLEL_MIN_PAGES', 64))
+SPLIT_WORKERS = int(os.getenv('SPLIT_WORKERS', os.cpu_count() or 1))
+# 'tokens' packs segments by model tokens with overlap and page spans, 'characters' is the original splitter
+CHUNKER = os.getenv('CHUNKER', 'tokens')
+CHUNK_TOKENS = int(os.getenv('CHUNK_TOKENS', 200))
+CHUNK_OVERLAP_TOKENS = int(os.getenv('CHUNK_OVERLAP_TOKENS', 40))
+
+bullet_point_pattern = re.compile(r'^(\d+[\.\)]|\*|•|-)\s')
+sentence_pattern = re.compile(r'(?<=[.!?]) +')
+
+def segment_page(text):
+    """Split page text into (piece, separator) pairs: bullet lines and sentences"""
+    segments = []
+    for line in text.splitlines():
+        if bullet_point_pattern.match(line.strip()):
+            segments.append((line, "\n"))
+        else:
+            segments.extend((sentence, " ") for sentence in sentence_pattern.split(line))
+    return segments
+
+def iter_pages(document, first_page=0, last_page=None):
+    """Yield (page_number, segments) with 1-based page numbers"""
+    for page_index in range(first_page, document.page_count if last_page is None else last_page):
+        yield page_index + 1, segment_page(document[page_index].get_text())
+
+def iter_segments(document, first_page=0, last_page=None):
+    for _, segments in iter_pages(document, first_page, last_page):
+        yield from segments
+
+def pack_chunks(segments, chunk_size):
+    """Greedily pack segments into chunks of at most chunk_size characters"""
+    current_chunk = ""
+    for piece, separator in segments:
+        if len(current_chunk) + len(piece) <= chunk_size:
+            current_chunk += piece + separator
+        else:
+            yield current_chunk
+            current_chunk = piece + separator
+    if current_chunk.strip():
+        yield current_chunk
+
+def page_ranges(page_count, workers):
+    step = -(-page_count // workers)
+    return [(first, min(first + step, page_count)) for first in range(0, page_count, step)]
+
+def _extract_range(pdf_path, first_page, last_page, output_path, conn):
+    # Runs in a worker process: one pickled segment list per page, written to local disk
+    try:
+        document = fitz.open(pdf_path)
+        with open(output_path, 'wb') as f:
+            for page_index in range(first_page, last_page):
+                pickle.dump(segment_page(document[page_index].get_text()), f, pickle.HIGHEST_PROTOCOL)
+        document.close()
+        conn.send(None)
+    except Exception as e:
+        conn.send(f"pages {first_page}-{last_page}: {e}")
+    finally:
+        conn.close()
+
+def iter_pages_parallel(pdf_path, page_count, workers=SPLIT_WORKERS):
+    """Extract page ranges in worker processes and yield (page_number, segments) in page order"""
+    # Lambda has no /dev/shm, so multiprocessing.Pool and Queue are unavailable; Process and Pipe work
+    context = multiprocessing.get_context('fork')
+    jobs = []
+    try:
+        for first_page, last_page in page_ranges(page_count, workers):
+            output_path = f"{pdf_path}.{first_page}.segments"
+            parent_conn, child_conn = context.Pipe(duplex=False)
+            process = context.Process(target=_extract_range, args=(pdf_path, first_page, last_page, output_path, child_conn))
+            process.start()
+            child_conn.close()
+            jobs.append((first_page, process, parent_conn, output_path))
+        for first_page, process, parent_conn, output_path in jobs:
+            try:
+                error = parent_conn.recv()
+            except EOFError:
+                error = f"extraction worker exited with code {process.exitcode}"
+            process.join()
+            if error:
+                raise RuntimeError(f"Page extraction failed for {error}")
+            with open(output_path, 'rb') as f:
+                page_number = first_page + 1
+                while True:
+                    try:
+                        page_segments = pickle.load(f)
+                    except EOFError:
+                        break
+                    yield page_number, page_segments
+                    page_number += 1
+            os.remove(output_path)
+    finally:
+        for _, process, parent_conn, output_path in jobs:
+            if process.is_alive():
+                process.terminate()
+            process.join()
+            parent_conn.close()
+            if os.path.exists(output_path):
+                os.remove(output_path)
+
+def iter_segments_parallel(pdf_path, page_count, workers=SPLIT_WORKERS):
+    for _, segments in iter_pages_parallel(pdf_path, page_count, workers):
+        yield from segments
+
+def iter_pdf_pages(pdf_path, workers=SPLIT_WORKERS, min_parallel_pages=PARALLEL_MIN_PAGES):
+    document = fitz.open(pdf_path)
+    page_count = document.page_count
+    if workers > 1 and page_count >= min_parallel_pages:
+        # Close before forking so workers open their own handle on the file
+        document.close()
+        print(f"Extracting {page_count} pages with {workers} worker processes")
+        yield from iter_pages_parallel(pdf_path, page_count, workers)
+        return
+    try:
+        yield from iter_pages(document)
+    finally:
+        document.close()
+
+def iter_pdf_segments(pdf_path, workers=SPLIT_WORKERS, min_parallel_pages=PARALLEL_MIN_PAGES):
+    for _, segments in iter_pdf_pages(pdf_path, workers, min_parallel_pages):
+        yield from segments
+
+def iter_chunks(pdf_path, chunker, chunk_tokens, chunk_overlap_tokens, chunk_size, workers=SPLIT_WORKERS):
+    """Yield (text, page_start, page_end); the character splitter keeps no page numbers"""
+    if chunker == 'characters':
+        for chunk in pack_chunks(iter_pdf_segments(pdf_path, workers), chunk_size):
+            yield chunk, None, None
+        return
+    for chunk in chunk_pages(iter_pdf_pages(pdf_path, workers), chunk_tokens, chunk_overlap_tokens):
+        yield chunk.text, chunk.page_start, chunk.page_end
+
+@metrics.instrument('SplitPDF')
 def lambda_handler(event, context):
     try:
         bucket = event['bucket']
@@ -16,67 +156,96 @@ def lambda_handler(event, context):
         client_id = event.get('client_id')
         is_pdf_chat = event.get('is_pdf_chat', False)
         
+        # chunk_size is in characters and only used by the 'characters' chunker, which has no overlap
+        chunker = event.get('chunker', CHUNKER)
         chunk_size = event.get('chunk_size', 750)
-        chunk_overlap = event.get('chunk_overlap', 300)
+        chunk_tokens = event.get('chunk_tokens', CHUNK_TOKENS)
+        chunk_overlap_tokens = event.get('chunk_overlap_tokens', CHUNK_OVERLAP_TOKENS)
+        ignored = [field for field in ('chunk_size', 'chunk_overlap') if chunker != 'characters' and field in event]
+        if ignored:
+            print(f"Ignoring {', '.join(ignored)} (characters) for the '{chunker}' chunker; "
+                  f"using chunk_tokens={chunk_tokens}, chunk_overlap_tokens={chunk_overlap_tokens}")
+        
+        # 'objects' writes one S3 object per chunk, 'manifest' writes a single NDJSON manifest
+        output_mode = event.get('output_mode', 'objects')
+        chunks_per_slice = event.get('chunks_per_slice', 100)
         
         print(f"Processing PDF: {pdf_id} for client: {client_id}")
         
-        # Download the file from S3
+        # Spool the file from S3 to local disk rather than reading it into memory
+        fd, pdf_path = tempfile.mkstemp(suffix='.pdf', dir=SPOOL_DIR)
+        os.close(fd)
         try:
-            response = s3.get_object(Bucket=bucket, Key=key)
-            pdf_content = response['Body'].read()
+            with metrics.span('S3Download'):
+                s3.download_file(bucket, key, pdf_path)
+            metrics.add('PdfBytes', os.path.getsize(pdf_path), 'Bytes')
         except ClientError as e:
             print(f"Error downloading PDF from S3: {e}")
+            os.remove(pdf_path)
             return {
                 'statusCode': 404,
                 'body': json.dumps('PDF file not found in S3')
             }
         
-        # Open the PDF content from memory
-        document = fitz.open(stream=pdf_content, filetype="pdf")
-        
-        text_chunks = []
-        current_chunk = ""
         chunk_keys = []
+        manifest = ManifestWriter() if output_mode == 'manifest' else None
+        manifest_key = f'{chunks_dir}manifest.ndjson'
         
-        def add_chunk(chunk, index):
+        def add_chunk(chunk, page_start, page_end, index):
             chunk_key = f'{chunks_dir}chunk_{index}.json'
             chunk_data = {
                 'text': chunk.strip(),
-                'chunk_key': chunk_key,
+                'chunk_key': manifest_key if manifest is not None else chunk_key,
                 'chunk_index': index,
+                'page_start': page_start,
+                'page_end': page_end,
                 'pdf_id': pdf_id,
                 'client_id': client_id,
                 'is_pdf_chat': is_pdf_chat
             }
-            s3.put_object(Bucket=bucket, Key=chunk_key, Body=json.dumps(chunk_data))
+            if manifest is not None:
+                manifest.add(chunk_data)
+                return
+            body = json.dumps(chunk_data)
+            s3.put_object(Bucket=bucket, Key=chunk_key, Body=body)
+            metrics.add('S3Puts')
+            metrics.add('ChunkBytes', len(body), 'Bytes')
             chunk_keys.append(chunk_key)
             print(f"Chunk {index} created: {chunk_key}")
         
-        bullet_point_pattern = re.compile(r'^(\d+[\.\)]|\*|•|-)\s')
-        sentence_pattern = re.compile(r'(?<=[.!?]) +')
+        def chunk_count():
+            return len(manifest) if manifest is not None else len(chunk_keys)
         
-        for page_index, page in enumerate(document):
-            text = page.get_text()
-            lines = text.splitlines()
-            for line in lines:
-                if bullet_point_pattern.match(line.strip()):
-                    if len(current_chunk) + len(line) <= chunk_size:
-                        current_chunk += line + "\n"
-                    else:
-                        add_chunk(current_chunk, len(chunk_keys))
-                        current_chunk = line + "\n"
-                else:
-                    sentences = sentence_pattern.split(line)
-                    for sentence in sentences:
-                        if len(current_chunk) + len(sentence) <= chunk_size:
-                            current_chunk += sentence + " "
-                        else:
-                            add_chunk(current_chunk, len(chunk_keys))
-                            current_chunk = sentence + " "
+        try:
+            # In 'objects' mode this includes the per-chunk S3 PUTs, which are interleaved with extraction
+            with metrics.span('ExtractAndChunk'):
+                for chunk, page_start, page_end in iter_chunks(pdf_path, chunker, chunk_tokens, chunk_overlap_tokens, chunk_size):
+                    add_chunk(chunk, page_start, page_end, chunk_count())
+        finally:
+            os.remove(pdf_path)
+        metrics.add('Chunks', chunk_count())
         
-        if current_chunk.strip():
-            add_chunk(current_chunk, len(chunk_keys))
+        if manifest is not None:
+            # Upload every chunk in one object and hand Step Functions only the slice boundaries
+            total_chunks = len(manifest)
+            slices = manifest.slices(chunks_per_slice)
+            with metrics.span('S3Upload'):
+                manifest_size = manifest.upload(s3, bucket, manifest_key)
+                manifest.close()
+                write_index(s3, bucket, manifest_key, slices)
+            metrics.add('ChunkBytes', manifest_size, 'Bytes')
+            print(f"PDF processing complete. Total chunks: {total_chunks}, manifest: {manifest_key} ({manifest_size} bytes)")
+            
+            return {
+                'statusCode': 200,
+                'manifest_key': manifest_key,
+                'chunk_count': total_chunks,
+                'slices': slices,
+                'bucket': bucket,
+                'pdf_id': pdf_id,
+                'client_id': client_id,
+                'is_pdf_chat': is_pdf_chat
+            }
         
         print(f"PDF processing complete. Total chunks: {len(chunk_keys)}")
         
@@ -3,7 +3,16 @@ import psycopg2
 from psycopg2 import extras
 import json
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
 from botocore.exceptions import ClientError
+from pg_copy import upsert_rows
+from chunk_partitions import tenant_key
+from db_connection import connection, get_stats
+from embedding_format import is_packed, to_batch_content, to_vector_literal
+import pdf_registry
+import local_vector_store
+import metrics
 
 # Initialize the AWS S3 client and Lex client
 s3 = boto3.client('s3')
@@ -12,30 +21,194 @@ lex_client = boto3.client('lex-runtime')
 BOT_NAME = 'PDFChatAgent'
 BOT_ALIAS = 'pdfchatagent'
 
+# 'binary' streams vectors in pgvector's binary format, 'text' is the fallback
+COPY_FORMAT = os.getenv('COPY_FORMAT', 'binary')
+S3_READ_WORKERS = int(os.getenv('S3_READ_WORKERS', 8))
+# Export each PDF's vectors for the in-process retrieval backend used by queryPDF
+VECTOR_EXPORT = os.getenv('VECTOR_EXPORT', 'true').lower() == 'true'
+
+class IncompleteEmbeddingsError(Exception):
+    """Some chunks of the PDF have no embedding, so it cannot be stored and marked ready"""
+
 def clean_string(input_string):
     """Remove null bytes from the string"""
     return input_string.replace('\x00', '')
 
+def build_rows(embedding_key, embedding_content):
+    # Batch objects from GenerateEmbeddings hold many chunks, single objects hold one
+    records = embedding_content.get('chunks', [embedding_content])
+    return [
+        (
+            embedding_content['pdf_id'],
+            record['chunk_index'],
+            embedding_key,
+            clean_string(record['text']),  # Remove any null bytes
+            record['embedding'],
+            tenant_key(embedding_content.get('client_id')),  # Partition key, never NULL
+            True,  # Set is_pdf_chat to True
+            record.get('page_start'),
+            record.get('page_end')
+        )
+        for record in records
+    ]
+
+def parse_embedding_object(body):
+    # Packed batches are read as NumPy views over the S3 body, older objects are JSON
+    if is_packed(body):
+        return to_batch_content(body)
+    return json.loads(body)
+
+def load_embedding_objects(bucket, embeddings_dir):
+    """Read every embedding object of a PDF, fetching them from S3 in parallel"""
+    paginator = s3.get_paginator('list_objects_v2')
+    keys = [
+        obj['Key']
+        for page in paginator.paginate(Bucket=bucket, Prefix=embeddings_dir)
+        for obj in page.get('Contents', [])
+    ]
+
+    # Worker threads do not inherit the invocation's context, so record through it directly
+    recorder = metrics.current()
+
+    def fetch(key):
+        body = s3.get_object(Bucket=bucket, Key=key)['Body'].read()
+        recorder.add('EmbeddingBytes', len(body), 'Bytes')
+        return key, parse_embedding_object(body)
+
+    with ThreadPoolExecutor(max_workers=S3_READ_WORKERS) as executor:
+        return list(executor.map(fetch, keys))
+
+def notify_processing_complete(client_id, pdf_id, ingest_version=None):
+    # Update Lex session with is_pdf_chat and processing status
+    session_attributes = {
+        'pdf_id': pdf_id,
+        'client_id': client_id,
+        'is_pdf_chat': 'true',
+        'processing_complete': 'true'
+    }
+    if ingest_version:
+        session_attributes['ingest_version'] = ingest_version
+    try:
+        with metrics.span('LexNotify'):
+            lex_response = lex_client.post_text(
+                botName=BOT_NAME,
+                botAlias=BOT_ALIAS,
+                userId=client_id,
+                inputText='notify_pdf_processing_complete',
+                sessionAttributes=session_attributes
+            )
+        print("Lex Response:", lex_response)  # Log Lex response for debugging
+        return lex_response.get('message', 'PDF processing complete. You can now ask questions about the document.')
+    except ClientError as lex_error:
+        print("Lex ClientError:", lex_error)  # Log Lex ClientError for debugging
+        return "Failed to update Lex session, but PDF processing is complete. You can now ask questions about the document."
+
+def store_bulk(event):
+    """Load all embeddings of one PDF with a single COPY in one transaction"""
+    bucket = event['bucket']
+    embeddings_dir = event['embeddings_dir']
+    pdf_id = event['pdf_id']
+    client_id = event.get('client_id')
+
+    print(f"Bulk loading embeddings for PDF: {pdf_id} from {embeddings_dir}")
+
+    rows_by_index = {}
+    reused_count = 0
+    with metrics.span('S3Read'):
+        embedding_objects = load_embedding_objects(bucket, embeddings_dir)
+    metrics.add('EmbeddingObjects', len(embedding_objects))
+    for embedding_key, embedding_content in embedding_objects:
+        # Objects left by an earlier attempt may cover the same chunks again
+        rows_by_index.update((row[1], row) for row in build_rows(embedding_key, embedding_content))
+        reused_count += embedding_content.get('reused_count', 0)
+    # SplitPDF's chunk count; executions started without it only check the indexes found for gaps
+    chunk_count = event.get('chunk_count')
+    if chunk_count is None:
+        chunk_count = max(rows_by_index) + 1 if rows_by_index else 0
+    # Objects from an earlier ingest with a different chunk size may reach past the end
+    rows = [rows_by_index[index] for index in range(chunk_count) if index in rows_by_index]
+
+    if not rows and not chunk_count:
+        return {
+            'statusCode': 404,
+            'body': json.dumps('No embeddings found in S3')
+        }
+    if len(rows) < chunk_count:
+        # Marking the PDF ready would make re-uploads skip it with chunks missing
+        try:
+            with connection() as conn:
+                with conn.cursor() as cur:
+                    pdf_registry.mark_failed(cur, pdf_id)
+                conn.commit()
+        except psycopg2.Error as e:
+            # The lease still expires, so the PDF can be retried later either way
+            print(f"Could not mark PDF {pdf_id} failed: {e}")
+        raise IncompleteEmbeddingsError(f"{chunk_count - len(rows)} of {chunk_count} chunks of PDF {pdf_id} have no embedding")
+
+    # The ingest version tells query Lambdas when their cached matrix for this PDF is stale
+    ingest_version = str(int(time.time() * 1000))
+
+    # Reuse a warm connection from the module-level manager
+    with connection() as conn:
+        try:
+            with metrics.span('DbCopy'), conn.cursor() as cur:
+                # Upserts on (pdf_id, chunk_index, client_id) make retries and re-runs idempotent
+                row_count = upsert_rows(cur, rows, binary=COPY_FORMAT != 'text')
+                # Drop chunks beyond the new end, e.g. after re-ingesting with a different chunk size
+                cur.execute(
+                    "DELETE FROM pdf_chunks WHERE client_id = %s AND pdf_id = %s AND chunk_index >= %s",
+                    (rows[-1][5], pdf_id, chunk_count)
+                )
+                pdf_registry.mark_ready(cur, pdf_id, client_id, row_count, ingest_version)
+                conn.commit()
+            metrics.add('RowsWritten', row_count)
+            print(f"{row_count} embeddings copied for PDF: {pdf_id}, dedup ratio: {reused_count / row_count:.1%}")
+        except psycopg2.Error as e:
+            conn.rollback()
+            print(f"Database error: {e}")
+            raise
+    print(f"DB connection stats: {get_stats()}")
+
+    if VECTOR_EXPORT:
+        with metrics.span('VectorExport'):
+            vectors_key = local_vector_store.export_pdf_vectors(
+                s3, bucket, pdf_id, ingest_version,
+                [{'chunk_index': row[1], 'text': row[3]} for row in rows],
+                [row[4] for row in rows]
+            )
+        print(f"Exported vectors for PDF: {pdf_id} to {vectors_key}")
+
+    lex_message = notify_processing_complete(client_id, pdf_id, ingest_version)
+
+    return {
+        'statusCode': 200,
+        'body': json.dumps({
+            'message': 'Embeddings stored successfully.',
+            'pdf_id': pdf_id,
+            'client_id': client_id,
+            'chunk_count': row_count,
+            'dedup_ratio': reused_count / row_count,
+            'ingest_version': ingest_version,
+            'is_pdf_chat': True,
+            'lex_message': lex_message
+        })
+    }
+
+@metrics.instrument('StoreEmbeddings')
 def lambda_handler(event, context):
     try:
+        if event.get('mode') == 'bulk':
+            return store_bulk(event)
+        
         bucket = event['bucket']
         embedding_key = event['embedding_key']
         
         print(f"Processing embedding: {embedding_key}")
         
-        # Database connection parameters from environment variables
-        db_params = {
-            'dbname': os.getenv('DB_NAME'),
-            'user': os.getenv('DB_USER'),
-            'password': os.getenv('DB_PASSWORD'),
-            'host': os.getenv('DB_HOST'),
-            'port': os.getenv('DB_PORT')
-        }
-        
         # Retrieve the embedding data from S3
         try:
             embedding_data = s3.get_object(Bucket=bucket, Key=embedding_key)
-            embedding_content = json.loads(embedding_data['Body'].read())
+            embedding_content = parse_embedding_object(embedding_data['Body'].read())
         except ClientError as e:
             print(f"Error retrieving embedding from S3: {e}")
             return {
@@ -43,93 +216,46 @@ def lambda_handler(event, context):
                 'body': json.dumps('Embedding not found in S3')
             }
         
-        # Clean the text to remove any null bytes
-        cleaned_text = clean_string(embedding_content['text'])
-        
-        # Convert the embedding to a format suitable for PostgreSQL
-        embedding = embedding_content['embedding']
-        
-        # Connect to the PostgreSQL database
-        conn = psycopg2.connect(**db_params)
-        cur = conn.cursor()
-        
-        try:
-            # Ensure the pgvector extension is created and create table
-            cur.execute("CREATE EXTENSION IF NOT EXISTS vector;")
-            cur.execute("""
-            DO $$
-            BEGIN
-                IF NOT EXISTS (SELECT 1 FROM pg_class WHERE relname = 'pdf_chunks') THEN
-                    CREATE TABLE pdf_chunks (
-                        id SERIAL PRIMARY KEY,
-                        pdf_id UUID NOT NULL,
-                        chunk_index INT NOT NULL,
-                        file_path TEXT,
-                        content TEXT,
-                        content_embedding VECTOR(1024),
-                        client_id UUID,
-                        is_pdf_chat BOOLEAN
-                    );
-                    CREATE INDEX IF NOT EXISTS pdf_chunks_embedding_idx ON pdf_chunks USING ivfflat (content_embedding vector_cosine_ops);
-                END IF;
-            END
-            $$;
-            """)
-            conn.commit()
-        
-            # Prepare the data for batch insertion
-            insert_data = [
-                (
-                    embedding_content['pdf_id'],
-                    embedding_content['chunk_index'],
-                    embedding_key,
-                    cleaned_text,
-                    embedding,
-                    embedding_content.get('client_id'),
-                    True  # Set is_pdf_chat to True
-                )
-            ]
+        # Reuse a warm connection to the PostgreSQL database
+        with connection() as conn:
+            cur = conn.cursor()
+            try:
+                # Prepare the data for batch insertion
+                insert_data = [
+                    row[:4] + (to_vector_literal(row[4]),) + row[5:]
+                    for row in build_rows(embedding_key, embedding_content)
+                ]
+            
+                # Batch insert the embedding data into the database
+                insert_query = """
+                INSERT INTO pdf_chunks (pdf_id, chunk_index, file_path, content, content_embedding, client_id, is_pdf_chat, page_start, page_end)
+                VALUES (%s, %s, %s, %s, %s::VECTOR, %s, %s, %s, %s)
+                ON CONFLICT (pdf_id, chunk_index, client_id) DO UPDATE
+                SET file_path = EXCLUDED.file_path, content = EXCLUDED.content,
+                    content_embedding = EXCLUDED.content_embedding,
+                    is_pdf_chat = EXCLUDED.is_pdf_chat, page_start = EXCLUDED.page_start, page_end = EXCLUDED.page_end
+                """
+                # Changed chunks need a new ingest version, or queryPDF keeps serving answers cached from the old ones
+                ingest_version = str(int(time.time() * 1000))
+                with metrics.span('DbInsert'):
+                    extras.execute_batch(cur, insert_query, insert_data)
+                    pdf_registry.bump_version(cur, embedding_content['pdf_id'], embedding_content.get('client_id'), ingest_version)
+                    conn.commit()
+                metrics.add('RowsWritten', len(insert_data))
+                print(f"{len(insert_data)} embeddings stored successfully for PDF: {embedding_content['pdf_id']}")
+            
+            except psycopg2.Error as e:
+                conn.rollback()
+                print(f"Database error: {e}")
+                raise
+            finally:
+                # The connection stays open for the next invocation
+                cur.close()
+        print(f"DB connection stats: {get_stats()}")
         
-            # Batch insert the embedding data into the database
-            insert_query = """
-            INSERT INTO pdf_chunks (pdf_id, chunk_index, file_path, content, content_embedding, client_id, is_pdf_chat)
-            VALUES (%s, %s, %s, %s, %s::VECTOR, %s, %s)
-            """
-            extras.execute_batch(cur, insert_query, insert_data)
-            conn.commit()
-            print(f"Embedding stored successfully for PDF: {embedding_content['pdf_id']}")
-        
-        except psycopg2.Error as e:
-            conn.rollback()
-            print(f"Database error: {e}")
-            raise
-        finally:
-            # Close the database connection
-            cur.close()
-            conn.close()
-        
-        # Update Lex session with is_pdf_chat and processing status
         client_id = embedding_content.get('client_id')
         pdf_id = embedding_content['pdf_id']
-        
-        try:
-            lex_response = lex_client.post_text(
-                botName=BOT_NAME,
-                botAlias=BOT_ALIAS,
-                userId=client_id,
-                inputText='notify_pdf_processing_complete',
-                sessionAttributes={
-                    'pdf_id': pdf_id,
-                    'client_id': client_id,
-                    'is_pdf_chat': 'true',
-                    'processing_complete': 'true'
-                }
-            )
-            print("Lex Response:", lex_response)  # Log Lex response for debugging
-            lex_message = lex_response.get('message', 'PDF processing complete. You can now ask questions about the document.')
-        except ClientError as lex_error:
-            print("Lex ClientError:", lex_error)  # Log Lex ClientError for debugging
-            lex_message = "Failed to update Lex session, but PDF processing is complete. You can now ask questions about the document."
+        lex_message = notify_processing_complete(client_id, pdf_id, ingest_version)
         
         # Prepare the response
         return {
@@ -138,11 +264,16 @@ def lambda_handler(event, context):
                 'message': 'Embedding stored successfully.',
                 'pdf_id': pdf_id,
                 'client_id': client_id,
+                'ingest_version': ingest_version,
                 'is_pdf_chat': True,
                 'lex_message': lex_message
             })
         }
 
+    except IncompleteEmbeddingsError as e:
+        # Raised so the state machine's Catch reports it instead of ending the run as a success
+        print(f"Incomplete embeddings: {e}")
+        raise
     except Exception as e:
         print(f"Unexpected error: {e}")
         return {
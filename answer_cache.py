@@ -0,0 +1,127 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+ANSWER_CACHE_ENABLED = os.getenv('ANSWER_CACHE_ENABLED', 'true').lower() == 'true'
+# Minimum cosine similarity between a new question and a cached one to reuse its answer
+ANSWER_CACHE_THRESHOLD = float(os.getenv('ANSWER_CACHE_THRESHOLD', 0.95))
+ANSWER_CACHE_TTL = float(os.getenv('ANSWER_CACHE_TTL', 3600))
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv('ANSWER_CACHE_SIZE', 2048))
+
+
+class _Entry:
+    __slots__ = ('vector', 'answer', 'expires_at', 'latency')
+
+    def __init__(self, vector, answer, expires_at, latency):
+        self.vector = vector
+        self.answer = answer
+        self.expires_at = expires_at
+        self.latency = latency
+
+class SemanticAnswerCache:
+    """Answers keyed by pdf_id and question embedding, matched by cosine similarity"""
+
+    def __init__(self, threshold=ANSWER_CACHE_THRESHOLD, ttl=ANSWER_CACHE_TTL, max_entries=ANSWER_CACHE_MAX_ENTRIES):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        # pdf_id -> {'version', 'entries': {entry_id: _Entry}, 'ids', 'matrix'}
+        self._scopes = {}
+        # (pdf_id, entry_id) in least-recently-used order, across all PDFs
+        self._lru = OrderedDict()
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'saved_seconds': 0.0, 'evictions': 0, 'invalidations': 0}
+
+    @staticmethod
+    def _unit(embedding):
+        # NumPy is imported on first use rather than on the query Lambda's cold start
+        import numpy as np
+        vector = np.asarray(embedding, dtype=np.float32)
+        return vector / (np.linalg.norm(vector) or 1)
+
+    def _scope(self, pdf_id, ingest_version):
+        scope = self._scopes.get(pdf_id)
+        if scope is not None and scope['version'] != ingest_version:
+            # The PDF was re-ingested, so answers based on the old chunks are stale
+            self._invalidate(pdf_id)
+            scope = None
+        if scope is None:
+            scope = {'version': ingest_version, 'entries': {}, 'ids': [], 'matrix': None}
+            self._scopes[pdf_id] = scope
+        return scope
+
+    def _remove(self, pdf_id, entry_id):
+        scope = self._scopes.get(pdf_id)
+        if scope and scope['entries'].pop(entry_id, None) is not None:
+            scope['matrix'] = None
+        self._lru.pop((pdf_id, entry_id), None)
+
+    def _invalidate(self, pdf_id):
+        scope = self._scopes.pop(pdf_id, None)
+        if scope:
+            for entry_id in scope['entries']:
+                self._lru.pop((pdf_id, entry_id), None)
+            self.stats['invalidations'] += 1
+
+    def invalidate(self, pdf_id):
+        with self._lock:
+            self._invalidate(pdf_id)
+
+    def lookup(self, pdf_id, query_embedding, ingest_version=None):
+        with self._lock:
+            scope = self._scope(pdf_id, ingest_version)
+            now = time.monotonic()
+            for entry_id in [entry_id for entry_id, entry in scope['entries'].items() if entry.expires_at <= now]:
+                self._remove(pdf_id, entry_id)
+            if not scope['entries']:
+                self.stats['misses'] += 1
+                return None
+            import numpy as np
+            if scope['matrix'] is None:
+                scope['ids'] = list(scope['entries'])
+                scope['matrix'] = np.stack([scope['entries'][entry_id].vector for entry_id in scope['ids']])
+            scores = scope['matrix'] @ self._unit(query_embedding)
+            best = int(np.argmax(scores))
+            if scores[best] < self.threshold:
+                self.stats['misses'] += 1
+                return None
+            entry_id = scope['ids'][best]
+            entry = scope['entries'][entry_id]
+            self._lru.move_to_end((pdf_id, entry_id))
+            self.stats['hits'] += 1
+            self.stats['saved_seconds'] += entry.latency
+            return entry.answer
+
+    def store(self, pdf_id, query_embedding, answer, latency, ingest_version=None):
+        """Cache an answer along with how long it took to produce"""
+        with self._lock:
+            scope = self._scope(pdf_id, ingest_version)
+            entry_id = self._next_id
+            self._next_id += 1
+            scope['entries'][entry_id] = _Entry(self._unit(query_embedding), answer, time.monotonic() + self.ttl, latency)
+            scope['matrix'] = None
+            self._lru[(pdf_id, entry_id)] = None
+            while len(self._lru) > self.max_entries:
+                (old_pdf_id, old_entry_id), _ = self._lru.popitem(last=False)
+                self._remove(old_pdf_id, old_entry_id)
+                self.stats['evictions'] += 1
+
+    def hit_rate(self):
+        total = self.stats['hits'] + self.stats['misses']
+        return self.stats['hits'] / total if total else 0.0
+
+    def report(self):
+        return dict(self.stats, hit_rate=round(self.hit_rate(), 3), size=len(self._lru))
+
+def is_cacheable(is_pdf_chat, ingest_version):
+    """Only single-PDF answers with a known ingest_version are cached.
+
+    A re-ingest changes the PDF's ingest_version, which invalidates its answers. Cross-PDF answers depend on
+    every PDF and have no such version, so caching them would serve answers from before a re-ingest.
+    """
+    return ANSWER_CACHE_ENABLED and is_pdf_chat and bool(ingest_version)
+
+# Module-level cache so answers survive across warm invocations
+answer_cache = SemanticAnswerCache()
@@ -0,0 +1,91 @@
+"""Compare chunking throughput of the token-budget chunker with the original character splitter.
+
+Pages are extracted once up front, so only chunking is timed. Larger documents are built by
+repeating the pages of a source PDF, and --page-multiplier joins consecutive pages into one to
+simulate very long pages:
+
+    python -m benchmarks.bench_chunker --pdf deepLearning.pdf --pages 142 1000 5000 --output chunker.json
+"""
+import argparse
+import json
+import os
+import statistics
+import tempfile
+import time
+
+import fitz
+
+import SplitPDF
+from benchmarks.bench_split_pdf import build_pdf
+from chunker import chunk_pages
+from tokenizer import _encoding, count_tokens
+
+def extract_pages(path, page_multiplier):
+    document = fitz.open(path)
+    texts = [page.get_text() for page in document]
+    document.close()
+    merged = ['\n'.join(texts[start:start + page_multiplier]) for start in range(0, len(texts), page_multiplier)]
+    return [(number, SplitPDF.segment_page(text)) for number, text in enumerate(merged, start=1)]
+
+def run_characters(pages, args):
+    segments = (segment for _, page_segments in pages for segment in page_segments)
+    return [(chunk, None, None) for chunk in SplitPDF.pack_chunks(segments, args.chunk_size)]
+
+def run_tokens(pages, args, overlap_tokens):
+    return [(chunk.text, chunk.page_start, chunk.page_end) for chunk in chunk_pages(pages, args.chunk_tokens, overlap_tokens)]
+
+def measure(name, function, pages, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        chunks = function(pages)
+        timings.append(time.perf_counter() - start)
+    seconds = statistics.median(timings)
+    text_bytes = sum(len(piece) + len(separator) for _, page_segments in pages for piece, separator in page_segments)
+    tokens = [count_tokens(text) for text, _, _ in chunks]
+    return {
+        'chunker': name,
+        'seconds': round(seconds, 4),
+        'mb_per_second': round(text_bytes / seconds / 1e6, 2),
+        'chunks': len(chunks),
+        'mean_tokens': round(statistics.fmean(tokens), 1),
+        'max_tokens': max(tokens),
+        'with_page_spans': all(page_start is not None for _, page_start, _ in chunks)
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--pdf', default='deepLearning.pdf')
+    parser.add_argument('--pages', type=int, nargs='+', default=[142, 1000, 5000])
+    parser.add_argument('--page-multiplier', type=int, default=1, help='join this many pages into one long page')
+    parser.add_argument('--chunk-size', type=int, default=750, help='characters, for the original splitter')
+    parser.add_argument('--chunk-tokens', type=int, default=SplitPDF.CHUNK_TOKENS)
+    parser.add_argument('--overlap-tokens', type=int, default=SplitPDF.CHUNK_OVERLAP_TOKENS)
+    parser.add_argument('--repeat', type=int, default=3, help='runs per chunker; the median is reported')
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    args = parser.parse_args()
+
+    print(f"Token counts from {'tiktoken' if _encoding is not None else 'the character estimate'}")
+    chunkers = [
+        ('characters', lambda pages: run_characters(pages, args)),
+        ('tokens', lambda pages: run_tokens(pages, args, 0)),
+        ('tokens+overlap', lambda pages: run_tokens(pages, args, args.overlap_tokens))
+    ]
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for page_count in args.pages:
+            path = os.path.join(tmp, f"bench_{page_count}.pdf")
+            build_pdf(args.pdf, page_count, path)
+            pages = extract_pages(path, args.page_multiplier)
+            for name, function in chunkers:
+                result = dict(measure(name, function, pages, args.repeat), pages=page_count)
+                print(f"{page_count:>6} pages  {name:>14}  {result['seconds']:8.4f} s  {result['mb_per_second']:7.2f} MB/s  "
+                      f"{result['chunks']:>6} chunks  tokens mean {result['mean_tokens']:6.1f} max {result['max_tokens']:>5}")
+                results.append(result)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == '__main__':
+    main()
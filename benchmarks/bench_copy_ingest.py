@@ -0,0 +1,89 @@
+"""Measure pdf_chunks ingest rows/sec for execute_batch versus COPY (text and binary).
+
+Runs against the Postgres + pgvector database configured by the usual DB_* environment
+variables and writes into a scratch copy of pdf_chunks that is dropped afterwards:
+
+    python -m benchmarks.bench_copy_ingest --sizes 1000 10000 100000 --output copy_ingest.json
+"""
+import argparse
+import json
+import random
+import time
+import uuid
+
+import psycopg2
+from psycopg2 import extras
+
+from db_connection import get_db_params
+from db_schema import apply_schema
+from pg_copy import copy_rows
+
+BENCH_TABLE = 'pdf_chunks_bench'
+DIMENSIONS = 1024
+
+def synthetic_rows(count, seed=0):
+    """Yield pdf_chunks rows lazily, cycling through a small pool of random vectors"""
+    rng = random.Random(seed)
+    vectors = [[rng.uniform(-1, 1) for _ in range(DIMENSIONS)] for _ in range(64)]
+    pdf_id = str(uuid.UUID(int=rng.getrandbits(128)))
+    client_id = str(uuid.UUID(int=rng.getrandbits(128)))
+    for index in range(count):
+        content = f"Synthetic chunk {index} " + "lorem ipsum dolor sit amet " * 25
+        yield (pdf_id, index, 'bench', content, vectors[index % len(vectors)], client_id, True, index // 4 + 1, index // 4 + 1)
+
+def insert_execute_batch(cur, rows):
+    extras.execute_batch(cur, f"""
+        INSERT INTO {BENCH_TABLE} (pdf_id, chunk_index, file_path, content, content_embedding, client_id, is_pdf_chat, page_start, page_end)
+        VALUES (%s, %s, %s, %s, %s::VECTOR, %s, %s, %s, %s)
+    """, rows)
+
+METHODS = {
+    'execute_batch': insert_execute_batch,
+    'copy_text': lambda cur, rows: copy_rows(cur, rows, table=BENCH_TABLE, binary=False),
+    'copy_binary': lambda cur, rows: copy_rows(cur, rows, table=BENCH_TABLE, binary=True),
+}
+
+def run(conn, method, size, with_indexes):
+    with conn.cursor() as cur:
+        cur.execute(f"DROP TABLE IF EXISTS {BENCH_TABLE};")
+        including = "INCLUDING ALL" if with_indexes else "INCLUDING DEFAULTS"
+        cur.execute(f"CREATE TABLE {BENCH_TABLE} (LIKE pdf_chunks {including});")
+        conn.commit()
+
+        start = time.perf_counter()
+        METHODS[method](cur, synthetic_rows(size))
+        conn.commit()
+        elapsed = time.perf_counter() - start
+
+        cur.execute(f"SELECT count(*) FROM {BENCH_TABLE};")
+        assert cur.fetchone()[0] == size
+        cur.execute(f"DROP TABLE {BENCH_TABLE};")
+        conn.commit()
+    return {'method': method, 'rows': size, 'seconds': round(elapsed, 3), 'rows_per_sec': round(size / elapsed, 1)}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--methods', nargs='+', choices=sorted(METHODS), default=sorted(METHODS))
+    parser.add_argument('--with-indexes', action='store_true', help='copy the pdf_chunks indexes onto the scratch table')
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(**get_db_params())
+    try:
+        apply_schema(conn)
+        results = []
+        for size in args.sizes:
+            for method in args.methods:
+                result = run(conn, method, size, args.with_indexes)
+                print(f"{method:>14} {size:>8} rows  {result['seconds']:>8.3f}s  {result['rows_per_sec']:>10.1f} rows/s")
+                results.append(result)
+    finally:
+        conn.close()
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == '__main__':
+    main()
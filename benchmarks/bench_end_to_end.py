@@ -0,0 +1,264 @@
+"""End-to-end ingest and query benchmark with offline stand-ins.
+
+Ingests each corpus through SplitPDF -> GenerateEmbeddings -> StoreEmbeddings with the local state machine
+runner, then replays questions through queryPDF.lambda_handler. S3 is moto, embeddings, completions and Lex
+are deterministic fakes with configurable latency, and Postgres + pgvector is the local database configured
+by the DB_* variables. Corpora are the bundled PDFs plus synthetic PDFs of increasing size:
+
+    python -m benchmarks.bench_end_to_end --synthetic-pages 50 200 1000 --queries 200 --output e2e.json
+    python -m benchmarks.bench_end_to_end --compare e2e.json    # print changes against an earlier run
+"""
+import argparse
+import contextlib
+import datetime
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import tempfile
+import time
+
+import fitz
+
+from benchmarks.bench_map_concurrency import execution_input
+from benchmarks import stand_ins
+
+BUNDLED_PDFS = ['LLMdoc.pdf', 'deepLearning.pdf']
+BUCKET = 'pdfchat-bench'
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+def synthetic_pdf(path, pages, seed=0):
+    """Write a PDF of seeded pseudo-text: paragraphs of sentences with a few bullet lists"""
+    rng = random.Random(seed)
+    syllables = ['ka', 'lo', 'mi', 'ne', 'ta', 'ri', 'so', 'vu', 'pe', 'da', 'gi', 'ro']
+    vocabulary = [''.join(rng.choice(syllables) for _ in range(rng.randint(1, 4))) for _ in range(2000)]
+    document = fitz.open()
+    for _ in range(pages):
+        lines = []
+        for _ in range(rng.randint(6, 10)):
+            if rng.random() < 0.2:
+                lines.extend(f"- {' '.join(rng.choices(vocabulary, k=rng.randint(4, 10)))}" for _ in range(rng.randint(2, 4)))
+            else:
+                sentences = [' '.join(rng.choices(vocabulary, k=rng.randint(6, 18))).capitalize() + '.' for _ in range(rng.randint(2, 5))]
+                lines.append(' '.join(sentences))
+        page = document.new_page()
+        page.insert_textbox(fitz.Rect(40, 40, 555, 800), '\n'.join(lines), fontsize=8)
+    document.save(path)
+    return path
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+class StageTimer:
+    """Wrap module functions to collect per-call latencies by stage"""
+
+    def __init__(self):
+        self.samples = {}
+
+    def wrap(self, module, name, stage):
+        function = getattr(module, name)
+
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.samples.setdefault(stage, []).append((time.perf_counter() - start) * 1000)
+        setattr(module, name, timed)
+
+    def summary(self):
+        return {
+            stage: {'p50_ms': round(statistics.median(values), 3), 'p99_ms': round(percentile(values, 0.99), 3)}
+            for stage, values in self.samples.items()
+        }
+
+@contextlib.contextmanager
+def quiet(enabled):
+    if not enabled:
+        yield
+        return
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+def ingest(runner, s3, name, pdf_path, client_id, silence):
+    execution = execution_input(s3, BUCKET, pdf_path, client_id)
+    with quiet(silence):
+        result = runner.run(execution)
+    if result['status'] != 'SUCCEEDED':
+        raise RuntimeError(f"Ingest of {name} failed: {result['error']}")
+    output = result['output']
+    if 'storeResult' not in output or output['storeResult'].get('statusCode') != 200:
+        raise RuntimeError(f"Ingest of {name} did not store its embeddings: {output}")
+    store_body = json.loads(output['storeResult']['body'])
+    chunk_count = store_body['chunk_count']
+    stage_seconds = {state: round(entry['seconds'], 3) for state, entry in result['states'].items()}
+    return execution, store_body, {
+        'corpus': name,
+        'pages': fitz.open(pdf_path).page_count,
+        'bytes': os.path.getsize(pdf_path),
+        'chunks': chunk_count,
+        'map_iterations': len(output['splitResult']['slices']),
+        'seconds': round(result['seconds'], 3),
+        'chunks_per_second': round(chunk_count / result['seconds'], 1),
+        # GenerateEmbeddings is summed over Map iterations, so it can exceed MapState wall time
+        'stage_seconds': stage_seconds
+    }
+
+def sample_questions(cur, pdf_id, count, rng):
+    cur.execute("SELECT content FROM pdf_chunks WHERE pdf_id = %s", (pdf_id,))
+    contents = [row[0] for row in cur.fetchall()]
+    questions = []
+    for content in rng.choices(contents, k=count):
+        words = content.split()
+        start = rng.randrange(max(1, len(words) - 8))
+        questions.append('What is said about ' + ' '.join(words[start:start + 8]) + '?')
+    return questions
+
+def query(queryPDF, execution, store_body, questions, is_pdf_chat, silence):
+    timer = StageTimer()
+    timer.wrap(queryPDF, 'get_embedding', 'embed')
+    timer.wrap(queryPDF, 'find_context', 'retrieve')
+    timer.wrap(queryPDF, 'process_user_query', 'complete')
+    session_attributes = {
+        'pdf_id': execution['pdf_id'],
+        'client_id': execution['client_id'],
+        'is_pdf_chat': 'true' if is_pdf_chat else 'false',
+        'processing_complete': 'true',
+        'ingest_version': store_body['ingest_version']
+    }
+    latencies = []
+    failures = 0
+    originals = {name: getattr(queryPDF, name) for name in ('get_embedding', 'find_context', 'process_user_query')}
+    try:
+        with quiet(silence):
+            for question in questions:
+                start = time.perf_counter()
+                response = queryPDF.lambda_handler({'sessionAttributes': dict(session_attributes), 'inputTranscript': question}, None)
+                latencies.append((time.perf_counter() - start) * 1000)
+                failures += response['dialogAction']['fulfillmentState'] != 'Fulfilled'
+    finally:
+        for name, function in originals.items():
+            setattr(queryPDF, name, function)
+    return {
+        'scope': 'single_pdf' if is_pdf_chat else 'all_pdfs',
+        'queries': len(latencies),
+        'failures': failures,
+        'p50_ms': round(statistics.median(latencies), 3),
+        'p99_ms': round(percentile(latencies, 0.99), 3),
+        'mean_ms': round(statistics.fmean(latencies), 3),
+        'stages': timer.summary()
+    }
+
+def compare(previous_path, results):
+    with open(previous_path) as f:
+        previous = json.load(f)
+    print(f"Compared with {previous_path} ({previous['meta'].get('git_revision')}):")
+    before = {row['corpus']: row for row in previous['ingest']}
+    for row in results['ingest']:
+        if row['corpus'] in before:
+            ratio = row['chunks_per_second'] / before[row['corpus']]['chunks_per_second']
+            print(f"  ingest {row['corpus']:>24}  chunks/s x{ratio:.2f}")
+    before = {(row['corpus'], row['scope']): row for row in previous['query']}
+    for row in results['query']:
+        old = before.get((row['corpus'], row['scope']))
+        if old:
+            print(f"  query  {row['corpus']:>24} {row['scope']:>10}  p50 x{row['p50_ms'] / old['p50_ms']:.2f}  p99 x{row['p99_ms'] / old['p99_ms']:.2f}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--synthetic-pages', type=int, nargs='*', default=[50, 200, 1000])
+    parser.add_argument('--no-bundled', action='store_true', help='skip LLMdoc.pdf and deepLearning.pdf')
+    parser.add_argument('--queries', type=int, default=100, help='questions per corpus and scope')
+    parser.add_argument('--concurrency', type=int, default=2, help='Map concurrency for ingestion')
+    parser.add_argument('--embedding-latency', type=float, default=0.05, help='seconds per embedding request')
+    parser.add_argument('--embedding-input-latency', type=float, default=0.001, help='extra seconds per embedded input')
+    parser.add_argument('--completion-latency', type=float, default=0.3, help='seconds per completion request')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--verbose', action='store_true', help='keep handler logging')
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    parser.add_argument('--compare', help='earlier results file to compare against')
+    args = parser.parse_args()
+
+    # Handler modules read these at import time
+    os.environ.setdefault('OPENAI_API_KEY', 'offline')
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+    os.environ['VECTOR_BUCKET'] = BUCKET
+    # The failure report runs on every ingest and only publishes when an embedding batch failed
+    os.environ.setdefault('SNS_TOPIC_ARN', 'arn:aws:sns:us-east-1:123456789012:bench-failures')
+    # Measure the full pipeline, not cache hits
+    os.environ['ANSWER_CACHE_ENABLED'] = 'false'
+
+    from moto import mock_aws
+    import boto3
+
+    embedding_provider = stand_ins.FakeEmbeddingProvider(latency=args.embedding_latency, per_input_latency=args.embedding_input_latency)
+    completion_provider = stand_ins.FakeCompletionProvider(latency=args.completion_latency)
+    lex = stand_ins.FakeLex()
+    rng = random.Random(args.seed)
+    client_id = '00000000-0000-0000-0000-00000000b0b0'
+
+    with mock_aws(), tempfile.TemporaryDirectory() as tmp:
+        stand_ins.install(embedding_provider, completion_provider)
+        from db_connection import connection
+        from db_schema import apply_schema
+        from local_runner import StateMachineRunner, load_definition
+        import queryPDF
+        stand_ins.patch_handlers(embedding_provider, completion_provider, lex)
+
+        s3 = boto3.client('s3')
+        s3.create_bucket(Bucket=BUCKET)
+        with connection() as conn:
+            apply_schema(conn)
+
+        corpora = [] if args.no_bundled else [(os.path.basename(path), path) for path in BUNDLED_PDFS]
+        for pages in args.synthetic_pages:
+            path = synthetic_pdf(os.path.join(tmp, f"synthetic_{pages}.pdf"), pages, args.seed)
+            corpora.append((f"synthetic_{pages}_pages", path))
+
+        runner_factory = lambda: StateMachineRunner(load_definition(), 'thread', args.concurrency, wait_scale=0)
+        results = {
+            'meta': {
+                'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+                'git_revision': git_revision(),
+                'python': platform.python_version(),
+                'settings': vars(args)
+            },
+            'ingest': [],
+            'query': []
+        }
+        for name, path in corpora:
+            execution, store_body, row = ingest(runner_factory(), s3, name, path, client_id, not args.verbose)
+            results['ingest'].append(row)
+            print(f"ingest {name:>24}  {row['pages']:>5} pages  {row['chunks']:>6} chunks  {row['seconds']:8.3f} s  "
+                  f"{row['chunks_per_second']:8.1f} chunks/s")
+            with connection() as conn:
+                with conn.cursor() as cur:
+                    questions = sample_questions(cur, execution['pdf_id'], args.queries, rng)
+            for is_pdf_chat in (True, False):
+                row = dict(corpus=name, **query(queryPDF, execution, store_body, questions, is_pdf_chat, not args.verbose))
+                results['query'].append(row)
+                stages = '  '.join(f"{stage} {values['p50_ms']:.1f}" for stage, values in row['stages'].items())
+                print(f"query  {name:>24} {row['scope']:>10}  p50 {row['p50_ms']:8.3f} ms  p99 {row['p99_ms']:8.3f} ms  ({stages})")
+
+        results['meta']['provider_calls'] = {
+            'embedding_requests': embedding_provider.calls,
+            'embedded_inputs': embedding_provider.inputs,
+            'completions': completion_provider.calls
+        }
+
+    if args.compare:
+        compare(args.compare, results)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+"""Sweep Map concurrency for the ingestion state machine with the local runner and report throughput.
+
+Each level ingests the PDF under a fresh pdf_id, so resumable steps cannot reuse an earlier level's work.
+With --moto, S3 is an in-process stand-in (thread executor only); otherwise the handlers use whatever
+S3 endpoint and DB_* database the environment points at, e.g. AWS_ENDPOINT_URL for a local S3:
+
+    python -m benchmarks.bench_map_concurrency --pdf deepLearning.pdf --concurrency 1 2 4 8 --moto --output sweep.json
+"""
+import argparse
+import contextlib
+import json
+import uuid
+
+import boto3
+
+from local_runner import StateMachineRunner, load_definition
+
+def execution_input(s3, bucket, pdf_path, client_id):
+    # Mirrors the input uploadPDFToS3 hands to the state machine
+    pdf_id = str(uuid.uuid4())
+    unique_dir = f"PDF_Upload/{pdf_id}/"
+    key = f"{unique_dir}{client_id}_{pdf_id}.pdf"
+    s3.upload_file(pdf_path, bucket, key)
+    return {
+        'bucket': bucket,
+        'key': key,
+        'chunks_dir': f"{unique_dir}chunks/",
+        'embeddings_dir': f"{unique_dir}embeddings/",
+        'pdf_id': pdf_id,
+        'client_id': client_id,
+        'is_pdf_chat': True
+    }
+
+def state_seconds(result, name):
+    return round(result['states'].get(name, {}).get('seconds', 0.0), 3)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--pdf', default='deepLearning.pdf')
+    parser.add_argument('--bucket', default='pdfchat-local')
+    parser.add_argument('--client-id', default=str(uuid.UUID(int=0)))
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 2, 4, 8, 16])
+    parser.add_argument('--executor', choices=['thread', 'process'], default='thread')
+    parser.add_argument('--chunks-per-slice', type=int, help='override SplitPDF chunks_per_slice to change the Map width')
+    parser.add_argument('--resource', action='append', default=[], metavar='NAME=MODULE:FUNCTION',
+                        help='replace a Lambda with another handler, e.g. GenerateEmbeddings=my_stub:handler')
+    parser.add_argument('--moto', action='store_true', help='run S3 in-process with moto')
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    args = parser.parse_args()
+    if args.moto and args.executor == 'process':
+        parser.error("--moto keeps S3 in this process; use --executor thread or a local S3 endpoint")
+
+    definition = load_definition()
+    if args.chunks_per_slice:
+        definition['States']['SplitPDF']['Parameters']['chunks_per_slice'] = args.chunks_per_slice
+    resources = dict(resource.split('=', 1) for resource in args.resource)
+
+    if args.moto:
+        from moto import mock_aws
+        mock = mock_aws()
+    else:
+        mock = contextlib.nullcontext()
+    results = []
+    with mock:
+        s3 = boto3.client('s3')
+        if args.moto:
+            s3.create_bucket(Bucket=args.bucket)
+        for concurrency in args.concurrency:
+            runner = StateMachineRunner(definition, args.executor, concurrency, resources, wait_scale=0)
+            result = runner.run(execution_input(s3, args.bucket, args.pdf, args.client_id))
+            output = result['output'] or {}
+            chunk_count = output.get('splitResult', {}).get('chunk_count', 0)
+            row = {
+                'concurrency': concurrency,
+                'executor': args.executor,
+                'status': result['status'],
+                'error': result['error'],
+                'seconds': round(result['seconds'], 3),
+                'chunks': chunk_count,
+                'map_iterations': len(output.get('splitResult', {}).get('slices', [])),
+                'chunks_per_second': round(chunk_count / result['seconds'], 1) if result['seconds'] else None,
+                'split_seconds': state_seconds(result, 'SplitPDF'),
+                'map_seconds': state_seconds(result, 'MapState'),
+                'store_seconds': state_seconds(result, 'StoreEmbeddings'),
+                'retries': sum(entry['retries'] for entry in result['states'].values()),
+                'errors': sum(entry['errors'] for entry in result['states'].values())
+            }
+            print(f"concurrency {concurrency:>3}  {row['status']:>9}  {row['seconds']:8.3f} s  "
+                  f"{row['chunks_per_second'] or 0:8.1f} chunks/s  map {row['map_seconds']:8.3f} s  "
+                  f"retries {row['retries']}  errors {row['errors']}")
+            results.append(row)
+
+    succeeded = [row for row in results if row['status'] == 'SUCCEEDED' and row['chunks_per_second']]
+    if succeeded:
+        # Lowest concurrency within 5% of the best measured throughput
+        best = max(row['chunks_per_second'] for row in succeeded)
+        pick = min((row for row in succeeded if row['chunks_per_second'] >= 0.95 * best), key=lambda row: row['concurrency'])
+        print(f"Suggested MaxConcurrency: {pick['concurrency']} ({pick['chunks_per_second']} chunks/s, best {best})")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == '__main__':
+    main()
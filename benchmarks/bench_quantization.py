@@ -0,0 +1,148 @@
+"""Measure recall, latency and index size of each VECTOR_QUANTIZATION mode on the ingested chunks.
+
+A random sample of pdf_chunks (--rows) is copied into a scratch table, leaving out --queries chunks whose stored
+embeddings serve as held-out queries. Their exact top-k neighbours come from a sequential scan; each mode then gets
+its own index on the scratch table and is scored on recall@k against them, query latency and index size. Quantized
+modes run once per --candidates value, since the re-rank shortlist trades latency for recall:
+
+    python -m benchmarks.bench_quantization --rows 100000 --queries 200 --k 10 --candidates 20 40 100 --output quantization.json
+"""
+import argparse
+import json
+import statistics
+import time
+
+from benchmarks.bench_retrieval import percentile
+from db_connection import connection
+from vector_index import (
+    DISTANCE_METRIC, INDEX_METHOD, TARGET_RECALL, build_index, get_index_definition, ivfflat_lists,
+    nearest_chunks_params, nearest_chunks_sql, search_settings
+)
+
+BENCH_TABLE = 'bench_quantization_chunks'
+BENCH_INDEX = 'bench_quantization_idx'
+
+def prepare(conn, rows, queries):
+    """Create the scratch table and return (row_count, held-out query embeddings)"""
+    with conn.cursor() as cur:
+        cur.execute(f"DROP TABLE IF EXISTS {BENCH_TABLE}")
+        cur.execute("SELECT id, content_embedding::text FROM pdf_chunks ORDER BY random() LIMIT %s", (queries,))
+        held_out = cur.fetchall()
+        # LIMIT NULL copies every remaining row
+        cur.execute(f"""
+            CREATE TABLE {BENCH_TABLE} AS
+            SELECT id, pdf_id, content_embedding
+            FROM pdf_chunks
+            WHERE id <> ALL(%s)
+            ORDER BY random()
+            LIMIT %s
+        """, ([row[0] for row in held_out], rows))
+        cur.execute(f"ANALYZE {BENCH_TABLE}")
+        cur.execute(f"SELECT count(*) FROM {BENCH_TABLE}")
+        row_count = cur.fetchone()[0]
+    conn.commit()
+    return row_count, [embedding for _, embedding in held_out]
+
+def search(conn, queries, k, quantization, candidates, settings):
+    """Return ([set of ids per query], [latency ms per query])"""
+    sql = nearest_chunks_sql(BENCH_TABLE, columns='id', quantization=quantization)
+    results, latencies = [], []
+    with conn.cursor() as cur:
+        for embedding in queries:
+            for setting, value in settings.items():
+                cur.execute(f"SET LOCAL {setting} = {int(value)}")
+            start = time.perf_counter()
+            cur.execute(sql, nearest_chunks_params(embedding, k, quantization=quantization, candidates=candidates))
+            ids = [row[0] for row in cur.fetchall()]
+            latencies.append((time.perf_counter() - start) * 1000)
+            results.append(ids)
+            conn.rollback()
+    return results, latencies
+
+def relation_bytes(conn, name, function='pg_relation_size'):
+    with conn.cursor() as cur:
+        cur.execute(f"SELECT {function}(%s::regclass)", (name,))
+        size = cur.fetchone()[0]
+    conn.commit()
+    return size
+
+def score(name, quantization, candidates, results, latencies, exact, k):
+    return {
+        'mode': name,
+        'quantization': quantization,
+        'candidates': candidates,
+        f'recall_at_{k}': round(statistics.fmean(len(set(ids) & set(truth)) / len(truth) for ids, truth in zip(results, exact) if truth), 4),
+        # Chat keeps the single nearest chunk, so this is the recall that shows up in answers
+        'top1_match': round(statistics.fmean(ids[:1] == truth[:1] for ids, truth in zip(results, exact)), 4),
+        'p50_ms': round(statistics.median(latencies), 3),
+        'p99_ms': round(percentile(latencies, 0.99), 3),
+        'mean_ms': round(statistics.fmean(latencies), 3)
+    }
+
+def report(result):
+    size = f"  index {result['index_bytes'] / 1e6:9.1f} MB" if 'index_bytes' in result else ''
+    recall = next(value for key, value in result.items() if key.startswith('recall_at_'))
+    print(f"{result['mode']:>8}  candidates {result['candidates'] or '-':>4}  recall {recall:.4f}  top1 {result['top1_match']:.4f}  "
+          f"p50 {result['p50_ms']:8.3f} ms  p99 {result['p99_ms']:8.3f} ms{size}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=100000, help='chunks copied into the scratch table (0 for all)')
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--k', type=int, default=10, help='neighbours compared for recall')
+    parser.add_argument('--modes', nargs='+', default=['none', 'halfvec', 'binary'], choices=['none', 'halfvec', 'binary'])
+    parser.add_argument('--candidates', type=int, nargs='+', default=[20, 40, 100], help='re-rank shortlist sizes for quantized modes')
+    parser.add_argument('--method', default=INDEX_METHOD, choices=['hnsw', 'ivfflat'])
+    parser.add_argument('--target-recall', type=float, default=TARGET_RECALL)
+    parser.add_argument('--keep', action='store_true', help='keep the scratch table afterwards')
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    args = parser.parse_args()
+
+    results = []
+    with connection() as conn:
+        row_count, queries = prepare(conn, args.rows or None, args.queries)
+        if not queries or not row_count:
+            raise SystemExit("pdf_chunks needs more rows than --queries, ingest some PDFs first")
+        print(f"{row_count} rows, {len(queries)} held-out queries, {args.method} index, {DISTANCE_METRIC} distance, "
+              f"table {relation_bytes(conn, BENCH_TABLE, 'pg_table_size') / 1e6:.1f} MB")
+
+        # No index yet, so this is an exact sequential scan
+        exact, latencies = search(conn, queries, args.k, 'none', None, {})
+        result = score('exact', 'none', None, exact, latencies, exact, args.k)
+        report(result)
+        results.append(result)
+
+        try:
+            for quantization in args.modes:
+                start = time.perf_counter()
+                build_index(conn, row_count, args.method, DISTANCE_METRIC, BENCH_TABLE, BENCH_INDEX, quantization)
+                build_seconds = time.perf_counter() - start
+                index_bytes = relation_bytes(conn, BENCH_INDEX)
+                with conn.cursor() as cur:
+                    lists = ivfflat_lists(get_index_definition(cur, BENCH_INDEX)) or 1
+                conn.commit()
+                for candidates in ([None] if quantization == 'none' else args.candidates):
+                    settings = search_settings(args.k, args.target_recall, args.method, lists, quantization, candidates or args.k)
+                    ids, latencies = search(conn, queries, args.k, quantization, candidates or args.k, settings)
+                    result = dict(
+                        score(quantization, quantization, candidates, ids, latencies, exact, args.k),
+                        settings=settings,
+                        index_bytes=index_bytes,
+                        index_bytes_per_row=round(index_bytes / row_count, 1),
+                        build_seconds=round(build_seconds, 2)
+                    )
+                    report(result)
+                    results.append(result)
+        finally:
+            with conn.cursor() as cur:
+                cur.execute(f"DROP INDEX IF EXISTS {BENCH_INDEX}")
+                if not args.keep:
+                    cur.execute(f"DROP TABLE IF EXISTS {BENCH_TABLE}")
+            conn.commit()
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == '__main__':
+    main()
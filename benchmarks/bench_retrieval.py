@@ -0,0 +1,74 @@
+"""Compare chat retrieval latency of pure vector search and hybrid (full-text + vector) search.
+
+Queries are sampled from pdf_chunks itself: the stored embedding of a random chunk stands in for the
+query embedding and a few of its words for the query text, so no embedding API calls are made:
+
+    python -m benchmarks.bench_retrieval --queries 200 --output retrieval.json
+"""
+import argparse
+import json
+import statistics
+import time
+
+from psycopg2.extras import DictCursor
+
+from db_connection import connection
+from helper_functions import find_relevant_context
+
+def sample_queries(cur, count):
+    cur.execute("""
+        SELECT pdf_id::text, content, content_embedding::text AS embedding
+        FROM pdf_chunks
+        ORDER BY random()
+        LIMIT %s
+    """, (count,))
+    return [
+        (row['pdf_id'], ' '.join(row['content'].split()[:6]), json.loads(row['embedding']))
+        for row in cur.fetchall()
+    ]
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+def run(cur, mode, queries, per_pdf):
+    latencies = []
+    for pdf_id, text, embedding in queries:
+        pdf_filter = pdf_id if per_pdf else None
+        start = time.perf_counter()
+        find_relevant_context(text, embedding, cur, 'pdf_chunks', pdf_filter, mode=mode)
+        latencies.append((time.perf_counter() - start) * 1000)
+        cur.connection.rollback()
+    return {
+        'mode': mode,
+        'per_pdf': per_pdf,
+        'queries': len(latencies),
+        'p50_ms': round(statistics.median(latencies), 3),
+        'p99_ms': round(percentile(latencies, 0.99), 3),
+        'mean_ms': round(statistics.fmean(latencies), 3)
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    args = parser.parse_args()
+
+    results = []
+    with connection() as conn:
+        with conn.cursor(cursor_factory=DictCursor) as cur:
+            queries = sample_queries(cur, args.queries)
+            if not queries:
+                raise SystemExit("pdf_chunks is empty, ingest some PDFs first")
+            for per_pdf in (False, True):
+                for mode in ('vector', 'hybrid'):
+                    result = run(cur, mode, queries, per_pdf)
+                    print(f"{mode:>7} {'single PDF' if per_pdf else 'all PDFs':>10}  p50 {result['p50_ms']:8.3f} ms  p99 {result['p99_ms']:8.3f} ms")
+                    results.append(result)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == '__main__':
+    main()
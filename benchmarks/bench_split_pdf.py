@@ -0,0 +1,110 @@
+"""Measure SplitPDF wall time and peak RSS per page count, in-memory versus spooled and parallel.
+
+Larger documents are built by repeating the pages of a source PDF. Every run happens in a fresh
+subprocess so its peak RSS is not inflated by earlier runs, and each run's chunks are compared
+against the in-memory sequential baseline:
+
+    python -m benchmarks.bench_split_pdf --pdf deepLearning.pdf --pages 142 500 1000 --workers 1 2 4 --output split.json
+"""
+import argparse
+import hashlib
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import fitz
+
+import SplitPDF
+
+def build_pdf(source, page_count, path):
+    """Write a PDF of page_count pages by repeating the source document"""
+    src = fitz.open(source)
+    document = fitz.open()
+    while document.page_count < page_count:
+        last_page = min(src.page_count, page_count - document.page_count) - 1
+        document.insert_pdf(src, to_page=last_page)
+    document.save(path)
+
+def split_once(path, workers, chunk_size):
+    """Run one split in this process and return timings, peak RSS and a digest of the chunks"""
+    start = time.perf_counter()
+    if workers == 0:
+        # The previous behaviour: whole file in memory, pages read sequentially
+        with open(path, 'rb') as f:
+            document = fitz.open(stream=f.read(), filetype="pdf")
+        segments = SplitPDF.iter_segments(document)
+    else:
+        segments = SplitPDF.iter_pdf_segments(path, workers=workers, min_parallel_pages=1)
+    digest = hashlib.sha256()
+    chunk_count = 0
+    for chunk in SplitPDF.pack_chunks(segments, chunk_size):
+        digest.update(chunk.encode('utf-8') + b'\x00')
+        chunk_count += 1
+    elapsed = time.perf_counter() - start
+    # ru_maxrss is in KiB on Linux; children covers the extraction workers
+    parent_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    child_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return {
+        'wall_seconds': round(elapsed, 3),
+        'peak_rss_mb': round(parent_rss / 1024, 1),
+        'peak_worker_rss_mb': round(child_rss / 1024, 1),
+        'chunk_count': chunk_count,
+        'digest': digest.hexdigest()
+    }
+
+def run_isolated(path, workers, chunk_size):
+    output = subprocess.run(
+        [sys.executable, '-m', 'benchmarks.bench_split_pdf', '--run-one', path, str(workers), str(chunk_size)],
+        check=True, capture_output=True, text=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--pdf', default='deepLearning.pdf')
+    parser.add_argument('--pages', type=int, nargs='+', default=[142, 500, 1000])
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, os.cpu_count() or 1])
+    parser.add_argument('--chunk-size', type=int, default=750)
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    parser.add_argument('--run-one', nargs=3, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_one:
+        path, workers, chunk_size = args.run_one
+        print(json.dumps(split_once(path, int(workers), int(chunk_size))))
+        return
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for page_count in args.pages:
+            path = os.path.join(tmp, f"bench_{page_count}.pdf")
+            build_pdf(args.pdf, page_count, path)
+            baseline = baseline_digest = None
+            # workers=0 is the in-memory sequential baseline
+            for workers in [0] + sorted(set(args.workers)):
+                result = run_isolated(path, workers, args.chunk_size)
+                digest = result.pop('digest')
+                if baseline is None:
+                    baseline, baseline_digest = result, digest
+                result.update(
+                    pages=page_count,
+                    mode='in_memory' if workers == 0 else 'spooled',
+                    workers=workers,
+                    speedup=round(baseline['wall_seconds'] / result['wall_seconds'], 2) if result['wall_seconds'] else None,
+                    matches_baseline=digest == baseline_digest
+                )
+                print(f"{page_count:>6} pages  {result['mode']:>9} x{workers}  {result['wall_seconds']:8.3f} s  "
+                      f"peak RSS {result['peak_rss_mb']:7.1f} MB (workers {result['peak_worker_rss_mb']:7.1f} MB)  "
+                      f"{result['chunk_count']} chunks  {'same' if result['matches_baseline'] else 'DIFFERENT'}")
+                results.append(result)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == '__main__':
+    main()
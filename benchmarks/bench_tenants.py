@@ -0,0 +1,152 @@
+"""Compare single-PDF search on one pdf_chunks table with the client_id hash-partitioned layout as tenants grow.
+
+For each tenant count, both layouts are loaded with the same synthetic chunks into scratch tables and get an
+ANN index. Chunk vectors are drawn around a shared set of topics, so most of a query's global neighbours belong
+to other tenants, like a busy multi-tenant table. Each query asks for the k nearest chunks of one PDF. The
+partitioned layout also carries the tenant key. Recall@k is scored against an exact search over that PDF's
+vectors in NumPy:
+
+    python -m benchmarks.bench_tenants --tenants 10 50 250 --pdfs-per-tenant 2 --chunks-per-pdf 100 --output tenants.json
+"""
+import argparse
+import json
+import statistics
+import time
+import uuid
+
+import numpy as np
+
+from benchmarks.bench_retrieval import percentile
+from chunk_partitions import PARTITION_COUNT, partitions_sql, table_sql
+from db_connection import connection
+from pg_copy import copy_rows
+from vector_index import (
+    DIMENSIONS, INDEX_METHOD, TARGET_RECALL, _plan_nodes, build_index, get_index_definition, ivfflat_lists,
+    nearest_chunks_params, nearest_chunks_sql, search_settings
+)
+
+BENCH_TABLE = 'bench_tenant_chunks'
+LAYOUTS = ('single', 'hash')
+
+def synthetic_corpus(tenants, pdfs_per_tenant, chunks_per_pdf, topics, seed):
+    """Return (topic centres, {(client_id, pdf_id): unit vectors})"""
+    rng = np.random.default_rng(seed)
+    centres = rng.standard_normal((topics, DIMENSIONS)).astype('<f4')
+    corpus = {}
+    for _ in range(tenants):
+        client_id = str(uuid.UUID(int=int(rng.integers(0, 2 ** 63)) << 64 | int(rng.integers(0, 2 ** 63))))
+        for _ in range(pdfs_per_tenant):
+            pdf_id = str(uuid.uuid4())
+            vectors = centres[rng.integers(0, topics, chunks_per_pdf)] + 0.5 * rng.standard_normal((chunks_per_pdf, DIMENSIONS)).astype('<f4')
+            corpus[(client_id, pdf_id)] = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    return centres, corpus
+
+def create_table(conn, layout, partitions):
+    table = f"{BENCH_TABLE}_{layout}"
+    with conn.cursor() as cur:
+        cur.execute(f"DROP TABLE IF EXISTS {table}")
+        cur.execute(table_sql(table, partitioned=layout == 'hash'))
+        if layout == 'hash':
+            cur.execute(partitions_sql(table, partitions))
+    conn.commit()
+    return table
+
+def load(conn, table, corpus):
+    rows = (
+        (pdf_id, index, 'bench', f"chunk {index}", vector, client_id, True, None, None)
+        for (client_id, pdf_id), vectors in corpus.items()
+        for index, vector in enumerate(vectors)
+    )
+    with conn.cursor() as cur:
+        row_count = copy_rows(cur, rows, table=table)
+        cur.execute(f"ANALYZE {table}")
+    conn.commit()
+    return row_count
+
+def run_queries(conn, table, layout, queries, k, settings):
+    sql = nearest_chunks_sql(table, 'pdf_id', columns='chunk_index', quantization='none', by_tenant=layout == 'hash')
+    recalls, latencies = [], []
+    with conn.cursor() as cur:
+        for client_id, pdf_id, vector, truth in queries:
+            for setting, value in settings.items():
+                cur.execute(f"SET LOCAL {setting} = {int(value)}")
+            params = nearest_chunks_params('[' + ','.join(map(str, vector.tolist())) + ']', k, pdf_id, 'none', client_id=client_id)
+            start = time.perf_counter()
+            cur.execute(sql, params)
+            found = {row[0] for row in cur.fetchall()}
+            latencies.append((time.perf_counter() - start) * 1000)
+            recalls.append(len(found & truth) / len(truth))
+            conn.rollback()
+        # How many partitions (or tables) the planner left in for one of the queries
+        cur.execute("EXPLAIN (FORMAT JSON) " + sql, params)
+        plan = cur.fetchone()[0][0]['Plan']
+        scanned = len({node['Relation Name'] for node in _plan_nodes(plan) if node.get('Relation Name')})
+        conn.rollback()
+    return recalls, latencies, scanned
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--tenants', type=int, nargs='+', default=[10, 50, 250])
+    parser.add_argument('--pdfs-per-tenant', type=int, default=2)
+    parser.add_argument('--chunks-per-pdf', type=int, default=100)
+    parser.add_argument('--topics', type=int, default=32, help='shared topics the chunk vectors cluster around')
+    parser.add_argument('--partitions', type=int, default=PARTITION_COUNT)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--k', type=int, default=5)
+    parser.add_argument('--method', default=INDEX_METHOD, choices=['hnsw', 'ivfflat'])
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    args = parser.parse_args()
+
+    results = []
+    rng = np.random.default_rng(args.seed + 1)
+    with connection() as conn:
+        for tenants in args.tenants:
+            centres, corpus = synthetic_corpus(tenants, args.pdfs_per_tenant, args.chunks_per_pdf, args.topics, args.seed)
+            keys = list(corpus)
+            queries = []
+            for _ in range(args.queries):
+                client_id, pdf_id = keys[rng.integers(len(keys))]
+                vector = centres[rng.integers(args.topics)] + 0.5 * rng.standard_normal(DIMENSIONS).astype('<f4')
+                vector /= np.linalg.norm(vector)
+                # Exact cosine neighbours within the PDF
+                truth = set(np.argsort(-(corpus[(client_id, pdf_id)] @ vector))[:args.k].tolist())
+                queries.append((client_id, pdf_id, vector, truth))
+
+            for layout in LAYOUTS:
+                table = create_table(conn, layout, args.partitions)
+                try:
+                    row_count = load(conn, table, corpus)
+                    partitions = args.partitions if layout == 'hash' else 1
+                    start = time.perf_counter()
+                    build_index(conn, max(row_count // partitions, 1), args.method, table=table, index_name=f"{table}_embedding_idx", quantization='none')
+                    build_seconds = time.perf_counter() - start
+                    with conn.cursor() as cur:
+                        lists = ivfflat_lists(get_index_definition(cur, f"{table}_embedding_idx")) or 1
+                    conn.commit()
+                    settings = search_settings(args.k, TARGET_RECALL, args.method, lists, 'none')
+                    recalls, latencies, scanned = run_queries(conn, table, layout, queries, args.k, settings)
+                finally:
+                    with conn.cursor() as cur:
+                        cur.execute(f"DROP TABLE IF EXISTS {table}")
+                    conn.commit()
+                result = {
+                    'layout': layout,
+                    'tenants': tenants,
+                    'rows': row_count,
+                    'relations_scanned': scanned,
+                    f'recall_at_{args.k}': round(statistics.fmean(recalls), 4),
+                    'p50_ms': round(statistics.median(latencies), 3),
+                    'p99_ms': round(percentile(latencies, 0.99), 3),
+                    'build_seconds': round(build_seconds, 2)
+                }
+                print(f"{tenants:>6} tenants  {layout:>6}  {row_count:>8} rows  scans {scanned:>3}  recall {statistics.fmean(recalls):.4f}  "
+                      f"p50 {result['p50_ms']:8.3f} ms  p99 {result['p99_ms']:8.3f} ms")
+                results.append(result)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == '__main__':
+    main()
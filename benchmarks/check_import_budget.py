@@ -0,0 +1,90 @@
+"""Fail when importing a Lambda module exceeds its cold-start budget or eagerly loads heavy dependencies.
+
+Each run imports the module in a fresh interpreter with -X importtime and the median over --runs is
+compared with the budget. Modules in --forbid must not be loaded by the import at all, since the
+query path loads them on first use. Exits non-zero on any failure, so it can gate a build:
+
+    python -m benchmarks.check_import_budget
+    python -m benchmarks.check_import_budget --module queryPDF --budget-ms 150 --runs 7 --output imports.json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Loaded lazily by the query path; importing any of them eagerly is a cold-start regression
+HEAVY_MODULES = ['langchain', 'openai', 'boto3', 'botocore', 'psycopg2', 'numpy', 'asyncpg', 'tiktoken']
+
+def parse_importtime(stderr):
+    """Return [(name, self_us, cumulative_us, depth)] from -X importtime output"""
+    entries = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        # One space after the bar, then two per nesting level
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        entries.append((name.strip(), int(self_us), int(cumulative_us), depth))
+    return entries
+
+def measure(module):
+    code = f"import json, sys; import {module}; print(json.dumps(sorted(sys.modules)))"
+    env = dict(os.environ, PYTHONPATH=REPO_ROOT + os.pathsep + os.environ.get('PYTHONPATH', ''))
+    # Handler modules read configuration at import time; none of these reach a network
+    env.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+    env.setdefault('SNS_TOPIC_ARN', 'arn:aws:sns:us-east-1:000000000000:import-budget')
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', code],
+        cwd=REPO_ROOT, env=env, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{result.stderr[-2000:]}")
+    entries = parse_importtime(result.stderr)
+    total = next(cumulative for name, _, cumulative, depth in entries if name == module and depth == 0)
+    return total / 1000, entries, json.loads(result.stdout.strip().splitlines()[-1])
+
+def check(module, budget_ms, runs, forbid, top):
+    timings = []
+    for _ in range(runs):
+        milliseconds, entries, loaded = measure(module)
+        timings.append(milliseconds)
+    median_ms = statistics.median(timings)
+    eager = sorted({name.split('.')[0] for name in loaded} & set(forbid))
+    slowest = sorted(entries, key=lambda entry: -entry[1])[:top]
+    result = {
+        'module': module,
+        'median_ms': round(median_ms, 1),
+        'budget_ms': budget_ms,
+        'runs_ms': [round(value, 1) for value in timings],
+        'eager_heavy_modules': eager,
+        'slowest_self_ms': [(name, round(self_us / 1000, 2)) for name, self_us, _, _ in slowest],
+        'passed': median_ms <= budget_ms and not eager
+    }
+    status = 'ok' if result['passed'] else 'FAIL'
+    print(f"{status:>4}  import {module}: median {median_ms:.1f} ms (budget {budget_ms:.0f} ms)"
+          + (f", eagerly loads {', '.join(eager)}" if eager else ''))
+    for name, self_ms in result['slowest_self_ms']:
+        print(f"        {self_ms:8.2f} ms  {name}")
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--module', nargs='+', default=['queryPDF'])
+    parser.add_argument('--budget-ms', type=float, default=float(os.getenv('IMPORT_BUDGET_MS', 150)))
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--forbid', nargs='*', default=HEAVY_MODULES, help='top-level modules the import must not load')
+    parser.add_argument('--top', type=int, default=8, help='slowest imports to list')
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    args = parser.parse_args()
+
+    results = [check(module, args.budget_ms, args.runs, args.forbid, args.top) for module in args.module]
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    sys.exit(0 if all(result['passed'] for result in results) else 1)
+
+if __name__ == '__main__':
+    main()
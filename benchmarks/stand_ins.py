@@ -0,0 +1,94 @@
+"""Deterministic offline stand-ins for the embedding, completion and Lex APIs used by the handlers.
+
+Embeddings are feature-hashed bags of words, so texts that share words get similar vectors and retrieval
+behaves plausibly. Every call sleeps for a configurable base latency plus a per-input latency.
+"""
+import re
+import time
+import types
+import zlib
+
+import numpy as np
+
+_WORD = re.compile(r"\w+")
+
+class FakeEmbeddingProvider:
+    def __init__(self, dimensions=1024, latency=0.0, per_input_latency=0.0):
+        self.dimensions = dimensions
+        self.latency = latency
+        self.per_input_latency = per_input_latency
+        self.calls = 0
+        self.inputs = 0
+
+    def embed(self, texts):
+        self.calls += 1
+        self.inputs += len(texts)
+        time.sleep(self.latency + self.per_input_latency * len(texts))
+        vectors = []
+        for text in texts:
+            vector = np.zeros(self.dimensions, dtype=np.float32)
+            for word in _WORD.findall(text.lower()):
+                digest = zlib.crc32(word.encode('utf-8'))
+                vector[digest % self.dimensions] += 1.0 if digest & 0x80000000 else -1.0
+            norm = np.linalg.norm(vector)
+            vector = vector / norm if norm else np.full(self.dimensions, self.dimensions ** -0.5, dtype=np.float32)
+            vectors.append(vector.tolist())
+        return vectors
+
+    # openai.Embedding.create, as called by GenerateEmbeddings
+    def create(self, input, model=None, dimensions=None, **kwargs):
+        texts = input if isinstance(input, list) else [input]
+        return {'data': [{'index': index, 'embedding': vector} for index, vector in enumerate(self.embed(texts))]}
+
+class _FakeEmbeddings:
+    """client.embeddings of the OpenAI SDK client, as called by helper_functions"""
+
+    def __init__(self, provider):
+        self.provider = provider
+
+    def create(self, input, model=None, dimensions=None, **kwargs):
+        texts = input if isinstance(input, list) else [input]
+        data = [types.SimpleNamespace(index=index, embedding=vector) for index, vector in enumerate(self.provider.embed(texts))]
+        return types.SimpleNamespace(data=data)
+
+class FakeCompletionProvider:
+    """openai.completions.create returning the first words of the prompt's context"""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = 0
+
+    def create(self, model=None, prompt='', **kwargs):
+        self.calls += 1
+        time.sleep(self.latency)
+        context = prompt.split('Context:', 1)[-1].split('Answer:', 1)[0]
+        text = '• ' + ' '.join(context.split()[:40])
+        return types.SimpleNamespace(choices=[types.SimpleNamespace(text=text)])
+
+class FakeLex:
+    def __init__(self):
+        self.calls = 0
+
+    def post_text(self, **kwargs):
+        self.calls += 1
+        return {'message': 'ok'}
+
+def install(embedding_provider, completion_provider):
+    """Replace the module-level openai entry points GenerateEmbeddings calls at request time"""
+    import openai
+    openai.Embedding = embedding_provider
+    openai.completions = completion_provider
+    return openai
+
+class FakeOpenAIClient:
+    """Stands in for the openai.OpenAI client that helper_functions creates lazily"""
+
+    def __init__(self, embedding_provider, completion_provider):
+        self.embeddings = _FakeEmbeddings(embedding_provider)
+        self.completions = completion_provider
+
+def patch_handlers(embedding_provider, completion_provider, lex):
+    import helper_functions
+    import StoreEmbeddings
+    helper_functions._openai_client = FakeOpenAIClient(embedding_provider, completion_provider)
+    StoreEmbeddings.lex_client = lex
@@ -0,0 +1,254 @@
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+import psycopg2
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+import SplitPDF
+import pdf_registry
+import vector_index
+from GenerateEmbeddings import embed_batch, pack_batches
+from chunk_partitions import tenant_key
+from db_connection import connection
+from pg_copy import upsert_rows
+
+# Backfills local PDFs without the upload Lambda or Step Functions: SplitPDF's chunking runs in a process
+# pool, embeddings go out in token-budgeted batches with a bounded number in flight, and each PDF is written
+# with one COPY. Finished PDFs are marked ready in pdf_documents, so re-running after a crash skips them.
+SPLIT_WORKERS = int(os.getenv('BULK_SPLIT_WORKERS', os.cpu_count() or 1))
+EMBED_CONCURRENCY = int(os.getenv('BULK_EMBED_CONCURRENCY', 8))
+# PDFs claimed but not yet stored; bounds memory when splitting runs ahead of embedding
+MAX_PENDING_DOCUMENTS = int(os.getenv('BULK_MAX_PENDING', 32))
+REPORT_INTERVAL = float(os.getenv('BULK_REPORT_INTERVAL', 10))
+
+def read_manifest(path, client_id=None):
+    """One PDF path per line, optionally followed by a tab and its client_id; paths are relative to the manifest"""
+    base = os.path.dirname(os.path.abspath(path))
+    documents = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            pdf_path, _, line_client_id = line.partition('\t')
+            documents.append((os.path.join(base, pdf_path), line_client_id.strip() or client_id))
+    return documents
+
+def find_documents(source, client_id=None):
+    """(pdf_path, client_id) for every PDF under a directory, or every entry of a manifest file"""
+    if not os.path.isdir(source):
+        return read_manifest(source, client_id)
+    documents = []
+    for root, directories, names in os.walk(source):
+        directories.sort()
+        documents.extend((os.path.join(root, name), client_id) for name in sorted(names) if name.lower().endswith('.pdf'))
+    return documents
+
+def split_document(pdf_path, chunker, chunk_tokens, chunk_overlap_tokens, chunk_size):
+    """Runs in a worker process: SplitPDF's chunks as (chunk_index, text, page_start, page_end)"""
+    # The pool already uses every core, so each PDF is extracted in its worker rather than forking more
+    chunks = SplitPDF.iter_chunks(pdf_path, chunker, chunk_tokens, chunk_overlap_tokens, chunk_size, workers=1)
+    # Numbered and stripped exactly as the SplitPDF Lambda writes its manifest, before anything is skipped
+    return [(chunk_index, text.strip(), page_start, page_end) for chunk_index, (text, page_start, page_end) in enumerate(chunks)]
+
+class Progress:
+    """Counts stored PDFs and chunks and prints throughput every REPORT_INTERVAL seconds"""
+
+    def __init__(self, total, interval=REPORT_INTERVAL):
+        self.total = total
+        self.interval = interval
+        self.started = time.perf_counter()
+        self.last_printed = self.started
+        self.documents = 0
+        self.chunks = 0
+        self.skipped = 0
+        self.failed = {}
+
+    def stored(self, chunk_count):
+        self.documents += 1
+        self.chunks += chunk_count
+        self.maybe_print()
+
+    def skip(self):
+        self.skipped += 1
+        self.maybe_print()
+
+    def fail(self, pdf_path, error):
+        self.failed[pdf_path] = repr(error)
+        self.maybe_print()
+
+    def report(self):
+        seconds = time.perf_counter() - self.started
+        return {
+            'total': self.total,
+            'stored': self.documents,
+            'skipped': self.skipped,
+            'failed': len(self.failed),
+            'chunks': self.chunks,
+            'seconds': round(seconds, 1),
+            'docs_per_second': round(self.documents / seconds, 2) if seconds else 0.0,
+            'chunks_per_second': round(self.chunks / seconds, 1) if seconds else 0.0
+        }
+
+    def print(self):
+        report = self.report()
+        done = report['stored'] + report['skipped'] + report['failed']
+        print(f"{done}/{self.total} PDFs  {report['docs_per_second']:7.2f} docs/s  {report['chunks_per_second']:8.1f} chunks/s  "
+              f"({report['skipped']} skipped, {report['failed']} failed, {report['seconds']:.0f} s)")
+        self.last_printed = time.perf_counter()
+
+    def maybe_print(self):
+        if time.perf_counter() - self.last_printed >= self.interval:
+            self.print()
+
+class BulkIngest:
+    """Split, embed and store PDFs as a pipeline: while one PDF is written, later ones are split and embedded"""
+
+    def __init__(self, split_workers=SPLIT_WORKERS, embed_concurrency=EMBED_CONCURRENCY, max_pending=MAX_PENDING_DOCUMENTS,
+                 chunker=SplitPDF.CHUNKER, chunk_tokens=SplitPDF.CHUNK_TOKENS, chunk_overlap_tokens=SplitPDF.CHUNK_OVERLAP_TOKENS,
+                 chunk_size=750, lease_seconds=pdf_registry.INGEST_LEASE_SECONDS, binary=True):
+        self.split_workers = split_workers
+        self.embed_concurrency = embed_concurrency
+        self.max_pending = max(1, max_pending)
+        self.split_options = (chunker, chunk_tokens, chunk_overlap_tokens, chunk_size)
+        self.lease_seconds = lease_seconds
+        self.binary = binary
+        self.progress = None
+
+    def claim(self, conn, pdf_path, client_id):
+        """Register the PDF; returns None when it is already ingested or another run holds it"""
+        with open(pdf_path, 'rb') as f:
+            content_hash = pdf_registry.stream_sha256(iter(lambda: f.read(pdf_registry.HASH_BLOCK_BYTES), b''))
+        pdf_id = pdf_registry.content_pdf_id(client_id, content_hash)
+        claim = pdf_registry.claim_ingest(conn, pdf_id, client_id, content_hash, self.lease_seconds)
+        if claim['status'] != pdf_registry.STARTED:
+            self.progress.skip()
+            return None
+        return {'path': pdf_path, 'client_id': client_id, 'pdf_id': pdf_id}
+
+    def start_embedding(self, embed_pool, document):
+        try:
+            chunks = document['split'].result()
+        except Exception as e:
+            document['error'] = e
+            document['embeddings'] = []
+            return
+        document['chunk_count'] = len(chunks)
+        # Empty chunks keep their index but are not embedded, since the embedding request rejects empty input
+        document['chunks'] = [chunk for chunk in chunks if chunk[1]]
+        texts = [text for _, text, _, _ in document['chunks']]
+        # Batches are consecutive runs of chunks, so their results concatenate back into chunk order
+        document['embeddings'] = [embed_pool.submit(embed_batch, [texts[index] for index in batch]) for batch in pack_batches(texts)]
+
+    def store(self, conn, document):
+        pdf_id = document['pdf_id']
+        client_id = document['client_id']
+        try:
+            if 'error' in document:
+                raise document['error']
+            embeddings = [embedding for future in document['embeddings'] for embedding in future.result()]
+            # Null bytes are stripped as StoreEmbeddings does
+            rows = [
+                (pdf_id, chunk_index, document['path'], text.replace('\x00', ''), embedding, tenant_key(client_id), True, page_start, page_end)
+                for (chunk_index, text, page_start, page_end), embedding in zip(document['chunks'], embeddings)
+            ]
+            with conn.cursor() as cur:
+                if rows:
+                    upsert_rows(cur, rows, binary=self.binary)
+                # Drop chunks beyond the new end left by an earlier ingest with a different chunk size
+                cur.execute(
+                    "DELETE FROM pdf_chunks WHERE client_id = %s AND pdf_id = %s AND chunk_index >= %s",
+                    (tenant_key(client_id), pdf_id, document['chunk_count'])
+                )
+                pdf_registry.mark_ready(cur, pdf_id, client_id, document['chunk_count'], str(int(time.time() * 1000)))
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            print(f"Failed to ingest {document['path']}: {e!r}")
+            # Release the claim, so re-running the CLI retries this PDF straight away
+            try:
+                with conn.cursor() as cur:
+                    pdf_registry.mark_failed(cur, pdf_id)
+                conn.commit()
+            except psycopg2.Error as mark_error:
+                conn.rollback()
+                print(f"Could not mark PDF {pdf_id} failed: {mark_error}")
+            self.progress.fail(document['path'], e)
+            return
+        self.progress.stored(len(rows))
+
+    def advance(self, conn, embed_pool, pending, max_pending):
+        """Start embedding every split PDF and store finished ones in order until fewer than max_pending remain"""
+        while pending:
+            for document in pending:
+                if 'embeddings' not in document and document['split'].done():
+                    self.start_embedding(embed_pool, document)
+            head = pending[0]
+            if 'embeddings' in head and all(future.done() for future in head['embeddings']):
+                self.store(conn, pending.popleft())
+                continue
+            if len(pending) < max_pending:
+                return
+            waiting = [
+                future for document in pending
+                for future in (document['embeddings'] if 'embeddings' in document else [document['split']])
+                if not future.done()
+            ]
+            wait(waiting, return_when=FIRST_COMPLETED)
+
+    def run(self, documents):
+        """Ingest [(pdf_path, client_id)] and return the throughput report"""
+        self.progress = Progress(len(documents))
+        pending = deque()
+        # Workers start fresh rather than forking a process that runs embedding threads and holds a DB connection
+        split_context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(self.split_workers, mp_context=split_context) as split_pool, \
+                ThreadPoolExecutor(self.embed_concurrency) as embed_pool, connection() as conn:
+            for pdf_path, client_id in documents:
+                document = self.claim(conn, pdf_path, client_id)
+                if document is not None:
+                    document['split'] = split_pool.submit(split_document, pdf_path, *self.split_options)
+                    pending.append(document)
+                self.advance(conn, embed_pool, pending, self.max_pending)
+            self.advance(conn, embed_pool, pending, 1)
+            # One index build after the backfill instead of one check per PDF
+            if vector_index.AUTO_BUILD and self.progress.documents:
+                vector_index.ensure_index(conn)
+        self.progress.print()
+        return dict(self.progress.report(), failures=self.progress.failed)
+
+if __name__ == '__main__':
+    # python bulk_ingest.py <directory | manifest> [--client-id ID] [--split-workers N] [--embed-concurrency N]
+    parser = argparse.ArgumentParser(description='Ingest local PDFs straight into pdf_chunks')
+    parser.add_argument('source', help='directory searched for *.pdf, or a manifest with one path[<TAB>client_id] per line')
+    parser.add_argument('--client-id', help='client_id for PDFs whose manifest line has none')
+    parser.add_argument('--split-workers', type=int, default=SPLIT_WORKERS)
+    parser.add_argument('--embed-concurrency', type=int, default=EMBED_CONCURRENCY, help='embedding requests in flight')
+    parser.add_argument('--max-pending', type=int, default=MAX_PENDING_DOCUMENTS, help='PDFs split or embedding but not yet stored')
+    parser.add_argument('--chunker', choices=['tokens', 'characters'], default=SplitPDF.CHUNKER)
+    parser.add_argument('--lease-seconds', type=int, default=pdf_registry.INGEST_LEASE_SECONDS,
+                        help='retry PDFs a crashed run left unfinished this long ago; 0 retries them at once')
+    parser.add_argument('--copy-format', choices=['binary', 'text'], default=os.getenv('COPY_FORMAT', 'binary'))
+    parser.add_argument('--output', help='write the final report as JSON to this file')
+    args = parser.parse_args()
+
+    documents = find_documents(args.source, args.client_id)
+    missing = [pdf_path for pdf_path, client_id in documents if not client_id]
+    if missing:
+        sys.exit(f"No client_id for {len(missing)} PDFs, e.g. {missing[0]}; pass --client-id")
+    report = BulkIngest(
+        split_workers=args.split_workers,
+        embed_concurrency=args.embed_concurrency,
+        max_pending=args.max_pending,
+        chunker=args.chunker,
+        lease_seconds=args.lease_seconds,
+        binary=args.copy_format == 'binary'
+    ).run(documents)
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    sys.exit(1 if report['failed'] else 0)
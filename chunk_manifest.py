@@ -0,0 +1,59 @@
+import json
+import tempfile
+
+# Chunks held in memory before the manifest spools to local disk
+SPOOL_MAX_BYTES = 8 * 1024 * 1024
+
+class ManifestWriter:
+    """Streams chunk records into one newline-delimited JSON object and tracks their byte offsets"""
+
+    def __init__(self):
+        self._file = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES)
+        self._offsets = []
+        self._size = 0
+
+    def __len__(self):
+        return len(self._offsets)
+
+    def add(self, record):
+        line = (json.dumps(record) + "\n").encode('utf-8')
+        self._file.write(line)
+        self._offsets.append((self._size, self._size + len(line)))
+        self._size += len(line)
+
+    def slices(self, chunks_per_slice):
+        """Split the manifest into contiguous slices with inclusive byte ranges for ranged GETs"""
+        slices = []
+        for first in range(0, len(self._offsets), chunks_per_slice):
+            last = min(first + chunks_per_slice, len(self._offsets)) - 1
+            slices.append({
+                'first_chunk': first,
+                'chunk_count': last - first + 1,
+                'byte_start': self._offsets[first][0],
+                'byte_end': self._offsets[last][1] - 1
+            })
+        return slices
+
+    def upload(self, s3, bucket, key):
+        self._file.seek(0)
+        s3.upload_fileobj(self._file, bucket, key)
+        return self._size
+
+    def close(self):
+        self._file.close()
+
+def index_key(manifest_key):
+    return f"{manifest_key}.index.json"
+
+def write_index(s3, bucket, manifest_key, slices):
+    s3.put_object(
+        Bucket=bucket,
+        Key=index_key(manifest_key),
+        Body=json.dumps({'manifest_key': manifest_key, 'slices': slices})
+    )
+
+def read_slice(s3, bucket, manifest_key, byte_start, byte_end):
+    """Fetch just one slice of the manifest with a byte-range GET"""
+    response = s3.get_object(Bucket=bucket, Key=manifest_key, Range=f"bytes={byte_start}-{byte_end}")
+    body = response['Body'].read()
+    return [json.loads(line) for line in body.splitlines() if line.strip()]
@@ -0,0 +1,184 @@
+import os
+import sys
+
+# pdf_chunks is hash partitioned on client_id so a tenant's chat queries touch one partition and its indexes
+PARTITION_COUNT = int(os.getenv('PDF_CHUNK_PARTITIONS', 16))
+MIGRATION_BATCH_ROWS = int(os.getenv('PDF_CHUNK_MIGRATION_BATCH', 5000))
+# client_id is part of the partition and conflict keys, so chunks without a client are stored under this id
+NO_CLIENT_ID = '00000000-0000-0000-0000-000000000000'
+# Unique key of a chunk; it has to include client_id to be enforceable on a partitioned table
+CHUNK_KEY_COLUMNS = ('pdf_id', 'chunk_index', 'client_id')
+
+# Online migration of an existing unpartitioned pdf_chunks: the copy is built next to it, kept in sync by a trigger
+NEW_TABLE = 'pdf_chunks_partitioned'
+OLD_TABLE = 'pdf_chunks_unpartitioned'
+SYNC_TRIGGER = 'pdf_chunks_partition_sync'
+COPY_COLUMNS = ('id', 'pdf_id', 'chunk_index', 'file_path', 'content', 'content_embedding', 'client_id', 'is_pdf_chat', 'page_start', 'page_end')
+
+def tenant_key(client_id):
+    return client_id or NO_CLIENT_ID
+
+def partition_name(table, remainder):
+    return f"{table}_p{remainder:02d}"
+
+def table_sql(table, id_default="SERIAL", partitioned=True):
+    """Partitioned pdf_chunks; the primary key leads with id so id lookups still use it across partitions"""
+    return f"""
+        CREATE TABLE IF NOT EXISTS {table} (
+            id {id_default},
+            pdf_id UUID NOT NULL,
+            chunk_index INT NOT NULL,
+            file_path TEXT,
+            content TEXT,
+            content_embedding VECTOR(1024),
+            client_id UUID NOT NULL,
+            is_pdf_chat BOOLEAN,
+            page_start INT,
+            page_end INT,
+            content_tsv TSVECTOR GENERATED ALWAYS AS (to_tsvector('english', coalesce(content, ''))) STORED,
+            PRIMARY KEY (id, client_id)
+        ){" PARTITION BY HASH (client_id)" if partitioned else ""};
+    """
+
+def partitions_sql(table, partitions=PARTITION_COUNT):
+    """Create any missing hash partitions, but only if table is partitioned (older installs are not)"""
+    statements = ''.join(
+        f"CREATE TABLE IF NOT EXISTS {partition_name(table, remainder)} PARTITION OF {table} "
+        f"FOR VALUES WITH (MODULUS {partitions}, REMAINDER {remainder});\n"
+        for remainder in range(partitions)
+    )
+    return f"""
+        DO $$
+        BEGIN
+            IF (SELECT relkind FROM pg_class WHERE oid = '{table}'::regclass) = 'p' THEN
+                {statements}
+            END IF;
+        END $$;
+    """
+
+def is_partitioned(cur, table='pdf_chunks'):
+    cur.execute("SELECT relkind = 'p' FROM pg_class WHERE oid = to_regclass(%s)", (table,))
+    row = cur.fetchone()
+    return bool(row and row[0])
+
+def partition_count(cur, table='pdf_chunks'):
+    cur.execute("SELECT count(*) FROM pg_inherits WHERE inhparent = to_regclass(%s)", (table,))
+    return cur.fetchone()[0]
+
+def _progress(cur):
+    cur.execute("SELECT last_id, target_id FROM pdf_chunks_partition_migration")
+    return cur.fetchone()
+
+def create(conn, partitions=PARTITION_COUNT):
+    """Step 1: create the partitioned copy and the trigger that mirrors every later write into it"""
+    column_list = ', '.join(COPY_COLUMNS)
+    new_values = ', '.join(f"NEW.{column}" if column != 'client_id' else f"coalesce(NEW.client_id, '{NO_CLIENT_ID}')" for column in COPY_COLUMNS)
+    updates = ', '.join(f"{column} = EXCLUDED.{column}" for column in COPY_COLUMNS if column not in CHUNK_KEY_COLUMNS)
+    key_list = ', '.join(CHUNK_KEY_COLUMNS)
+    with conn.cursor() as cur:
+        if is_partitioned(cur):
+            raise RuntimeError("pdf_chunks is already partitioned")
+        # Shares pdf_chunks_id_seq, so ids stay unique and hybrid search keeps joining on them
+        cur.execute(table_sql(NEW_TABLE, "INT NOT NULL DEFAULT nextval('pdf_chunks_id_seq')"))
+        cur.execute(partitions_sql(NEW_TABLE, partitions))
+        cur.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS {NEW_TABLE}_chunk_key ON {NEW_TABLE} ({key_list})")
+        cur.execute(f"CREATE INDEX IF NOT EXISTS {NEW_TABLE}_content_tsv_idx ON {NEW_TABLE} USING gin (content_tsv)")
+        cur.execute(f"""
+            CREATE OR REPLACE FUNCTION {SYNC_TRIGGER}() RETURNS trigger AS $$
+            BEGIN
+                IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                    DELETE FROM {NEW_TABLE}
+                    WHERE pdf_id = OLD.pdf_id AND chunk_index = OLD.chunk_index
+                        AND client_id = coalesce(OLD.client_id, '{NO_CLIENT_ID}');
+                END IF;
+                IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                    INSERT INTO {NEW_TABLE} ({column_list}) VALUES ({new_values})
+                    ON CONFLICT ({key_list}) DO UPDATE SET {updates};
+                END IF;
+                RETURN NULL;
+            END $$ LANGUAGE plpgsql;
+        """)
+        cur.execute(f"DROP TRIGGER IF EXISTS {SYNC_TRIGGER} ON pdf_chunks")
+        cur.execute(f"CREATE TRIGGER {SYNC_TRIGGER} AFTER INSERT OR UPDATE OR DELETE ON pdf_chunks FOR EACH ROW EXECUTE FUNCTION {SYNC_TRIGGER}()")
+        # Rows up to target_id predate the trigger and are copied by backfill; later ones arrive through it
+        cur.execute("CREATE TABLE IF NOT EXISTS pdf_chunks_partition_migration (last_id BIGINT NOT NULL, target_id BIGINT NOT NULL)")
+        cur.execute("DELETE FROM pdf_chunks_partition_migration")
+        cur.execute("INSERT INTO pdf_chunks_partition_migration SELECT 0, coalesce(max(id), 0) FROM pdf_chunks")
+    conn.commit()
+    print(f"Created {NEW_TABLE} with {partitions} partitions and the sync trigger")
+
+def backfill(conn, batch_rows=MIGRATION_BATCH_ROWS):
+    """Step 2: copy the rows that predate the trigger, one committed id range at a time; safe to re-run"""
+    column_list = ', '.join(COPY_COLUMNS)
+    select_list = ', '.join(column if column != 'client_id' else f"coalesce(client_id, '{NO_CLIENT_ID}')" for column in COPY_COLUMNS)
+    with conn.cursor() as cur:
+        last_id, target_id = _progress(cur)
+        conn.commit()
+        while last_id < target_id:
+            upper = min(last_id + batch_rows, target_id)
+            # Rows the trigger already wrote are newer than this snapshot, so they win
+            cur.execute(f"""
+                INSERT INTO {NEW_TABLE} ({column_list})
+                SELECT {select_list} FROM pdf_chunks WHERE id > %s AND id <= %s
+                ON CONFLICT ({', '.join(CHUNK_KEY_COLUMNS)}) DO NOTHING
+            """, (last_id, upper))
+            cur.execute("UPDATE pdf_chunks_partition_migration SET last_id = %s", (upper,))
+            conn.commit()
+            last_id = upper
+            print(f"Backfilled ids up to {last_id} of {target_id}")
+
+def build_index(conn):
+    """Step 3: build the ANN index on every partition before any query reads them"""
+    # Imported here so the schema setup does not need the index settings
+    import vector_index
+    with conn.cursor() as cur:
+        cur.execute(f"SELECT count(*) FROM {NEW_TABLE}")
+        row_count = cur.fetchone()[0]
+        partitions = partition_count(cur, NEW_TABLE)
+    conn.commit()
+    # Each partition gets its own index, sized to the rows in one partition
+    vector_index.build_index(conn, max(row_count // max(partitions, 1), 1), table=NEW_TABLE, index_name=f"{NEW_TABLE}_embedding_idx")
+
+def swap(conn):
+    """Step 4: rename the partitioned copy into place in one short transaction; the old table is kept for rollback"""
+    with conn.cursor() as cur:
+        last_id, target_id = _progress(cur)
+        if last_id < target_id:
+            raise RuntimeError(f"Backfill incomplete: {last_id} of {target_id}")
+        cur.execute(f"SELECT to_regclass('{NEW_TABLE}_embedding_idx') IS NOT NULL")
+        if not cur.fetchone()[0]:
+            raise RuntimeError("Build the ANN index on the partitioned table first")
+        # Writers wait on the lock for the few milliseconds the renames take
+        cur.execute("LOCK TABLE pdf_chunks IN ACCESS EXCLUSIVE MODE")
+        cur.execute(f"DROP TRIGGER {SYNC_TRIGGER} ON pdf_chunks")
+        cur.execute(f"ALTER TABLE pdf_chunks RENAME TO {OLD_TABLE}")
+        for suffix in ('embedding_idx', 'content_tsv_idx', 'chunk_key', 'pdf_id_chunk_index_key', 'pkey'):
+            cur.execute(f"ALTER INDEX IF EXISTS pdf_chunks_{suffix} RENAME TO {OLD_TABLE}_{suffix}")
+        cur.execute(f"ALTER TABLE {NEW_TABLE} RENAME TO pdf_chunks")
+        for suffix in ('embedding_idx', 'content_tsv_idx', 'chunk_key', 'pkey'):
+            cur.execute(f"ALTER INDEX IF EXISTS {NEW_TABLE}_{suffix} RENAME TO pdf_chunks_{suffix}")
+        for remainder in range(partition_count(cur)):
+            cur.execute(f"ALTER TABLE {partition_name(NEW_TABLE, remainder)} RENAME TO {partition_name('pdf_chunks', remainder)}")
+        # Otherwise dropping the old table would take the id sequence with it
+        cur.execute("ALTER SEQUENCE pdf_chunks_id_seq OWNED BY pdf_chunks.id")
+        cur.execute("DROP TABLE pdf_chunks_partition_migration")
+    conn.commit()
+    print(f"pdf_chunks is now partitioned; the previous table is kept as {OLD_TABLE}")
+
+def drop_old(conn):
+    """Step 5: once queries look healthy, drop the unpartitioned table"""
+    with conn.cursor() as cur:
+        cur.execute(f"DROP TABLE IF EXISTS {OLD_TABLE}")
+        cur.execute(f"DROP FUNCTION IF EXISTS {SYNC_TRIGGER}()")
+    conn.commit()
+    print(f"Dropped {OLD_TABLE}")
+
+STEPS = {'create': create, 'backfill': backfill, 'index': build_index, 'swap': swap, 'drop-old': drop_old}
+
+if __name__ == '__main__':
+    # python chunk_partitions.py create | backfill | index | swap | drop-old
+    from db_connection import connection
+    if len(sys.argv) != 2 or sys.argv[1] not in STEPS:
+        sys.exit(f"usage: python chunk_partitions.py {' | '.join(STEPS)}")
+    with connection() as conn:
+        STEPS[sys.argv[1]](conn)
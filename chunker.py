@@ -0,0 +1,49 @@
+from collections import deque, namedtuple
+from tokenizer import count_tokens, split_tokens
+
+# page_start and page_end are 1-based and inclusive
+Chunk = namedtuple('Chunk', ['text', 'page_start', 'page_end', 'token_count'])
+
+def iter_token_segments(pages, max_tokens, count=count_tokens):
+    """Yield (text, tokens, page_number) for every non-blank segment, cutting any that exceed max_tokens"""
+    for page_number, segments in pages:
+        for piece, separator in segments:
+            if not piece.strip():
+                continue
+            tokens = count(piece)
+            if tokens <= max_tokens:
+                yield piece + separator, tokens, page_number
+                continue
+            for part in split_tokens(piece, max_tokens):
+                yield part + separator, count(part), page_number
+
+def chunk_pages(pages, max_tokens, overlap_tokens=0, count=count_tokens):
+    """Pack page segments into chunks of at most max_tokens tokens, repeating up to overlap_tokens between neighbours.
+
+    pages yields (page_number, [(piece, separator), ...]). Each segment is counted once and joined once per chunk it
+    lands in, so the work is linear in the document size.
+    """
+    if max_tokens < 1:
+        raise ValueError("max_tokens must be at least 1")
+    overlap_tokens = max(0, min(overlap_tokens, max_tokens - 1))
+    window = deque()
+    window_tokens = 0
+    # Segments in the window not yet part of an emitted chunk
+    fresh = 0
+
+    def make_chunk():
+        return Chunk(''.join(text for text, _, _ in window).strip(), window[0][2], window[-1][2], window_tokens)
+
+    for segment in iter_token_segments(pages, max_tokens, count):
+        tokens = segment[1]
+        if fresh and window_tokens + tokens > max_tokens:
+            yield make_chunk()
+            fresh = 0
+            # Keep a tail of whole segments as the overlap, leaving room for the incoming segment
+            while window and (window_tokens > overlap_tokens or window_tokens + tokens > max_tokens):
+                window_tokens -= window.popleft()[1]
+        window.append(segment)
+        window_tokens += tokens
+        fresh += 1
+    if fresh:
+        yield make_chunk()
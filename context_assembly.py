@@ -0,0 +1,102 @@
+import os
+from collections import namedtuple
+
+# Hits retrieved per question, chunks added on each side of every hit, and the prompt tokens they share
+CONTEXT_TOP_K = int(os.getenv('CONTEXT_TOP_K', 3))
+CONTEXT_NEIGHBOURS = int(os.getenv('CONTEXT_NEIGHBOURS', 1))
+CONTEXT_TOKEN_BUDGET = int(os.getenv('CONTEXT_TOKEN_BUDGET', 1500))
+# Neighbouring token chunks repeat their overlap verbatim; shorter coincidental matches are left alone
+MIN_OVERLAP_CHARS = 16
+MAX_OVERLAP_CHARS = 4000
+PASSAGE_SEPARATOR = "\n\n"
+
+Context = namedtuple('Context', ['text', 'chunks', 'tokens'])
+
+def context_sql(table, hits_sql):
+    """Expand ranked hits into their chunk_index windows in the same statement.
+
+    hits_sql returns pdf_id, client_id, chunk_index and rank_key, lower being better. Every (hit, chunk)
+    pair in a window comes back, so assemble can tell hits from neighbours.
+    """
+    return f"""
+        WITH hits AS (
+            SELECT pdf_id, client_id, chunk_index, row_number() OVER (ORDER BY rank_key) AS hit_rank
+            FROM ({hits_sql.strip().rstrip(';')}) ranked
+        )
+        SELECT hits.hit_rank, abs(chunks.chunk_index - hits.chunk_index) AS hit_distance,
+            chunks.pdf_id::text AS pdf_id, chunks.chunk_index, chunks.content
+        FROM hits
+        JOIN {table} chunks ON chunks.pdf_id = hits.pdf_id AND chunks.client_id = hits.client_id
+            AND chunks.chunk_index BETWEEN hits.chunk_index - %(neighbours)s AND hits.chunk_index + %(neighbours)s
+        ORDER BY hits.hit_rank, hit_distance;
+    """
+
+def strip_overlap(previous, following):
+    """The part of following after any text it repeats from the end of previous"""
+    head = following[:MIN_OVERLAP_CHARS]
+    if len(head) < MIN_OVERLAP_CHARS:
+        return following
+    # The earliest match in the tail is the longest overlap
+    position = previous.find(head, max(0, len(previous) - MAX_OVERLAP_CHARS))
+    while position != -1:
+        if following.startswith(previous[position:]):
+            return following[len(previous) - position:]
+        position = previous.find(head, position + 1)
+    return following
+
+def _join(previous, following):
+    remainder = strip_overlap(previous, following)
+    # An overlap match ends on a segment boundary, so the remainder keeps its own leading separator
+    return previous + remainder if remainder is not following else previous + "\n" + following
+
+def assemble(rows, token_budget=CONTEXT_TOKEN_BUDGET):
+    """Pack retrieved chunks into passages that fit token_budget.
+
+    rows carry hit_rank, hit_distance, pdf_id, chunk_index and content. Chunks are taken best hit first and
+    nearest first within a hit's window, skipping chunks already taken and neighbours whose hit did not fit.
+    The chosen chunks are stitched into passages of consecutive chunk_index with the repeated overlap
+    removed, ordered by their best hit. Tokens are counted per chunk before the overlap is removed, so
+    the final text is never longer than the budget.
+    """
+    # tokenizer loads tiktoken's BPE file, so keep it off the query Lambda's import path
+    from tokenizer import count_tokens, split_tokens
+    selected = {}
+    hits_taken = set()
+    texts = set()
+    used = 0
+    for row in sorted(rows, key=lambda row: (row['hit_rank'], row['hit_distance'], row['chunk_index'])):
+        key = (row['pdf_id'], row['chunk_index'])
+        is_hit = row['hit_distance'] == 0
+        if key in selected:
+            # A hit already taken as a better hit's neighbour still counts as taken
+            if is_hit:
+                hits_taken.add(row['hit_rank'])
+            continue
+        text = (row['content'] or '').strip()
+        # Identical chunks, e.g. the same PDF uploaded by two clients, are sent once
+        if not text or text in texts or not (is_hit or row['hit_rank'] in hits_taken):
+            continue
+        tokens = count_tokens(text)
+        if used + tokens > token_budget:
+            if selected:
+                continue
+            # The best hit alone is over budget: keep its start rather than sending nothing
+            text = split_tokens(text, token_budget)[0]
+            tokens = count_tokens(text)
+        selected[key] = (row['hit_rank'], text)
+        texts.add(text)
+        if is_hit:
+            hits_taken.add(row['hit_rank'])
+        used += tokens
+
+    passages = []
+    for (pdf_id, chunk_index), (hit_rank, text) in sorted(selected.items()):
+        last = passages[-1] if passages else None
+        if last and last['pdf_id'] == pdf_id and last['chunk_index'] == chunk_index - 1:
+            last['text'] = _join(last['text'], text)
+            last['chunk_index'] = chunk_index
+            last['hit_rank'] = min(last['hit_rank'], hit_rank)
+        else:
+            passages.append({'pdf_id': pdf_id, 'chunk_index': chunk_index, 'hit_rank': hit_rank, 'text': text})
+    passages.sort(key=lambda passage: passage['hit_rank'])
+    return Context(PASSAGE_SEPARATOR.join(passage['text'] for passage in passages), len(selected), used)
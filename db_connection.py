@@ -0,0 +1,150 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+import metrics
+
+# Upper bound on connections held by one Lambda container
+MAX_CONNECTIONS = int(os.getenv('DB_MAX_CONNECTIONS', 2))
+# Idle connections older than this are pinged with SELECT 1 before reuse
+VALIDATE_AFTER_SECONDS = float(os.getenv('DB_VALIDATE_AFTER_SECONDS', 30))
+# Seconds to wait for a free connection once the cap is reached
+ACQUIRE_TIMEOUT_SECONDS = float(os.getenv('DB_ACQUIRE_TIMEOUT_SECONDS', 10))
+
+def get_db_params():
+    # Database connection parameters from environment variables
+    return {
+        'dbname': os.getenv('DB_NAME'),
+        'user': os.getenv('DB_USER'),
+        'password': os.getenv('DB_PASSWORD'),
+        'host': os.getenv('DB_HOST'),
+        'port': os.getenv('DB_PORT'),
+        'connect_timeout': int(os.getenv('DB_CONNECT_TIMEOUT', 5)),
+        # Keep warm connections from being silently dropped between invocations
+        'keepalives': 1,
+        'keepalives_idle': 30
+    }
+
+class ConnectionManager:
+    """Keeps database connections alive across warm Lambda invocations"""
+
+    def __init__(self, db_params=None, max_connections=MAX_CONNECTIONS, validate_after=VALIDATE_AFTER_SECONDS):
+        self.db_params = db_params
+        self.max_connections = max_connections
+        self.validate_after = validate_after
+        self._idle = []
+        self._in_use = 0
+        self._condition = threading.Condition()
+        self.stats = {'opened': 0, 'reused': 0, 'discarded': 0}
+
+    def _open(self):
+        # psycopg2 is imported on first connect, keeping it off the import path of Lambdas that may not need it
+        import psycopg2
+        with metrics.span('DbConnect'):
+            conn = psycopg2.connect(**(self.db_params or get_db_params()))
+        self.stats['opened'] += 1
+        metrics.add('DbConnectionsOpened')
+        return conn
+
+    def _discard(self, conn):
+        import psycopg2
+        self.stats['discarded'] += 1
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+    def _is_usable(self, conn, last_used):
+        import psycopg2
+        from psycopg2 import extensions
+        if conn.closed:
+            return False
+        if conn.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+            return False
+        if time.monotonic() - last_used < self.validate_after:
+            return True
+        # Only ping connections that sat idle long enough to have been dropped
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def acquire(self):
+        with self._condition:
+            while True:
+                while self._idle:
+                    conn, last_used = self._idle.pop()
+                    if self._is_usable(conn, last_used):
+                        self._in_use += 1
+                        self.stats['reused'] += 1
+                        return conn
+                    self._discard(conn)
+                if self._in_use < self.max_connections:
+                    break
+                if not self._condition.wait(ACQUIRE_TIMEOUT_SECONDS):
+                    from psycopg2 import pool
+                    raise pool.PoolError(f"No database connection available after {ACQUIRE_TIMEOUT_SECONDS}s")
+            self._in_use += 1
+        try:
+            return self._open()
+        except Exception:
+            with self._condition:
+                self._in_use -= 1
+                self._condition.notify()
+            raise
+
+    def release(self, conn, discard=False):
+        import psycopg2
+        from psycopg2 import extensions
+        if not discard and not conn.closed and conn.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+            # Never hand out a connection with an open transaction
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                discard = True
+        with self._condition:
+            self._in_use -= 1
+            if discard or conn.closed:
+                self._discard(conn)
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._condition.notify()
+
+    @contextmanager
+    def connection(self):
+        with metrics.span('DbAcquire'):
+            conn = self.acquire()
+        import psycopg2
+        discard = False
+        try:
+            yield conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            # The connection itself is broken, reconnect on the next acquire
+            discard = True
+            raise
+        finally:
+            self.release(conn, discard=discard)
+
+    def close_all(self):
+        with self._condition:
+            while self._idle:
+                conn, _ = self._idle.pop()
+                conn.close()
+
+# Module-level manager so connections survive across warm invocations
+_manager = None
+
+def get_manager():
+    global _manager
+    if _manager is None:
+        _manager = ConnectionManager()
+    return _manager
+
+def connection():
+    return get_manager().connection()
+
+def get_stats():
+    return dict(get_manager().stats)
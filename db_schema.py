@@ -0,0 +1,98 @@
+import psycopg2
+from chunk_partitions import CHUNK_KEY_COLUMNS, NO_CLIENT_ID, partitions_sql, table_sql
+from db_connection import get_db_params
+
+# Schema setup runs once at deploy time (python db_schema.py), not on every write.
+# The ANN index on content_embedding is managed by vector_index.py once data is loaded.
+# New installs get pdf_chunks hash partitioned on client_id; existing ones migrate online with chunk_partitions.py.
+SCHEMA_STATEMENTS = [
+    "CREATE EXTENSION IF NOT EXISTS vector;",
+    table_sql('pdf_chunks'),
+    partitions_sql('pdf_chunks'),
+    # Unpartitioned tables from older installs: drop duplicates left by plain INSERTs before chunk writes became upserts
+    """
+    DO $$
+    BEGIN
+        IF to_regclass('pdf_chunks_pdf_id_chunk_index_key') IS NULL
+            AND (SELECT relkind FROM pg_class WHERE oid = 'pdf_chunks'::regclass) = 'r' THEN
+            DELETE FROM pdf_chunks a USING pdf_chunks b
+            WHERE a.pdf_id = b.pdf_id AND a.chunk_index = b.chunk_index AND a.id < b.id;
+            CREATE UNIQUE INDEX pdf_chunks_pdf_id_chunk_index_key ON pdf_chunks (pdf_id, chunk_index);
+        END IF;
+    END $$;
+    """,
+    # Chunk writes upsert on CHUNK_KEY_COLUMNS, which includes client_id so the same key works once partitioned
+    f"UPDATE pdf_chunks SET client_id = '{NO_CLIENT_ID}' WHERE client_id IS NULL;",
+    f"CREATE UNIQUE INDEX IF NOT EXISTS pdf_chunks_chunk_key ON pdf_chunks ({', '.join(CHUNK_KEY_COLUMNS)});",
+    # The unique index also serves pdf_id filters
+    "DROP INDEX IF EXISTS pdf_chunks_pdf_id_idx;",
+    # Full-text side of hybrid retrieval, kept up to date by Postgres on every write
+    """
+    ALTER TABLE pdf_chunks ADD COLUMN IF NOT EXISTS content_tsv TSVECTOR
+        GENERATED ALWAYS AS (to_tsvector('english', coalesce(content, ''))) STORED;
+    """,
+    "CREATE INDEX IF NOT EXISTS pdf_chunks_content_tsv_idx ON pdf_chunks USING gin (content_tsv);",
+    # 1-based inclusive page span of each chunk; NULL for chunks from the character splitter
+    "ALTER TABLE pdf_chunks ADD COLUMN IF NOT EXISTS page_start INT, ADD COLUMN IF NOT EXISTS page_end INT;",
+    """
+    CREATE TABLE IF NOT EXISTS query_embedding_cache (
+        cache_key TEXT PRIMARY KEY,
+        model TEXT NOT NULL,
+        dimensions INT NOT NULL,
+        embedding VECTOR(1024) NOT NULL,
+        created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+    );
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS chunk_embedding_store (
+        content_hash TEXT PRIMARY KEY,
+        model TEXT NOT NULL,
+        dimensions INT NOT NULL,
+        embedding VECTOR(1024) NOT NULL,
+        created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+    );
+    """,
+    # One row per ingested PDF; pdf_id is derived from client_id and the file's SHA-256
+    """
+    CREATE TABLE IF NOT EXISTS pdf_documents (
+        pdf_id UUID PRIMARY KEY,
+        client_id UUID,
+        content_hash TEXT,
+        status TEXT NOT NULL,
+        chunk_count INT,
+        ingest_version TEXT,
+        created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+        updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+    );
+    """,
+    # Presigned multipart upload that holds the claim; complete_upload only starts processing for this upload
+    "ALTER TABLE pdf_documents ADD COLUMN IF NOT EXISTS upload_id TEXT;",
+    # Failures pending notification per PDF and error class; FailureNotification sends one summary per window
+    """
+    CREATE TABLE IF NOT EXISTS failure_notifications (
+        pdf_id TEXT NOT NULL,
+        error_class TEXT NOT NULL,
+        failures INT NOT NULL DEFAULT 0,
+        sample_errors TEXT[] NOT NULL DEFAULT '{}',
+        last_execution_id TEXT,
+        last_seen TIMESTAMPTZ NOT NULL DEFAULT now(),
+        notified_at TIMESTAMPTZ,
+        PRIMARY KEY (pdf_id, error_class)
+    );
+    """
+]
+
+def apply_schema(conn):
+    with conn.cursor() as cur:
+        for statement in SCHEMA_STATEMENTS:
+            cur.execute(statement)
+    conn.commit()
+
+if __name__ == '__main__':
+    db_params = get_db_params()
+    conn = psycopg2.connect(**db_params)
+    try:
+        apply_schema(conn)
+        print(f"Schema applied to database: {db_params['dbname']}")
+    finally:
+        conn.close()
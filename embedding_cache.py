@@ -0,0 +1,142 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# In-process tier bounds
+CACHE_MAX_ENTRIES = int(os.getenv('QUERY_EMBEDDING_CACHE_SIZE', 1024))
+CACHE_TTL_SECONDS = float(os.getenv('QUERY_EMBEDDING_CACHE_TTL', 3600))
+# Optional shared tier in the query_embedding_cache table
+SHARED_CACHE_ENABLED = os.getenv('QUERY_EMBEDDING_SHARED_CACHE', 'false').lower() == 'true'
+SHARED_CACHE_TTL_SECONDS = int(os.getenv('QUERY_EMBEDDING_SHARED_CACHE_TTL', 7 * 24 * 3600))
+
+def normalize_query(text):
+    """Case- and whitespace-insensitive form of a query, so replays of the same question match"""
+    return ' '.join(text.lower().split())
+
+def cache_key(text, model, dimensions):
+    return hashlib.sha256(f"{model}:{dimensions}:{normalize_query(text)}".encode('utf-8')).hexdigest()
+
+def content_hash(text, model, dimensions):
+    """Exact-text key for chunk embeddings shared across PDFs"""
+    return hashlib.sha256(f"{model}:{dimensions}:{text}".encode('utf-8')).hexdigest()
+
+class LRUCache:
+    """Size- and TTL-bounded in-process cache"""
+
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES, ttl_seconds=CACHE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if time.monotonic() >= expires_at:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl_seconds)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+class QueryEmbeddingCache:
+    """Two-tier cache of query embeddings: an in-process LRU, then an optional Postgres table"""
+
+    def __init__(self, model, dimensions, shared=SHARED_CACHE_ENABLED):
+        self.model = model
+        self.dimensions = dimensions
+        self.shared = shared
+        self.local = LRUCache()
+        self.stats = {'local_hits': 0, 'shared_hits': 0, 'misses': 0}
+
+    def _shared_get(self, key):
+        from db_connection import connection
+        import psycopg2
+        try:
+            with connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute("""
+                        SELECT embedding::text FROM query_embedding_cache
+                        WHERE cache_key = %s AND created_at > now() - make_interval(secs => %s)
+                    """, (key, SHARED_CACHE_TTL_SECONDS))
+                    row = cur.fetchone()
+            # pgvector's text form '[1,2,3]' is valid JSON
+            return json.loads(row[0]) if row else None
+        except psycopg2.Error as e:
+            print(f"Shared embedding cache lookup failed: {e}")
+            return None
+
+    def _shared_put(self, key, embedding):
+        from db_connection import connection
+        import psycopg2
+        try:
+            with connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute("""
+                        INSERT INTO query_embedding_cache (cache_key, model, dimensions, embedding)
+                        VALUES (%s, %s, %s, %s::vector)
+                        ON CONFLICT (cache_key) DO UPDATE SET embedding = EXCLUDED.embedding, created_at = now()
+                    """, (key, self.model, self.dimensions, embedding))
+                conn.commit()
+        except psycopg2.Error as e:
+            print(f"Shared embedding cache write failed: {e}")
+
+    def lookup(self, text):
+        """Cached embedding of text from either tier, or None (counted as a miss)"""
+        key = cache_key(text, self.model, self.dimensions)
+
+        embedding = self.local.get(key)
+        if embedding is not None:
+            self.stats['local_hits'] += 1
+            return embedding
+
+        if self.shared:
+            embedding = self._shared_get(key)
+            if embedding is not None:
+                self.stats['shared_hits'] += 1
+                self.local.put(key, embedding)
+                return embedding
+
+        self.stats['misses'] += 1
+        return None
+
+    def store(self, text, embedding):
+        key = cache_key(text, self.model, self.dimensions)
+        self.local.put(key, embedding)
+        if self.shared:
+            self._shared_put(key, embedding)
+
+    def get_or_compute(self, text, compute):
+        embedding = self.lookup(text)
+        if embedding is None:
+            embedding = compute(text)
+            if embedding is not None:
+                self.store(text, embedding)
+        return embedding
+
+    def hit_rate(self):
+        hits = self.stats['local_hits'] + self.stats['shared_hits']
+        total = hits + self.stats['misses']
+        return hits / total if total else 0.0
+
+    def report(self):
+        return dict(self.stats, hit_rate=round(self.hit_rate(), 3), local_size=len(self.local))
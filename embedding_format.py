@@ -0,0 +1,73 @@
+import json
+import struct
+
+# Packed embedding batch layout (all little-endian):
+#   header    magic 'PDFE', version u8, dtype u8, reserved u16, count u32, dimensions u32, metadata length u32
+#   metadata  UTF-8 JSON, zero padded to a multiple of 8 bytes
+#   vectors   count x dimensions values of the header dtype, row major
+MAGIC = b'PDFE'
+VERSION = 1
+HEADER = struct.Struct('<4sBBHIII')
+# NumPy dtype strings; NumPy is imported where vectors are packed so to_vector_literal callers do not load it
+DTYPES = {1: '<f4', 2: '<f2'}
+DTYPE_CODES = {'float32': 1, 'float16': 2}
+
+def is_packed(body):
+    return body[:4] == MAGIC
+
+def metadata_length(header):
+    """Length of the metadata that follows a packed batch's first HEADER.size bytes"""
+    magic, version, _, _, _, _, meta_length = HEADER.unpack_from(header)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"Not a packed embedding batch (magic={magic!r}, version={version})")
+    return meta_length
+
+def encode(metadata, vectors, dtype='float32'):
+    """Pack a batch of vectors and its metadata into one bytes object"""
+    import numpy as np
+    code = DTYPE_CODES[dtype]
+    matrix = np.asarray(vectors, dtype=DTYPES[code])
+    if matrix.ndim != 2:
+        matrix = matrix.reshape(len(matrix), -1)
+    meta = json.dumps(metadata).encode('utf-8')
+    meta += b'\x00' * (-(HEADER.size + len(meta)) % 8)
+    header = HEADER.pack(MAGIC, VERSION, code, 0, matrix.shape[0], matrix.shape[1], len(meta))
+    return header + meta + matrix.tobytes()
+
+def decode(body):
+    """Return (metadata, matrix) where the matrix is a read-only view over body, not a copy"""
+    import numpy as np
+    magic, version, code, _, count, dimensions, meta_length = HEADER.unpack_from(body)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"Not a packed embedding batch (magic={magic!r}, version={version})")
+    metadata = json.loads(bytes(body[HEADER.size:HEADER.size + meta_length]).rstrip(b'\x00'))
+    matrix = np.frombuffer(body, dtype=DTYPES[code], count=count * dimensions, offset=HEADER.size + meta_length)
+    return metadata, matrix.reshape(count, dimensions)
+
+def open_memmap(path):
+    """Return (metadata, matrix) with the matrix memory-mapped from a packed file on local disk"""
+    import numpy as np
+    with open(path, 'rb') as f:
+        header = f.read(HEADER.size)
+        magic, version, code, _, count, dimensions, meta_length = HEADER.unpack(header)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"Not a packed embedding file: {path}")
+        metadata = json.loads(f.read(meta_length).rstrip(b'\x00'))
+    matrix = np.memmap(path, dtype=DTYPES[code], mode='r', offset=HEADER.size + meta_length, shape=(count, dimensions))
+    return metadata, matrix
+
+def to_batch_content(body):
+    """Expose a packed batch in the same shape as a JSON batch object, with vector rows as views"""
+    metadata, matrix = decode(body)
+    for chunk, vector in zip(metadata['chunks'], matrix):
+        chunk['embedding'] = vector
+    return metadata
+
+_literal_formats = {}
+
+def to_vector_literal(values):
+    """Format a vector as pgvector text with a single C-level format call"""
+    count = len(values)
+    if count not in _literal_formats:
+        _literal_formats[count] = '[' + ','.join(['%.7g'] * count) + ']'
+    return _literal_formats[count] % tuple(values)
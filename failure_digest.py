@@ -0,0 +1,150 @@
+import json
+import os
+import re
+import uuid
+from collections import OrderedDict
+
+# Failures of one PDF are grouped by error class; a class notified within this window is counted, not re-sent
+FAILURE_WINDOW_SECONDS = int(os.getenv('FAILURE_WINDOW_SECONDS', 900))
+SAMPLE_ERRORS = 3
+MAX_DETAIL_CHARS = 300
+# Ids, counts and offsets differ between otherwise identical errors
+_VARYING = re.compile(r"[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}|\d+", re.IGNORECASE)
+
+def classify(error):
+    """(error_class, detail) for a Catch output, a failed Lambda result or a formatted message"""
+    if isinstance(error, dict):
+        if 'Error' in error:
+            return error['Error'], str(error.get('Cause', ''))[:MAX_DETAIL_CHARS]
+        if 'statusCode' in error:
+            # Handlers report most failures as a status code rather than raising
+            return f"HTTP {error['statusCode']}", str(error.get('body', ''))[:MAX_DETAIL_CHARS]
+    text = str(error)
+    # States.Format renders a caught error object as JSON inside the message
+    start = text.find('{"Error"')
+    if start != -1:
+        try:
+            name, detail = classify(json.loads(text[start:]))
+            return f"{text[:start].strip()} {name}".strip(), detail
+        except ValueError:
+            pass
+    first_line = text.strip().splitlines()[0] if text.strip() else 'Unknown error'
+    return _VARYING.sub('#', first_line)[:120], text[:MAX_DETAIL_CHARS]
+
+def collect(event):
+    """Failures in a failure event: one error, or every failed result of a Map state"""
+    if 'results' not in event:
+        return [classify(event.get('error') or 'Unknown error')]
+    failures = []
+    for result in event['results'] or []:
+        if not isinstance(result, dict):
+            continue
+        if result.get('failed'):
+            failures.append(classify(result.get('error')))
+        elif isinstance(result.get('statusCode'), int) and result['statusCode'] != 200:
+            failures.append(classify(result))
+    return failures
+
+def group(failures, stage=None):
+    """{error_class: {'count', 'samples'}} with up to SAMPLE_ERRORS distinct samples per class"""
+    groups = OrderedDict()
+    for name, detail in failures:
+        error_class = f"{stage}: {name}" if stage else name
+        entry = groups.setdefault(error_class, {'count': 0, 'samples': []})
+        entry['count'] += 1
+        if detail and detail not in entry['samples'] and len(entry['samples']) < SAMPLE_ERRORS:
+            entry['samples'].append(detail)
+    return groups
+
+def claim(conn, pdf_id, execution_id, groups, window_seconds=FAILURE_WINDOW_SECONDS):
+    """Add groups to the PDF's pending failures; returns them all if a notification is due, else None.
+
+    A notification is due when any pending class has not been notified within window_seconds. The rows
+    stay locked in the caller's transaction, so commit after publishing and roll back if that fails.
+    """
+    with conn.cursor() as cur:
+        for error_class, entry in groups.items():
+            cur.execute("""
+                INSERT INTO failure_notifications (pdf_id, error_class, failures, sample_errors, last_execution_id)
+                VALUES (%s, %s, %s, %s, %s)
+                ON CONFLICT (pdf_id, error_class) DO UPDATE
+                    SET failures = failure_notifications.failures + EXCLUDED.failures,
+                        sample_errors = (failure_notifications.sample_errors || EXCLUDED.sample_errors)[1:%s],
+                        last_execution_id = EXCLUDED.last_execution_id, last_seen = now()
+            """, (pdf_id, error_class, entry['count'], entry['samples'], execution_id, SAMPLE_ERRORS))
+        # Locks every pending class of the PDF, so a concurrent run waits and then sees them notified
+        cur.execute("""
+            SELECT error_class, failures, sample_errors,
+                notified_at IS NULL OR notified_at < now() - make_interval(secs => %s) AS due
+            FROM failure_notifications
+            WHERE pdf_id = %s AND failures > 0
+            ORDER BY failures DESC
+            FOR UPDATE
+        """, (window_seconds, pdf_id))
+        rows = cur.fetchall()
+        if not any(due for _, _, _, due in rows):
+            return None
+        cur.execute("""
+            UPDATE failure_notifications SET failures = 0, sample_errors = '{}', notified_at = now()
+            WHERE pdf_id = %s AND failures > 0
+        """, (pdf_id,))
+    return OrderedDict((error_class, {'count': failures, 'samples': list(samples)}) for error_class, failures, samples, _ in rows)
+
+def claim_due(conn, window_seconds=FAILURE_WINDOW_SECONDS):
+    """Take one PDF whose pending failures are past the window; returns (pdf_id, client_id, execution_id, groups) or None.
+
+    Failures suppressed by claim wait here until a scheduled flush publishes them. Rows locked by a concurrent
+    claim or flush are skipped. As with claim, commit after publishing and roll back if that fails.
+    """
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT pdf_id FROM failure_notifications
+            WHERE failures > 0 AND (notified_at IS NULL OR notified_at < now() - make_interval(secs => %s))
+            ORDER BY last_seen
+            LIMIT 1
+            FOR UPDATE SKIP LOCKED
+        """, (window_seconds,))
+        row = cur.fetchone()
+        if row is None:
+            return None
+        pdf_id = row[0]
+        cur.execute("""
+            SELECT error_class, failures, sample_errors, last_execution_id, last_seen
+            FROM failure_notifications
+            WHERE pdf_id = %s AND failures > 0
+            ORDER BY failures DESC
+            FOR UPDATE
+        """, (pdf_id,))
+        rows = cur.fetchall()
+        cur.execute("""
+            UPDATE failure_notifications SET failures = 0, sample_errors = '{}', notified_at = now()
+            WHERE pdf_id = %s AND failures > 0
+        """, (pdf_id,))
+        client_id = None
+        try:
+            # Failure events without a pdf_id are recorded as 'Unknown'
+            pdf_uuid = str(uuid.UUID(pdf_id))
+        except ValueError:
+            pdf_uuid = None
+        if pdf_uuid:
+            cur.execute("SELECT client_id FROM pdf_documents WHERE pdf_id = %s", (pdf_uuid,))
+            client_row = cur.fetchone()
+            client_id = client_row[0] if client_row else None
+    groups = OrderedDict((error_class, {'count': failures, 'samples': list(samples)}) for error_class, failures, samples, _, _ in rows)
+    execution_id = max(rows, key=lambda row: row[4])[3]
+    return pdf_id, client_id, execution_id, groups
+
+def summary(pdf_id, client_id, execution_id, is_pdf_chat, groups):
+    total = sum(entry['count'] for entry in groups.values())
+    lines = [
+        "PDF Processing Failure Summary:",
+        f"PDF ID: {pdf_id}",
+        f"Client ID: {client_id}",
+        f"Execution: {execution_id}",
+        f"Is PDF Chat: {is_pdf_chat}",
+        f"Failures: {total} in {len(groups)} error class{'es' if len(groups) != 1 else ''}"
+    ]
+    for error_class, entry in groups.items():
+        lines.append(f"- {error_class}: {entry['count']}")
+        lines.extend(f"    e.g. {sample}" for sample in entry['samples'])
+    return total, '\n'.join(lines)
@@ -4,13 +4,15 @@ import base64
 pdf_file_path = "./deepLearning.pdf"
 # Path to save the encoded string
 output_file_path = "./encoded_pdf.txt"
+# Bytes encoded per step: a multiple of 3, so the pieces concatenate into one valid base64 string
+read_size = 3 * 1024 * 1024
 
-# Read and encode the PDF file
-with open(pdf_file_path, "rb") as pdf_file:
-    encoded_string = base64.b64encode(pdf_file.read()).decode('utf-8')
-
-# Save the encoded string to a text file
-with open(output_file_path, "w") as text_file:
-    text_file.write(encoded_string)
+# Read and encode the PDF file a piece at a time
+with open(pdf_file_path, "rb") as pdf_file, open(output_file_path, "w") as text_file:
+    while True:
+        data = pdf_file.read(read_size)
+        if not data:
+            break
+        text_file.write(base64.b64encode(data).decode('utf-8'))
 
 print(f"Base64 encoded string saved to {output_file_path}")
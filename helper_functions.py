@@ -1,57 +1,121 @@
-from langchain.embeddings.openai import OpenAIEmbeddings
 import os
-import openai
 import warnings
+from context_assembly import CONTEXT_NEIGHBOURS, CONTEXT_TOKEN_BUDGET, CONTEXT_TOP_K, assemble, context_sql
+from embedding_cache import QueryEmbeddingCache
+from embedding_format import to_vector_literal
+from vector_index import candidate_count, candidate_rows, distance_operator, nearest_chunks_params, nearest_chunks_sql, set_search_params
 
 # Ignore all warnings
 warnings.filterwarnings('ignore')
 
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-# Initialize the embeddings
-embeddings = OpenAIEmbeddings(api_key=OPENAI_API_KEY, model="text-embedding-3-large", dimensions=1024)
+EMBEDDING_MODEL = "text-embedding-3-large"
+EMBEDDING_DIMENSIONS = 1024
+# Hybrid retrieval: candidates taken from each side and the reciprocal rank fusion constant
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", 20))
+RRF_K = int(os.getenv("RRF_K", 60))
+QUERY_ERROR_MESSAGE = "I apologize, but I encountered an error while processing your query. Please try again later."
+COMPLETION_PARAMS = {'model': "gpt-3.5-turbo-instruct", 'temperature': 0.7, 'max_tokens': 500}
+# The OpenAI client is created on first use, so importing this module stays cheap on a cold start
+_openai_client = None
+# Repeated or replayed questions skip the embedding call
+query_embedding_cache = QueryEmbeddingCache(EMBEDDING_MODEL, EMBEDDING_DIMENSIONS)
+
+def openai_client():
+    global _openai_client
+    if _openai_client is None:
+        import openai
+        _openai_client = openai.OpenAI(api_key=OPENAI_API_KEY)
+    return _openai_client
+
+def _embed_text(text: str) -> list:
+    response = openai_client().embeddings.create(input=[text], model=EMBEDDING_MODEL, dimensions=EMBEDDING_DIMENSIONS)
+    return response.data[0].embedding  # Return the first (and only) embedding
 
 def get_embedding(text: str) -> list:
     if not text or not isinstance(text, str):
         return None
     try:
-        embedding_result = embeddings.embed_documents([text])
-        return embedding_result[0]  # Return the first (and only) embedding
+        return query_embedding_cache.get_or_compute(text, _embed_text)
     except Exception as e:
         print(f"Error in generating embedding for text '{text}': {e}")
         return None
 
-def find_most_relevant_content(query_embedding, cursor, table, pdf_id=None, limit=1):
+def hybrid_sql(table, filter_by_pdf=False, filter_by_client=False, columns='chunks.content, fused.score'):
+    """Fuse full-text and ANN candidates with reciprocal rank fusion in a single statement"""
+    pdf_filter = ("AND pdf_id = %(pdf_id)s " if filter_by_pdf else "") + ("AND client_id = %(client_id)s" if filter_by_client else "")
+    # The tenant key on the join keeps the id lookups to one partition too
+    join_filter = "AND chunks.client_id = %(client_id)s" if filter_by_client else ""
+    nearest_rows = candidate_rows(table, f"WHERE TRUE {pdf_filter}", 'id')
+    # OR the query terms together so a single matching part number or acronym is enough
+    return f"""
+        WITH vector_hits AS (
+            SELECT id, row_number() OVER (ORDER BY distance) AS rank
+            FROM (
+                SELECT id, content_embedding {distance_operator()} %(embedding)s::vector AS distance
+                FROM {nearest_rows}
+                ORDER BY distance
+                LIMIT %(candidates)s
+            ) nearest
+        ),
+        text_hits AS (
+            SELECT id, row_number() OVER (ORDER BY score DESC) AS rank
+            FROM (
+                SELECT id, ts_rank_cd(content_tsv, query) AS score
+                FROM {table}, CAST(replace(plainto_tsquery('english', %(query)s)::text, '&', '|') AS tsquery) AS query
+                WHERE content_tsv @@ query {pdf_filter}
+                ORDER BY score DESC
+                LIMIT %(candidates)s
+            ) matches
+        ),
+        fused AS (
+            SELECT id, sum(1.0 / (%(rrf_k)s + rank)) AS score
+            FROM (SELECT id, rank FROM vector_hits UNION ALL SELECT id, rank FROM text_hits) ranked
+            GROUP BY id
+        )
+        SELECT {columns}
+        FROM fused JOIN {table} chunks ON chunks.id = fused.id {join_filter}
+        ORDER BY fused.score DESC
+        LIMIT %(limit)s;
+    """
+
+def hybrid_params(user_query, query_embedding, pdf_id=None, limit=1, client_id=None):
+    return {
+        'embedding': to_vector_literal(query_embedding),
+        'query': user_query,
+        'pdf_id': pdf_id,
+        'client_id': client_id,
+        'candidates': HYBRID_CANDIDATES,
+        'rerank_candidates': candidate_count(HYBRID_CANDIDATES),
+        'rrf_k': RRF_K,
+        'limit': limit
+    }
+
+def context_query(user_query, query_embedding, table, pdf_id=None, client_id=None, mode='vector', top_k=CONTEXT_TOP_K, neighbours=CONTEXT_NEIGHBOURS):
+    """(sql, params) fetching the top_k hits and their neighbouring chunks in one round trip"""
+    if mode == 'hybrid':
+        hits_sql = hybrid_sql(table, bool(pdf_id), bool(client_id), "chunks.pdf_id, chunks.client_id, chunks.chunk_index, -fused.score AS rank_key")
+        params = hybrid_params(user_query, query_embedding, pdf_id, top_k, client_id)
+    else:
+        columns = f"pdf_id, client_id, chunk_index, content_embedding {distance_operator()} %(embedding)s::vector AS rank_key"
+        hits_sql = nearest_chunks_sql(table, 'pdf_id' if pdf_id else None, columns, by_tenant=bool(client_id))
+        params = nearest_chunks_params(to_vector_literal(query_embedding), top_k, pdf_id, client_id=client_id)
+    return context_sql(table, hits_sql), dict(params, neighbours=neighbours)
+
+def find_relevant_context(user_query, query_embedding, cursor, table, pdf_id=None, client_id=None, mode='vector',
+                          top_k=CONTEXT_TOP_K, neighbours=CONTEXT_NEIGHBOURS, token_budget=CONTEXT_TOKEN_BUDGET):
+    """Top hits with their neighbouring chunks, deduplicated and packed into token_budget; returns a Context"""
     try:
-        # Format the embedding as a PostgreSQL array
-        embedding_str = "[" + ",".join(map(str, query_embedding)) + "]"
-        
-        if pdf_id:
-            sql_query = f"""
-                SELECT content
-                FROM {table}
-                WHERE pdf_id = %s
-                ORDER BY content_embedding <-> %s::vector
-                LIMIT %s;
-            """
-            cursor.execute(sql_query, (pdf_id, embedding_str, limit))
-        else:
-            sql_query = f"""
-                SELECT content
-                FROM {table}
-                ORDER BY content_embedding <-> %s::vector
-                LIMIT %s;
-            """
-            cursor.execute(sql_query, (embedding_str, limit))
-        
-        result = cursor.fetchone()
-        return result['content'] if result else None
+        set_search_params(cursor, HYBRID_CANDIDATES if mode == 'hybrid' else top_k)
+        sql_query, params = context_query(user_query, query_embedding, table, pdf_id, client_id, mode, top_k, neighbours)
+        cursor.execute(sql_query, params)
+        return assemble(cursor.fetchall(), token_budget)
     except Exception as e:
-        print(f"Error in find_most_relevant_content: {e}")
+        print(f"Error in find_relevant_context: {e}")
         return None
 
-def process_user_query(user_query, context, is_pdf_chat):
-    try:
-        prompt = f"""
+def build_prompt(user_query, context, is_pdf_chat):
+    return f"""
         You are an intelligent PDF assistant. Your primary function is to help users extract relevant information from PDF documents based on their queries. Follow these steps meticulously:
         1. Analyze the user's query, correcting any spelling errors and clarifying ambiguous terms using advanced natural language processing techniques.
         2. Conduct a semantic search within the provided PDF content to identify the most relevant information that addresses the preprocessed user query.
@@ -67,16 +131,14 @@ def process_user_query(user_query, context, is_pdf_chat):
         Context: {context}
         Answer:
         """
-        response = openai.completions.create(
-            model="gpt-3.5-turbo-instruct",
-            prompt=prompt,
-            temperature=0.7,
-            max_tokens=500
-        )
+
+def process_user_query(user_query, context, is_pdf_chat):
+    try:
+        response = openai_client().completions.create(prompt=build_prompt(user_query, context, is_pdf_chat), **COMPLETION_PARAMS)
         return response.choices[0].text.strip()
     except Exception as e:
         print(f"Error in process_user_query: {e}")
-        return "I apologize, but I encountered an error while processing your query. Please try again later."
+        return QUERY_ERROR_MESSAGE
 
 def create_response_card():
     buttons = [{"text": "Main Menu", "value": "main menu"}]
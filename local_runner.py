@@ -0,0 +1,488 @@
+import copy
+import fnmatch
+import importlib
+import json
+import operator
+import re
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+# Runs StateMachine.json in-process: Task states call the matching module's lambda_handler directly.
+# Supports Task, Choice, Map, Pass, Wait, Succeed and Fail with Parameters, ResultSelector, InputPath,
+# ResultPath, OutputPath, Retry, Catch, $$ context paths and the common States.* intrinsic functions.
+DEFINITION_PATH = 'StateMachine.json'
+# Inline Map runs at most 40 iterations at once when MaxConcurrency is 0
+MAX_INLINE_MAP_CONCURRENCY = 40
+
+class StateError(Exception):
+    """A named Step Functions error such as States.TaskFailed or a Lambda exception type"""
+
+    def __init__(self, error, cause=''):
+        super().__init__(f"{error}: {cause}")
+        self.error = error
+        self.cause = cause
+
+    def to_output(self):
+        return {'Error': self.error, 'Cause': self.cause}
+
+class LambdaContext:
+    """Just enough of the Lambda context object for the handlers in this repo"""
+
+    def __init__(self, function_name, timeout_seconds=900):
+        self.function_name = function_name
+        self.aws_request_id = str(uuid.uuid4())
+        self._deadline = time.monotonic() + timeout_seconds
+
+    def get_remaining_time_in_millis(self):
+        return max(0, int((self._deadline - time.monotonic()) * 1000))
+
+# ---- Paths ----
+
+_PATH_TOKEN = re.compile(r"\.([^.\[]+)|\['([^']*)'\]|\[(\d+)\]")
+
+def _path_tokens(path):
+    root = '$$' if path.startswith('$$') else '$'
+    if not path.startswith('$'):
+        raise StateError('States.Runtime', f"Not a path: {path}")
+    rest = path[len(root):]
+    tokens = []
+    position = 0
+    while position < len(rest):
+        match = _PATH_TOKEN.match(rest, position)
+        if match is None:
+            raise StateError('States.Runtime', f"Unsupported path: {path}")
+        name, quoted, index = match.groups()
+        tokens.append(int(index) if index is not None else (name if name is not None else quoted))
+        position = match.end()
+    return root, tokens
+
+def read_path(path, data, context=None):
+    root, tokens = _path_tokens(path)
+    value = context if root == '$$' else data
+    for token in tokens:
+        try:
+            value = value[token]
+        except (KeyError, IndexError, TypeError):
+            raise StateError('States.Runtime', f"The JSONPath {path} could not be found in the input")
+    return value
+
+def path_exists(path, data, context=None):
+    try:
+        read_path(path, data, context)
+        return True
+    except StateError:
+        return False
+
+def write_path(data, path, value):
+    """Return a copy of data with value placed at path, the way ResultPath does"""
+    root, tokens = _path_tokens(path)
+    if not tokens:
+        return value
+    result = copy.copy(data) if isinstance(data, dict) else {}
+    target = result
+    for token in tokens[:-1]:
+        child = target.get(token)
+        target[token] = copy.copy(child) if isinstance(child, dict) else {}
+        target = target[token]
+    target[tokens[-1]] = value
+    return result
+
+# ---- Intrinsic functions ----
+
+_INTRINSIC_TOKEN = re.compile(r"""\s*(?:
+    (?P<string>'(?:\\.|[^'\\])*')
+  | (?P<number>-?\d+(?:\.\d+)?)
+  | (?P<call>States\.\w+)\(
+  | (?P<path>\$\$?[^,)\s]*)
+  | (?P<literal>true|false|null)
+)""", re.VERBOSE)
+
+def _format(template, *args):
+    pieces = re.split(r"(?<!\\)\{\}", template)
+    if len(pieces) - 1 != len(args):
+        raise StateError('States.IntrinsicFailure', f"States.Format expects {len(pieces) - 1} arguments")
+    pieces = [re.sub(r"\\([{}\\'])", r"\1", piece) for piece in pieces]
+    rendered = [value if isinstance(value, str) else json.dumps(value) for value in args]
+    return pieces[0] + ''.join(value + piece for value, piece in zip(rendered, pieces[1:]))
+
+INTRINSICS = {
+    'States.Format': _format,
+    'States.StringToJson': json.loads,
+    'States.JsonToString': lambda value: json.dumps(value, separators=(',', ':')),
+    'States.Array': lambda *values: list(values),
+    'States.UUID': lambda: str(uuid.uuid4())
+}
+
+def _parse_intrinsic(text, position, data, context):
+    match = _INTRINSIC_TOKEN.match(text, position)
+    if match is None:
+        raise StateError('States.IntrinsicFailure', f"Cannot parse intrinsic function: {text}")
+    position = match.end()
+    if match.group('string') is not None:
+        # Keep \{ and \} escaped for States.Format, unescape quotes
+        return match.group('string')[1:-1].replace("\\'", "'"), position
+    if match.group('number') is not None:
+        number = match.group('number')
+        return (float(number) if '.' in number else int(number)), position
+    if match.group('literal') is not None:
+        return {'true': True, 'false': False, 'null': None}[match.group('literal')], position
+    if match.group('path') is not None:
+        return read_path(match.group('path'), data, context), position
+    name = match.group('call')
+    if name not in INTRINSICS:
+        raise StateError('States.IntrinsicFailure', f"Unsupported intrinsic function: {name}")
+    args = []
+    while True:
+        closing = re.compile(r"\s*\)").match(text, position)
+        if closing:
+            return INTRINSICS[name](*args), closing.end()
+        value, position = _parse_intrinsic(text, position, data, context)
+        args.append(value)
+        separator = re.compile(r"\s*,").match(text, position)
+        if separator:
+            position = separator.end()
+
+def resolve_value(expression, data, context):
+    if expression.startswith('States.'):
+        value, _ = _parse_intrinsic(expression, 0, data, context)
+        return value
+    return read_path(expression, data, context)
+
+def resolve_parameters(template, data, context):
+    """Expand a Parameters / ItemSelector / ResultSelector template: keys ending in .$ are evaluated"""
+    if isinstance(template, dict):
+        resolved = {}
+        for key, value in template.items():
+            if key.endswith('.$'):
+                resolved[key[:-2]] = resolve_value(value, data, context)
+            else:
+                resolved[key] = resolve_parameters(value, data, context)
+        return resolved
+    if isinstance(template, list):
+        return [resolve_parameters(value, data, context) for value in template]
+    return template
+
+# ---- Choice rules ----
+
+COMPARISONS = {
+    'Equals': operator.eq,
+    'LessThan': operator.lt,
+    'GreaterThan': operator.gt,
+    'LessThanEquals': operator.le,
+    'GreaterThanEquals': operator.ge
+}
+
+def _is_type(type_name, value):
+    if type_name == 'Numeric':
+        return isinstance(value, (int, float)) and not isinstance(value, bool)
+    if type_name == 'Boolean':
+        return isinstance(value, bool)
+    return isinstance(value, str)
+
+def evaluate_rule(rule, data, context):
+    if 'And' in rule:
+        return all(evaluate_rule(child, data, context) for child in rule['And'])
+    if 'Or' in rule:
+        return any(evaluate_rule(child, data, context) for child in rule['Or'])
+    if 'Not' in rule:
+        return not evaluate_rule(rule['Not'], data, context)
+    variable = rule['Variable']
+    for key, expected in rule.items():
+        if key in ('Variable', 'Next'):
+            continue
+        if key == 'IsPresent':
+            return path_exists(variable, data, context) == expected
+        value = read_path(variable, data, context)
+        if key == 'IsNull':
+            return (value is None) == expected
+        if key in ('IsString', 'IsNumeric', 'IsBoolean'):
+            return _is_type(key[2:], value) == expected
+        if key.endswith('Path'):
+            key, expected = key[:-4], read_path(expected, data, context)
+        if key == 'StringMatches':
+            return isinstance(value, str) and fnmatch.fnmatchcase(value, expected)
+        for type_name in ('String', 'Numeric', 'Boolean', 'Timestamp'):
+            if key.startswith(type_name) and key[len(type_name):] in COMPARISONS:
+                if not _is_type('String' if type_name == 'Timestamp' else type_name, value):
+                    return False
+                return COMPARISONS[key[len(type_name):]](value, expected)
+    raise StateError('States.Runtime', f"Unsupported Choice rule: {rule}")
+
+# ---- Runner ----
+
+def _error_matches(error_equals, error):
+    for name in error_equals:
+        if name == 'States.ALL' or name == error:
+            return True
+        # Every task error except a timeout counts as States.TaskFailed
+        if name == 'States.TaskFailed' and error != 'States.Timeout':
+            return True
+    return False
+
+def function_name(resource):
+    """arn:aws:lambda:<region>:<account>:function:SplitPDF[:alias] -> SplitPDF"""
+    parts = resource.split(':')
+    if 'function' in parts:
+        return parts[parts.index('function') + 1]
+    return resource
+
+def _run_iteration(definition, item_input, context, options):
+    # Entry point for Map iterations running in a worker process
+    runner = StateMachineRunner(definition, **options)
+    output = runner.run_states(definition, item_input, context)
+    return output, runner.stats
+
+class StateMachineRunner:
+    """Interpret a Step Functions definition in-process.
+
+    executor is 'thread' or 'process' for Map iterations; map_concurrency overrides every Map's
+    MaxConcurrency; resources maps function names to 'module:function' strings (or callables with
+    the thread executor) in place of the module's lambda_handler; wait_scale multiplies Retry and
+    Wait delays, so 0 skips them when benchmarking.
+    """
+
+    def __init__(self, definition, executor='thread', map_concurrency=None, resources=None, wait_scale=1.0):
+        if executor not in ('thread', 'process'):
+            raise ValueError(f"Unknown executor: {executor}")
+        self.definition = definition
+        self.executor = executor
+        self.map_concurrency = map_concurrency
+        self.resources = dict(resources or {})
+        self.wait_scale = wait_scale
+        # state name -> {'count', 'seconds', 'errors', 'retries'}
+        self.stats = {}
+        self._lock = threading.Lock()
+
+    def _options(self):
+        return {
+            'executor': self.executor,
+            'map_concurrency': self.map_concurrency,
+            'resources': self.resources,
+            'wait_scale': self.wait_scale
+        }
+
+    def _record(self, name, seconds=0.0, count=0, errors=0, retries=0):
+        with self._lock:
+            entry = self.stats.setdefault(name, {'count': 0, 'seconds': 0.0, 'errors': 0, 'retries': 0})
+            entry['count'] += count
+            entry['seconds'] += seconds
+            entry['errors'] += errors
+            entry['retries'] += retries
+
+    def _merge_stats(self, stats):
+        for name, entry in stats.items():
+            self._record(name, entry['seconds'], entry['count'], entry['errors'], entry['retries'])
+
+    def _handler(self, name):
+        target = self.resources.get(name, f"{name}:lambda_handler")
+        if callable(target):
+            return target
+        module_name, _, attribute = target.partition(':')
+        return getattr(importlib.import_module(module_name), attribute or 'lambda_handler')
+
+    def invoke(self, name, payload):
+        try:
+            result = self._handler(name)(payload, LambdaContext(name))
+        except Exception as e:
+            # An unhandled Lambda exception surfaces with its type as the error name
+            raise StateError(type(e).__name__, str(e))
+        # Round-trip through JSON like the real service, which also catches non-serializable results
+        return json.loads(json.dumps(result))
+
+    # ---- States ----
+
+    def run(self, execution_input, name=None):
+        """Run one execution and return a summary shaped like DescribeExecution"""
+        context = {
+            'Execution': {'Id': name or str(uuid.uuid4()), 'Input': execution_input, 'StartTime': time.time()},
+            'StateMachine': {'Id': DEFINITION_PATH}
+        }
+        start = time.perf_counter()
+        try:
+            output = self.run_states(self.definition, execution_input, context)
+            status, error = 'SUCCEEDED', None
+        except StateError as e:
+            output, status, error = None, 'FAILED', e.to_output()
+        return {
+            'status': status,
+            'output': output,
+            'error': error,
+            'seconds': time.perf_counter() - start,
+            'states': self.stats
+        }
+
+    def run_states(self, states_definition, data, context):
+        name = states_definition['StartAt']
+        while True:
+            state = states_definition['States'][name]
+            state_context = dict(context, State={'Name': name, 'EnteredTime': time.time()})
+            start = time.perf_counter()
+            try:
+                name, data = self._run_state(name, state, data, state_context)
+            except StateError:
+                self._record(state_context['State']['Name'], time.perf_counter() - start, 1, errors=1)
+                raise
+            self._record(state_context['State']['Name'], time.perf_counter() - start, 1)
+            if name is None:
+                return data
+
+    def _next(self, state):
+        return None if state.get('End') else state['Next']
+
+    def _run_state(self, name, state, data, context):
+        state_type = state['Type']
+        if state_type == 'Choice':
+            effective = self._input(state, data, context)
+            for rule in state['Choices']:
+                if evaluate_rule(rule, effective, context):
+                    return rule['Next'], self._output(state, effective, context)
+            if 'Default' not in state:
+                raise StateError('States.NoChoiceMatched', f"No Choice rule matched in {name}")
+            return state['Default'], self._output(state, effective, context)
+        if state_type == 'Succeed':
+            return None, self._output(state, self._input(state, data, context), context)
+        if state_type == 'Fail':
+            raise StateError(state.get('Error', 'States.Fail'), state.get('Cause', ''))
+        if state_type == 'Wait':
+            effective = self._input(state, data, context)
+            seconds = state['Seconds'] if 'Seconds' in state else read_path(state['SecondsPath'], effective, context)
+            time.sleep(seconds * self.wait_scale)
+            return self._next(state), self._output(state, effective, context)
+        if state_type == 'Pass':
+            effective = self._input(state, data, context)
+            result = state['Result'] if 'Result' in state else self._parameters(state, effective, context)
+            return self._finish(state, data, result, context)
+        if state_type == 'Task':
+            return self._with_policies(name, state, data, lambda: self._task(state, data, context))
+        if state_type == 'Map':
+            return self._with_policies(name, state, data, lambda: self._map(state, data, context))
+        raise StateError('States.Runtime', f"Unsupported state type {state_type} in {name}")
+
+    def _input(self, state, data, context):
+        input_path = state.get('InputPath', '$')
+        return {} if input_path is None else read_path(input_path, data, context)
+
+    def _parameters(self, state, effective, context):
+        if 'Parameters' in state:
+            return resolve_parameters(state['Parameters'], effective, context)
+        return effective
+
+    def _output(self, state, data, context):
+        output_path = state.get('OutputPath', '$')
+        return {} if output_path is None else read_path(output_path, data, context)
+
+    def _finish(self, state, raw_input, result, context):
+        if 'ResultSelector' in state:
+            result = resolve_parameters(state['ResultSelector'], result, context)
+        result_path = state.get('ResultPath', '$')
+        combined = raw_input if result_path is None else write_path(raw_input, result_path, result)
+        return self._next(state), self._output(state, combined, context)
+
+    def _task(self, state, data, context):
+        payload = self._parameters(state, self._input(state, data, context), context)
+        resource = state['Resource']
+        if resource.endswith(':lambda:invoke'):
+            # Optimized integration: FunctionName and Payload come from Parameters, the result is wrapped
+            result = {'Payload': self.invoke(function_name(payload['FunctionName']), payload.get('Payload'))}
+        else:
+            result = self.invoke(function_name(resource), payload)
+        return self._finish(state, data, result, context)
+
+    def _map(self, state, data, context):
+        effective = self._input(state, data, context)
+        items = read_path(state.get('ItemsPath', '$'), effective, context)
+        processor = state.get('ItemProcessor') or state['Iterator']
+        selector = state.get('ItemSelector', state.get('Parameters'))
+        jobs = []
+        for index, item in enumerate(items):
+            item_context = dict(context, Map={'Item': {'Index': index, 'Value': item}})
+            item_input = resolve_parameters(selector, effective, item_context) if selector is not None else item
+            jobs.append((item_input, item_context))
+        concurrency = self.map_concurrency if self.map_concurrency is not None else state.get('MaxConcurrency', 0)
+        if not concurrency:
+            concurrency = MAX_INLINE_MAP_CONCURRENCY
+        results = self._run_iterations(processor, jobs, max(1, min(concurrency, len(jobs) or 1)))
+        return self._finish(state, data, results, context)
+
+    def _run_iterations(self, processor, jobs, concurrency):
+        if concurrency == 1:
+            return [self.run_states(processor, item_input, item_context) for item_input, item_context in jobs]
+        if self.executor == 'process':
+            with ProcessPoolExecutor(max_workers=concurrency) as pool:
+                futures = [pool.submit(_run_iteration, processor, item_input, item_context, self._options()) for item_input, item_context in jobs]
+                try:
+                    outcomes = [future.result() for future in futures]
+                finally:
+                    for future in futures:
+                        future.cancel()
+            for _, stats in outcomes:
+                self._merge_stats(stats)
+            return [output for output, _ in outcomes]
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            futures = [pool.submit(self.run_states, processor, item_input, item_context) for item_input, item_context in jobs]
+            try:
+                # The first failed iteration fails the whole Map
+                return [future.result() for future in futures]
+            finally:
+                for future in futures:
+                    future.cancel()
+
+    def _with_policies(self, name, state, data, action):
+        attempts = {}
+        while True:
+            try:
+                return action()
+            except StateError as error:
+                for index, retrier in enumerate(state.get('Retry', [])):
+                    if _error_matches(retrier['ErrorEquals'], error.error):
+                        break
+                else:
+                    index, retrier = None, None
+                if retrier is not None and attempts.get(index, 0) < retrier.get('MaxAttempts', 3):
+                    delay = retrier.get('IntervalSeconds', 1) * retrier.get('BackoffRate', 2.0) ** attempts.get(index, 0)
+                    delay = min(delay, retrier.get('MaxDelaySeconds', delay))
+                    attempts[index] = attempts.get(index, 0) + 1
+                    self._record(name, retries=1)
+                    print(f"{name} failed with {error.error}, retry {attempts[index]} in {delay}s")
+                    time.sleep(delay * self.wait_scale)
+                    continue
+                for catcher in state.get('Catch', []):
+                    if _error_matches(catcher['ErrorEquals'], error.error):
+                        print(f"{name} failed with {error.error}, caught by {catcher['Next']}")
+                        self._record(name, errors=1)
+                        result_path = catcher.get('ResultPath', '$')
+                        output = data if result_path is None else write_path(data, result_path, error.to_output())
+                        return catcher['Next'], output
+                raise
+
+def load_definition(path=DEFINITION_PATH):
+    with open(path) as f:
+        return json.load(f)
+
+if __name__ == '__main__':
+    # python local_runner.py input.json [--executor thread|process] [--concurrency N] [--no-wait]
+    import argparse
+    parser = argparse.ArgumentParser(description='Run StateMachine.json locally against the lambda_handler modules')
+    parser.add_argument('input', help='execution input JSON file')
+    parser.add_argument('--definition', default=DEFINITION_PATH)
+    parser.add_argument('--executor', choices=['thread', 'process'], default='thread')
+    parser.add_argument('--concurrency', type=int, help='override MaxConcurrency of every Map state')
+    parser.add_argument('--resource', action='append', default=[], metavar='NAME=MODULE:FUNCTION',
+                        help='replace a Lambda with another handler, e.g. GenerateEmbeddings=my_stub:handler')
+    parser.add_argument('--no-wait', action='store_true', help='skip Retry and Wait delays')
+    args = parser.parse_args()
+    with open(args.input) as f:
+        execution_input = json.load(f)
+    runner = StateMachineRunner(
+        load_definition(args.definition),
+        executor=args.executor,
+        map_concurrency=args.concurrency,
+        resources=dict(resource.split('=', 1) for resource in args.resource),
+        wait_scale=0 if args.no_wait else 1.0
+    )
+    result = runner.run(execution_input)
+    print(json.dumps(result, indent=2, default=str))
+    sys.exit(0 if result['status'] == 'SUCCEEDED' else 1)
@@ -0,0 +1,101 @@
+import os
+import embedding_format
+
+# Exported per-PDF matrices live at s3://VECTOR_BUCKET/<VECTOR_PREFIX><pdf_id>/vectors/<ingest_version>.bin;
+# StoreEmbeddings writes them to the bucket the PDF was ingested from, uploadPDFToS3.BUCKET_NAME
+VECTOR_BUCKET = os.getenv('VECTOR_BUCKET', 'isckrs-conference-rawdata2')
+VECTOR_PREFIX = os.getenv('VECTOR_PREFIX', 'PDF_Upload/')
+CACHE_DIR = os.getenv('VECTOR_CACHE_DIR', '/tmp/vectors')
+# Lambda's /tmp is small, so keep the local cache bounded
+CACHE_MAX_BYTES = int(os.getenv('VECTOR_CACHE_MAX_BYTES', 256 * 1024 * 1024))
+
+# pdf_id -> (ingest_version, metadata, memory-mapped matrix)
+_open_stores = {}
+
+def vectors_key(pdf_id, ingest_version, prefix=VECTOR_PREFIX):
+    return f"{prefix}{pdf_id}/vectors/{ingest_version}.bin"
+
+def export_pdf_vectors(s3, bucket, pdf_id, ingest_version, chunks, embeddings, prefix=VECTOR_PREFIX):
+    """Write one PDF's unit-normalized float32 matrix so dot products give cosine similarity"""
+    import numpy as np
+    matrix = np.asarray(embeddings, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    matrix = matrix / np.where(norms == 0, 1, norms)
+    metadata = {'pdf_id': pdf_id, 'ingest_version': ingest_version, 'chunks': chunks}
+    key = vectors_key(pdf_id, ingest_version, prefix)
+    s3.put_object(Bucket=bucket, Key=key, Body=embedding_format.encode(metadata, matrix))
+    return key
+
+def _evict(keep_path):
+    files = [os.path.join(CACHE_DIR, name) for name in os.listdir(CACHE_DIR)]
+    files.sort(key=os.path.getmtime)
+    total = sum(os.path.getsize(path) for path in files)
+    for path in files:
+        if total <= CACHE_MAX_BYTES:
+            break
+        if path != keep_path:
+            total -= os.path.getsize(path)
+            os.remove(path)
+
+def _download(pdf_id, ingest_version, path):
+    import boto3
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    # A new ingest version invalidates every older file of the same PDF
+    for name in os.listdir(CACHE_DIR):
+        if name.startswith(f"{pdf_id}_"):
+            os.remove(os.path.join(CACHE_DIR, name))
+    partial_path = path + '.part'
+    boto3.client('s3').download_file(VECTOR_BUCKET, vectors_key(pdf_id, ingest_version), partial_path)
+    os.replace(partial_path, path)
+    _evict(path)
+
+def load(pdf_id, ingest_version):
+    cached = _open_stores.get(pdf_id)
+    if cached and cached[0] == ingest_version:
+        return cached
+    path = os.path.join(CACHE_DIR, f"{pdf_id}_{ingest_version}.bin")
+    if not os.path.exists(path):
+        _download(pdf_id, ingest_version, path)
+    metadata, matrix = embedding_format.open_memmap(path)
+    _open_stores[pdf_id] = (ingest_version, metadata, matrix)
+    return _open_stores[pdf_id]
+
+def _nearest(matrix, query_embedding, limit):
+    """Row positions of the limit best cosine scores, best first, and all scores"""
+    import numpy as np
+    query = np.asarray(query_embedding, dtype=np.float32)
+    query /= np.linalg.norm(query) or 1
+    scores = matrix @ query
+    if limit < len(scores):
+        top = np.argpartition(-scores, limit)[:limit]
+    else:
+        top = np.arange(len(scores))
+    return top[np.argsort(-scores[top])], scores
+
+def search(query_embedding, pdf_id, ingest_version, limit=1):
+    """Exact top-k by cosine similarity over the PDF's memory-mapped matrix"""
+    _, metadata, matrix = load(pdf_id, ingest_version)
+    top, scores = _nearest(matrix, query_embedding, limit)
+    chunks = metadata['chunks']
+    return [(chunks[index]['text'], float(scores[index])) for index in top]
+
+def context_rows(query_embedding, pdf_id, ingest_version, top_k=1, neighbours=0):
+    """Top hits and their neighbouring chunks, in the row shape context_assembly.assemble takes"""
+    _, metadata, matrix = load(pdf_id, ingest_version)
+    top, _ = _nearest(matrix, query_embedding, top_k)
+    chunks = metadata['chunks']
+    texts = {chunk['chunk_index']: chunk['text'] for chunk in chunks}
+    rows = []
+    for hit_rank, position in enumerate(top, start=1):
+        hit_index = chunks[position]['chunk_index']
+        for chunk_index in range(hit_index - neighbours, hit_index + neighbours + 1):
+            if chunk_index in texts:
+                rows.append({
+                    'hit_rank': hit_rank, 'hit_distance': abs(chunk_index - hit_index),
+                    'pdf_id': pdf_id, 'chunk_index': chunk_index, 'content': texts[chunk_index]
+                })
+    return rows
+
+def find_most_relevant_content(query_embedding, pdf_id, ingest_version, limit=1):
+    results = search(query_embedding, pdf_id, ingest_version, limit)
+    return results[0][0] if results else None
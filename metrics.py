@@ -0,0 +1,203 @@
+import contextlib
+import contextvars
+import functools
+import json
+import os
+import random
+import sys
+import threading
+import time
+
+# One CloudWatch embedded-metric-format (EMF) record is printed per invocation; CloudWatch turns it into metrics
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'true').lower() == 'true'
+METRICS_NAMESPACE = os.getenv('METRICS_NAMESPACE', 'PDFChat')
+# Opt-in sampling profiler: the fraction of invocations to profile, and how often to sample their stack
+PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', 0))
+PROFILE_INTERVAL = float(os.getenv('PROFILE_INTERVAL', 0.005))
+# Comma-separated span names that get their own profile in sampled invocations; the whole handler is always profiled
+PROFILE_SPANS = {name for name in os.getenv('PROFILE_SPANS', '').split(',') if name}
+PROFILE_TOP_FRAMES = 15
+# EMF allows at most 100 values per metric in one record
+MAX_VALUES_PER_METRIC = 100
+
+# Functions that already ran in this process; local_runner hosts several handlers in one
+_warm_functions = set()
+_current = contextvars.ContextVar('metrics', default=None)
+
+class Profiler:
+    """Sample one thread's stack from a background thread and count the frames seen"""
+
+    def __init__(self, thread_id, interval=PROFILE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples = 0
+        self.self_counts = {}
+        self.total_counts = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    @staticmethod
+    def _label(frame):
+        code = frame.f_code
+        return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            self.samples += 1
+            label = self._label(frame)
+            self.self_counts[label] = self.self_counts.get(label, 0) + 1
+            seen = set()
+            while frame is not None:
+                label = self._label(frame)
+                if label not in seen:
+                    seen.add(label)
+                    self.total_counts[label] = self.total_counts.get(label, 0) + 1
+                frame = frame.f_back
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        top = lambda counts: sorted(counts.items(), key=lambda item: -item[1])[:PROFILE_TOP_FRAMES]
+        return {
+            'samples': self.samples,
+            'interval_ms': self.interval * 1000,
+            'self': top(self.self_counts),
+            'cumulative': top(self.total_counts)
+        }
+
+class Metrics:
+    """Spans, counters and properties of one invocation, flushed as a single EMF record"""
+
+    def __init__(self, function_name, profiled=False):
+        self.function_name = function_name
+        self.profiled = profiled
+        self.values = {}
+        self.units = {}
+        self.properties = {}
+        self.profiles = {}
+        self._lock = threading.Lock()
+
+    def put(self, name, value, unit='Count'):
+        with self._lock:
+            self.values.setdefault(name, []).append(value)
+            self.units[name] = unit
+
+    def add(self, name, value=1, unit='Count'):
+        """Accumulate into a single value, e.g. bytes read across many S3 GETs"""
+        with self._lock:
+            values = self.values.setdefault(name, [0])
+            values[0] += value
+            self.units[name] = unit
+
+    @contextlib.contextmanager
+    def span(self, name):
+        profiler = Profiler(threading.get_ident()).start() if self.profiled and name in PROFILE_SPANS else None
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.put(name, round((time.perf_counter() - start) * 1000, 3), 'Milliseconds')
+            if profiler:
+                self.profiles[name] = profiler.stop()
+
+    def record(self):
+        metrics = [{'Name': name, 'Unit': self.units[name]} for name in self.values]
+        record = {
+            '_aws': {
+                'Timestamp': int(time.time() * 1000),
+                'CloudWatchMetrics': [{
+                    'Namespace': METRICS_NAMESPACE,
+                    'Dimensions': [['FunctionName']],
+                    'Metrics': metrics
+                }]
+            },
+            'FunctionName': self.function_name
+        }
+        for name, values in self.values.items():
+            values = values[:MAX_VALUES_PER_METRIC]
+            record[name] = values[0] if len(values) == 1 else values
+        record.update(self.properties)
+        if self.profiles:
+            record['Profile'] = self.profiles
+        return record
+
+    def flush(self):
+        # Property values may not be JSON types (UUIDs, NumPy scalars)
+        print(json.dumps(self.record(), default=str))
+
+class _NullMetrics(Metrics):
+    """Used outside an instrumented handler so library code can record unconditionally"""
+
+    def put(self, name, value, unit='Count'):
+        pass
+
+    def add(self, name, value=1, unit='Count'):
+        pass
+
+    @contextlib.contextmanager
+    def span(self, name):
+        yield
+
+_null = _NullMetrics('none')
+
+def current():
+    return _current.get() or _null
+
+def span(name):
+    return current().span(name)
+
+def put(name, value, unit='Count'):
+    current().put(name, value, unit)
+
+def add(name, value=1, unit='Count'):
+    current().add(name, value, unit)
+
+def set_property(key, value):
+    current().properties[key] = value
+
+def is_failure(result):
+    # Handlers catch their own exceptions and return a 5xx status, or a failed Lex fulfillment, instead
+    if not isinstance(result, dict):
+        return False
+    if result.get('dialogAction', {}).get('fulfillmentState') == 'Failed':
+        return True
+    return isinstance(result.get('statusCode'), int) and result['statusCode'] >= 500
+
+def instrument(function_name):
+    """Decorate a lambda_handler: times the invocation, flags cold starts, counts errors and flushes EMF"""
+    def decorator(handler):
+        @functools.wraps(handler)
+        def wrapper(event, context):
+            if not METRICS_ENABLED:
+                return handler(event, context)
+            profiled = PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+            metrics = Metrics(function_name, profiled)
+            metrics.put('ColdStart', 0 if function_name in _warm_functions else 1)
+            _warm_functions.add(function_name)
+            request_id = getattr(context, 'aws_request_id', None)
+            if request_id:
+                metrics.properties['RequestId'] = request_id
+            token = _current.set(metrics)
+            profiler = Profiler(threading.get_ident()).start() if profiled else None
+            start = time.perf_counter()
+            failed = True
+            try:
+                result = handler(event, context)
+                failed = is_failure(result)
+                return result
+            finally:
+                metrics.put('Duration', round((time.perf_counter() - start) * 1000, 3), 'Milliseconds')
+                metrics.put('Errors', 1 if failed else 0)
+                if profiler:
+                    metrics.profiles['handler'] = profiler.stop()
+                _current.reset(token)
+                metrics.flush()
+        return wrapper
+    return decorator
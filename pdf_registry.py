@@ -0,0 +1,121 @@
+import hashlib
+import os
+import uuid
+
+# Content-addressed pdf_ids: uuid5(PDF_ID_NAMESPACE, "<client_id>:<sha256 of the file>")
+PDF_ID_NAMESPACE = uuid.uuid5(uuid.NAMESPACE_URL, 'pdfchat/pdf_documents')
+# A run still 'processing' after this long is assumed to have failed and may be restarted
+INGEST_LEASE_SECONDS = int(os.getenv('INGEST_LEASE_SECONDS', 900))
+
+# Files are hashed a block at a time rather than read into memory whole
+HASH_BLOCK_BYTES = 1024 * 1024
+
+READY = 'ready'
+PROCESSING = 'processing'
+STARTED = 'started'
+FAILED = 'failed'
+
+def content_sha256(data):
+    return hashlib.sha256(data).hexdigest()
+
+def stream_sha256(blocks):
+    """SHA-256 of an iterable of byte blocks"""
+    digest = hashlib.sha256()
+    for block in blocks:
+        digest.update(block)
+    return digest.hexdigest()
+
+def content_pdf_id(client_id, content_hash):
+    """Same client and same bytes always map to the same pdf_id"""
+    return str(uuid.uuid5(PDF_ID_NAMESPACE, f"{client_id}:{content_hash}"))
+
+def claim_ingest(conn, pdf_id, client_id, content_hash, lease_seconds=INGEST_LEASE_SECONDS):
+    """Register an upload and decide whether to run the pipeline.
+
+    Returns a dict whose status is 'started' when this caller should run ingestion, 'ready' when the
+    same content is already indexed, or 'processing' when another run holds a live lease.
+    """
+    with conn.cursor() as cur:
+        # A new pdf_id, changed content, a failed run or an expired lease claims the row; anything else leaves it alone
+        cur.execute("""
+            INSERT INTO pdf_documents (pdf_id, client_id, content_hash, status)
+            VALUES (%s, %s, %s, 'processing')
+            ON CONFLICT (pdf_id) DO UPDATE
+                SET status = 'processing', content_hash = EXCLUDED.content_hash, upload_id = NULL, updated_at = now()
+                WHERE pdf_documents.content_hash IS DISTINCT FROM EXCLUDED.content_hash
+                   OR pdf_documents.status = 'failed'
+                   OR (pdf_documents.status <> 'ready'
+                       AND pdf_documents.updated_at < now() - make_interval(secs => %s))
+            RETURNING pdf_id
+        """, (pdf_id, client_id, content_hash, lease_seconds))
+        if cur.fetchone() is not None:
+            conn.commit()
+            return {'status': STARTED, 'chunk_count': None, 'ingest_version': None}
+        cur.execute("SELECT status, chunk_count, ingest_version FROM pdf_documents WHERE pdf_id = %s", (pdf_id,))
+        status, chunk_count, ingest_version = cur.fetchone()
+    conn.commit()
+    return {
+        'status': READY if status == READY else PROCESSING,
+        'chunk_count': chunk_count,
+        'ingest_version': ingest_version
+    }
+
+def attach_upload(conn, pdf_id, upload_id):
+    """Tie a claimed ingest to the presigned multipart upload that delivers its file"""
+    with conn.cursor() as cur:
+        cur.execute(
+            "UPDATE pdf_documents SET upload_id = %s, updated_at = now() WHERE pdf_id = %s AND status = 'processing'",
+            (upload_id, pdf_id)
+        )
+    conn.commit()
+
+def renew_upload_claim(conn, pdf_id, client_id, upload_id, lease_seconds=INGEST_LEASE_SECONDS):
+    """Renew the claim held by upload_id while its upload is completed.
+
+    Returns a dict like claim_ingest plus the claimed content_hash: 'started' while the claim is live and tied to
+    upload_id, 'ready' when the PDF is already indexed, and 'processing' when the claim expired or belongs to
+    another upload.
+    """
+    with conn.cursor() as cur:
+        cur.execute("""
+            UPDATE pdf_documents SET updated_at = now()
+            WHERE pdf_id = %s AND client_id = %s AND upload_id = %s AND status = 'processing'
+                AND updated_at >= now() - make_interval(secs => %s)
+            RETURNING content_hash
+        """, (pdf_id, client_id, upload_id, lease_seconds))
+        row = cur.fetchone()
+        if row is not None:
+            conn.commit()
+            return {'status': STARTED, 'chunk_count': None, 'ingest_version': None, 'content_hash': row[0]}
+        cur.execute("SELECT status, chunk_count, ingest_version FROM pdf_documents WHERE pdf_id = %s", (pdf_id,))
+        status, chunk_count, ingest_version = cur.fetchone() or (None, None, None)
+    conn.commit()
+    return {
+        'status': READY if status == READY else PROCESSING,
+        'chunk_count': chunk_count,
+        'ingest_version': ingest_version,
+        'content_hash': None
+    }
+
+def mark_ready(cur, pdf_id, client_id, chunk_count, ingest_version):
+    """Record a finished ingest in the caller's transaction"""
+    cur.execute("""
+        INSERT INTO pdf_documents (pdf_id, client_id, status, chunk_count, ingest_version)
+        VALUES (%s, %s, 'ready', %s, %s)
+        ON CONFLICT (pdf_id) DO UPDATE
+            SET status = 'ready', chunk_count = EXCLUDED.chunk_count,
+                ingest_version = EXCLUDED.ingest_version, updated_at = now()
+    """, (pdf_id, client_id, chunk_count, ingest_version))
+
+
+def mark_failed(cur, pdf_id):
+    """Record a run that cannot finish, so the next upload of the PDF claims it without waiting for the lease"""
+    cur.execute("UPDATE pdf_documents SET status = 'failed', updated_at = now() WHERE pdf_id = %s AND status <> 'ready'", (pdf_id,))
+
+def bump_version(cur, pdf_id, client_id, ingest_version):
+    """Give the PDF a new ingest_version after chunks are written outside a full ingest, leaving its status alone"""
+    cur.execute("""
+        INSERT INTO pdf_documents (pdf_id, client_id, status, ingest_version)
+        VALUES (%s, %s, 'processing', %s)
+        ON CONFLICT (pdf_id) DO UPDATE SET ingest_version = EXCLUDED.ingest_version
+    """, (pdf_id, client_id, ingest_version))
\ No newline at end of file
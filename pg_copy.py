@@ -0,0 +1,135 @@
+import struct
+import sys
+import uuid
+from array import array
+from chunk_partitions import CHUNK_KEY_COLUMNS
+from embedding_format import to_vector_literal
+
+# Columns written to pdf_chunks by the bulk ingestion path
+PDF_CHUNK_COLUMNS = ('pdf_id', 'chunk_index', 'file_path', 'content', 'content_embedding', 'client_id', 'is_pdf_chat', 'page_start', 'page_end')
+
+COPY_SIGNATURE = b'PGCOPY\n\xff\r\n\x00'
+
+def encode_uuid(value):
+    return uuid.UUID(str(value)).bytes
+
+def encode_int(value):
+    return struct.pack('!i', value)
+
+def encode_text(value):
+    return value.encode('utf-8')
+
+def encode_bool(value):
+    return b'\x01' if value else b'\x00'
+
+def encode_vector(values):
+    """pgvector binary format: int16 dimensions, int16 unused, then big-endian float4 values"""
+    if hasattr(values, 'astype'):
+        # NumPy rows from packed embedding batches convert without a Python float round trip
+        return struct.pack('!hh', len(values), 0) + values.astype('>f4').tobytes()
+    floats = array('f', values)
+    if sys.byteorder == 'little':
+        floats.byteswap()
+    return struct.pack('!hh', len(floats), 0) + floats.tobytes()
+
+PDF_CHUNK_ENCODERS = (encode_uuid, encode_int, encode_text, encode_text, encode_vector, encode_uuid, encode_bool, encode_int, encode_int)
+
+class BinaryCopyStream:
+    """File-like object that encodes rows into PostgreSQL binary COPY format as it is read"""
+
+    def __init__(self, rows, encoders=PDF_CHUNK_ENCODERS):
+        self._rows = iter(rows)
+        self._encoders = encoders
+        self._buffer = bytearray(COPY_SIGNATURE + struct.pack('!ii', 0, 0))
+        self._finished = False
+        self.row_count = 0
+        self.byte_count = 0
+
+    def _encode_row(self, row):
+        self._buffer += struct.pack('!h', len(row))
+        for value, encoder in zip(row, self._encoders):
+            if value is None:
+                self._buffer += struct.pack('!i', -1)
+                continue
+            data = encoder(value)
+            self._buffer += struct.pack('!i', len(data))
+            self._buffer += data
+        self.row_count += 1
+
+    def read(self, size=-1):
+        while not self._finished and (size < 0 or len(self._buffer) < size):
+            row = next(self._rows, None)
+            if row is None:
+                self._buffer += struct.pack('!h', -1)
+                self._finished = True
+            else:
+                self._encode_row(row)
+        if size < 0:
+            size = len(self._buffer)
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        self.byte_count += len(data)
+        return data
+
+def _escape_text(value):
+    if value is None:
+        return '\\N'
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    # NumPy rows would otherwise fall through to str(), which is space separated and elided with '...'
+    if isinstance(value, (list, tuple, array)) or hasattr(value, 'tolist'):
+        return to_vector_literal(value)
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+class TextCopyStream:
+    """Text COPY format fallback for servers or columns without binary support"""
+
+    def __init__(self, rows):
+        self._lines = ('\t'.join(_escape_text(value) for value in row) + '\n' for row in rows)
+        self._buffer = ''
+        self.row_count = 0
+
+    def read(self, size=-1):
+        while size < 0 or len(self._buffer) < size:
+            line = next(self._lines, None)
+            if line is None:
+                break
+            self._buffer += line
+            self.row_count += 1
+        if size < 0:
+            size = len(self._buffer)
+        data = self._buffer[:size]
+        self._buffer = self._buffer[size:]
+        return data
+
+def copy_rows(cur, rows, table='pdf_chunks', columns=PDF_CHUNK_COLUMNS, encoders=PDF_CHUNK_ENCODERS, binary=True):
+    """Load rows with a single COPY ... FROM STDIN and return the number of rows written"""
+    column_list = ', '.join(columns)
+    if binary:
+        stream = BinaryCopyStream(rows, encoders)
+        cur.copy_expert(f"COPY {table} ({column_list}) FROM STDIN WITH (FORMAT binary)", stream)
+    else:
+        stream = TextCopyStream(rows)
+        cur.copy_expert(f"COPY {table} ({column_list}) FROM STDIN", stream)
+    return stream.row_count
+
+def upsert_rows(cur, rows, key_columns=CHUNK_KEY_COLUMNS, table='pdf_chunks', columns=PDF_CHUNK_COLUMNS, encoders=PDF_CHUNK_ENCODERS, binary=True):
+    """COPY rows into a temporary staging table, then merge them into table on key_columns.
+
+    Rows that already exist with identical values are left untouched, so retries do not create dead tuples.
+    """
+    staging = f"{table}_staging"
+    column_list = ', '.join(columns)
+    key_list = ', '.join(key_columns)
+    update_columns = [column for column in columns if column not in key_columns]
+    cur.execute(f"CREATE TEMP TABLE {staging} ON COMMIT DROP AS SELECT {column_list} FROM {table} WITH NO DATA")
+    row_count = copy_rows(cur, rows, staging, columns, encoders, binary)
+    cur.execute(f"""
+        INSERT INTO {table} ({column_list})
+        SELECT DISTINCT ON ({key_list}) {column_list} FROM {staging} ORDER BY {key_list}
+        ON CONFLICT ({key_list}) DO UPDATE
+            SET {', '.join(f"{column} = EXCLUDED.{column}" for column in update_columns)}
+            WHERE ({', '.join(f"{table}.{column}" for column in update_columns)})
+                IS DISTINCT FROM ({', '.join(f"EXCLUDED.{column}" for column in update_columns)})
+    """)
+    return row_count
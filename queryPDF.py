@@ -1,10 +1,80 @@
 import json
-import boto3
 import os
-import psycopg2
-from psycopg2.extras import DictCursor
-from helper_functions import get_embedding, find_most_relevant_content, process_user_query, create_response_card
+import time
+from db_connection import connection, get_stats
+import local_vector_store
+import metrics
+from answer_cache import answer_cache, is_cacheable
+from context_assembly import CONTEXT_NEIGHBOURS, CONTEXT_TOP_K, assemble
+from helper_functions import get_embedding, find_relevant_context, process_user_query, create_response_card, query_embedding_cache, QUERY_ERROR_MESSAGE
 
+# 'pgvector' queries Postgres, 'mmap' serves single-PDF chat from a memory-mapped local matrix
+RETRIEVAL_BACKEND = os.getenv('RETRIEVAL_BACKEND', 'pgvector')
+# 'vector' ranks by embedding distance only, 'hybrid' fuses it with full-text search
+RETRIEVAL_MODE = os.getenv('RETRIEVAL_MODE', 'vector')
+# 'sync' runs each step after the previous one; 'async' overlaps them with asyncio, asyncpg and the async OpenAI client
+QUERY_PIPELINE = os.getenv('QUERY_PIPELINE', 'sync')
+
+def find_context(user_query, query_embedding, is_pdf_chat, pdf_id, ingest_version, client_id=None):
+    """Top hits plus neighbouring chunks, deduplicated and packed into CONTEXT_TOKEN_BUDGET"""
+    context = None
+    use_local_backend = RETRIEVAL_BACKEND == 'mmap' and is_pdf_chat and bool(ingest_version)
+    if use_local_backend:
+        try:
+            with metrics.span('LocalSearch'):
+                rows = local_vector_store.context_rows(query_embedding, pdf_id, ingest_version, CONTEXT_TOP_K, CONTEXT_NEIGHBOURS)
+                context = assemble(rows)
+        except Exception as e:
+            # Fall back to pgvector if the exported matrix is missing or unreadable
+            print(f"Local vector search failed, falling back to pgvector: {e}")
+            use_local_backend = False
+    
+    if not use_local_backend:
+        # Imported here so the mmap backend and answer cache hits never load psycopg2
+        from psycopg2.extras import DictCursor
+        # A PDF belongs to one client, so its client_id prunes the search to that tenant's partition
+        tenant = client_id if is_pdf_chat else None
+        # Reuse a warm connection to the PostgreSQL database across invocations
+        with connection() as conn:
+            with metrics.span('VectorQuery'), conn.cursor(cursor_factory=DictCursor) as cur:
+                # Hits and their neighbouring chunks come back in one round trip
+                context = find_relevant_context(
+                    user_query, query_embedding, cur, "pdf_chunks", pdf_id if is_pdf_chat else None, tenant, RETRIEVAL_MODE
+                )
+        print(f"DB connection stats: {get_stats()}")
+    
+    if not context or not context.text:
+        print("No relevant content found in the database")
+        return ""
+    metrics.add('ContextChunks', context.chunks)
+    metrics.add('ContextTokens', context.tokens)
+    return context.text
+
+def answer_sequential(user_query, is_pdf_chat, pdf_id, ingest_version, client_id=None):
+    # Get embedding for user query
+    with metrics.span('QueryEmbedding'):
+        query_embedding = get_embedding(user_query)
+    if query_embedding is None:
+        raise ValueError("Failed to generate embedding for user query")
+    print(f"Query embedding cache: {query_embedding_cache.report()}")
+    
+    # Near-duplicate questions about the same PDF reuse an earlier answer
+    cacheable = is_cacheable(is_pdf_chat, ingest_version)
+    answer = answer_cache.lookup(pdf_id, query_embedding, ingest_version) if cacheable else None
+    if cacheable:
+        metrics.put('AnswerCacheHit', 0 if answer is None else 1)
+    
+    if answer is None:
+        start = time.perf_counter()
+        closest_content = find_context(user_query, query_embedding, is_pdf_chat, pdf_id, ingest_version, client_id)
+        metrics.add('ContextBytes', len(closest_content.encode('utf-8')), 'Bytes')
+        with metrics.span('Completion'):
+            answer = process_user_query(user_query, closest_content, is_pdf_chat)
+        if cacheable and answer != QUERY_ERROR_MESSAGE:
+            answer_cache.store(pdf_id, query_embedding, answer, time.perf_counter() - start, ingest_version)
+    return answer
+
+@metrics.instrument('queryPDF')
 def lambda_handler(event, context):
     print(f"Received event: {json.dumps(event)}")
     
@@ -15,6 +85,8 @@ def lambda_handler(event, context):
     is_pdf_chat = session_attributes.get('is_pdf_chat') == 'true'
     processing_complete = session_attributes.get('processing_complete') == 'true'
     pdf_id = session_attributes.get('pdf_id')
+    ingest_version = session_attributes.get('ingest_version')
+    client_id = session_attributes.get('client_id')
     
     print(f"Session attributes: {json.dumps(session_attributes)}")
     print(f"is_pdf_chat: {is_pdf_chat}, processing_complete: {processing_complete}, pdf_id: {pdf_id}")
@@ -33,33 +105,16 @@ def lambda_handler(event, context):
         }
     
     try:
-        # Get embedding for user query
-        query_embedding = get_embedding(user_query)
-        if query_embedding is None:
-            raise ValueError("Failed to generate embedding for user query")
-        
-        # Connect to the PostgreSQL database
-        db_params = {
-            'dbname': os.getenv('DB_NAME'),
-            'user': os.getenv('DB_USER'),
-            'password': os.getenv('DB_PASSWORD'),
-            'host': os.getenv('DB_HOST'),
-            'port': os.getenv('DB_PORT')
-        }
-        print(f"Attempting to connect to database: {db_params['dbname']} on host: {db_params['host']}")
-        
-        with psycopg2.connect(**db_params) as conn:
-            with conn.cursor(cursor_factory=DictCursor) as cur:
-                if is_pdf_chat:
-                    closest_content = find_most_relevant_content(query_embedding, cur, "pdf_chunks", pdf_id)
-                else:
-                    closest_content = find_most_relevant_content(query_embedding, cur, "pdf_chunks")
-        
-        if closest_content is None:
-            print("No relevant content found in the database")
-            closest_content = ""
-        
-        answer = process_user_query(user_query, closest_content, is_pdf_chat)
+        if QUERY_PIPELINE == 'async':
+            # Imported here so the default pipeline never loads asyncio or asyncpg
+            import query_pipeline
+            answer, report = query_pipeline.answer_query(
+                user_query, is_pdf_chat, pdf_id, ingest_version, RETRIEVAL_BACKEND, RETRIEVAL_MODE, client_id
+            )
+            print(f"Async query pipeline: {json.dumps(report)}")
+        else:
+            answer = answer_sequential(user_query, is_pdf_chat, pdf_id, ingest_version, client_id)
+        print(f"Answer cache: {answer_cache.report()}")
         
         return {
             'sessionAttributes': session_attributes,
@@ -0,0 +1,264 @@
+import asyncio
+import os
+import re
+import threading
+import time
+import local_vector_store
+import metrics
+import vector_index
+from answer_cache import answer_cache, is_cacheable
+from context_assembly import CONTEXT_NEIGHBOURS, CONTEXT_TOP_K, assemble, context_sql
+from db_connection import get_db_params
+from helper_functions import (
+    COMPLETION_PARAMS, EMBEDDING_DIMENSIONS, EMBEDDING_MODEL, HYBRID_CANDIDATES, OPENAI_API_KEY,
+    build_prompt, context_query, query_embedding_cache
+)
+
+# Per-step timeouts in seconds; a step that runs out falls back instead of failing the request
+EMBED_TIMEOUT = float(os.getenv('QUERY_EMBED_TIMEOUT', 5))
+DB_TIMEOUT = float(os.getenv('QUERY_DB_TIMEOUT', 3))
+SEARCH_TIMEOUT = float(os.getenv('QUERY_SEARCH_TIMEOUT', 3))
+COMPLETION_TIMEOUT = float(os.getenv('QUERY_COMPLETION_TIMEOUT', 20))
+# asyncpg connections kept per Lambda container
+POOL_SIZE = int(os.getenv('QUERY_ASYNC_POOL_SIZE', 2))
+
+FALLBACK_ANSWER_WORDS = 80
+_PLACEHOLDER = re.compile(r"%\((\w+)\)s|%s")
+
+# Full-text fallback when the query embedding is unavailable
+TEXT_SEARCH_SQL = """
+    SELECT pdf_id, client_id, chunk_index, -ts_rank_cd(content_tsv, query) AS rank_key
+    FROM {table}, CAST(replace(plainto_tsquery('english', %(query)s)::text, '&', '|') AS tsquery) AS query
+    WHERE content_tsv @@ query {pdf_filter}
+    ORDER BY rank_key
+    LIMIT %(limit)s
+"""
+
+# The event loop, asyncpg pool and async OpenAI client are bound to a thread and survive warm invocations
+_state = threading.local()
+
+def to_asyncpg(sql, params):
+    """Rewrite psycopg2 %s / %(name)s placeholders as $n and return (sql, args)"""
+    args = []
+    positions = {}
+
+    def replace(match):
+        name = match.group(1)
+        if name is None:
+            args.append(params[len(args)])
+            return f"${len(args)}"
+        if name not in positions:
+            args.append(params[name])
+            positions[name] = len(args)
+        return f"${positions[name]}"
+    return _PLACEHOLDER.sub(replace, sql), args
+
+def _event_loop():
+    loop = getattr(_state, 'loop', None)
+    if loop is None or loop.is_closed():
+        loop = _state.loop = asyncio.new_event_loop()
+        _state.pool = None
+        _state.client = None
+    return loop
+
+def _openai_client():
+    if _state.client is None:
+        import openai
+        _state.client = openai.AsyncOpenAI(api_key=OPENAI_API_KEY)
+    return _state.client
+
+async def _init_connection(conn):
+    # Send and receive pgvector values as text, the same literal the psycopg2 path uses
+    schema = await conn.fetchval("SELECT typnamespace::regnamespace::text FROM pg_type WHERE typname = 'vector'")
+    await conn.set_type_codec('vector', schema=schema, encoder=str, decoder=str, format='text')
+
+async def _pool():
+    if _state.pool is None:
+        import asyncpg
+        params = get_db_params()
+        _state.pool = await asyncpg.create_pool(
+            database=params['dbname'],
+            user=params['user'],
+            password=params['password'],
+            host=params['host'],
+            port=int(params['port']) if params['port'] else None,
+            timeout=params['connect_timeout'],
+            min_size=1,
+            max_size=POOL_SIZE,
+            init=_init_connection
+        )
+    return _state.pool
+
+class StepTimer:
+    """Times each pipeline step so the overlap can be compared with running them back to back"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.steps = {}
+
+    async def run(self, name, awaitable, timeout):
+        start = time.perf_counter()
+        try:
+            return await asyncio.wait_for(awaitable, timeout)
+        finally:
+            elapsed = (time.perf_counter() - start) * 1000
+            self.steps[name] = round(elapsed, 3)
+            metrics.put(name, round(elapsed, 3), 'Milliseconds')
+
+    def report(self):
+        wall_ms = (time.perf_counter() - self.started) * 1000
+        sequential_ms = sum(self.steps.values())
+        return {
+            'steps_ms': self.steps,
+            'wall_ms': round(wall_ms, 3),
+            'sequential_ms': round(sequential_ms, 3),
+            # Time the request would have spent waiting had the steps run one after another
+            'overlap_saved_ms': round(max(0.0, sequential_ms - wall_ms), 3)
+        }
+
+async def _embed(text):
+    # The shared cache tier makes blocking psycopg2 round trips, so keep them off the event loop
+    embedding = await asyncio.to_thread(query_embedding_cache.lookup, text)
+    if embedding is None:
+        response = await _openai_client().embeddings.create(input=[text], model=EMBEDDING_MODEL, dimensions=EMBEDDING_DIMENSIONS)
+        embedding = response.data[0].embedding
+        await asyncio.to_thread(query_embedding_cache.store, text, embedding)
+    return embedding
+
+async def _acquire():
+    pool = await _pool()
+    return await pool.acquire()
+
+def _search_query(user_query, query_embedding, pdf_id, retrieval_mode, client_id=None):
+    if query_embedding is None:
+        pdf_filter = ("AND pdf_id = %(pdf_id)s " if pdf_id else "") + ("AND client_id = %(client_id)s" if client_id else "")
+        sql = context_sql('pdf_chunks', TEXT_SEARCH_SQL.format(table='pdf_chunks', pdf_filter=pdf_filter))
+        params = {'query': user_query, 'pdf_id': pdf_id, 'client_id': client_id, 'limit': CONTEXT_TOP_K, 'neighbours': CONTEXT_NEIGHBOURS}
+        return to_asyncpg(sql, params), CONTEXT_TOP_K
+    sql, params = context_query(user_query, query_embedding, 'pdf_chunks', pdf_id, client_id, retrieval_mode)
+    return to_asyncpg(sql, params), HYBRID_CANDIDATES if retrieval_mode == 'hybrid' else CONTEXT_TOP_K
+
+async def _search(conn, user_query, query_embedding, pdf_id, retrieval_mode, client_id=None):
+    (sql, args), search_limit = _search_query(user_query, query_embedding, pdf_id, retrieval_mode, client_id)
+    async with conn.transaction():
+        lists = 1
+        if vector_index.INDEX_METHOD != 'hnsw':
+            if not hasattr(_state, 'ivfflat_lists'):
+                definition = await conn.fetchval("SELECT indexdef FROM pg_indexes WHERE indexname = $1", vector_index.INDEX_NAME)
+                _state.ivfflat_lists = vector_index.ivfflat_lists(definition) or 1
+            lists = _state.ivfflat_lists
+        for setting, value in vector_index.search_settings(search_limit, lists=lists).items():
+            await conn.execute(f"SET LOCAL {setting} = {int(value)}")
+        rows = await conn.fetch(sql, *args)
+    context = assemble(rows)
+    metrics.add('ContextChunks', context.chunks)
+    metrics.add('ContextTokens', context.tokens)
+    return context.text or None
+
+async def _local_search(query_embedding, pdf_id, ingest_version):
+    # The memory-mapped search is synchronous file and NumPy work, so keep it off the event loop
+    rows = await asyncio.to_thread(local_vector_store.context_rows, query_embedding, pdf_id, ingest_version, CONTEXT_TOP_K, CONTEXT_NEIGHBOURS)
+    context = assemble(rows)
+    metrics.add('ContextChunks', context.chunks)
+    metrics.add('ContextTokens', context.tokens)
+    return context.text or None
+
+async def _complete(user_query, context, is_pdf_chat):
+    response = await _openai_client().completions.create(prompt=build_prompt(user_query, context, is_pdf_chat), **COMPLETION_PARAMS)
+    return response.choices[0].text.strip()
+
+def fallback_answer(context):
+    """Answer with the retrieved passage itself when the completion model is unavailable"""
+    if not context:
+        return "I couldn't generate an answer right now. Please try again in a moment."
+    words = context.split()
+    excerpt = ' '.join(words[:FALLBACK_ANSWER_WORDS]) + (' …' if len(words) > FALLBACK_ANSWER_WORDS else '')
+    return f"• The most relevant passage I found: {excerpt}"
+
+async def _answer(user_query, is_pdf_chat, pdf_id, ingest_version, retrieval_backend, retrieval_mode, client_id, timer):
+    use_local_backend = retrieval_backend == 'mmap' and is_pdf_chat and bool(ingest_version)
+    search_pdf_id = pdf_id if is_pdf_chat else None
+    # The PDF's client_id is the partition key, so single-PDF searches touch one partition
+    search_client_id = client_id if is_pdf_chat else None
+    fallbacks = []
+    # Opening the database connection does not depend on the embedding, so both start at once
+    embed_task = asyncio.ensure_future(timer.run('QueryEmbedding', _embed(user_query), EMBED_TIMEOUT))
+    conn_task = None if use_local_backend else asyncio.ensure_future(timer.run('DbAcquire', _acquire(), DB_TIMEOUT))
+    conn = None
+    try:
+        try:
+            query_embedding = await embed_task
+        except Exception as e:
+            # Full-text search still works without an embedding
+            print(f"Query embedding failed, falling back to full-text search: {e!r}")
+            fallbacks.append('embedding')
+            query_embedding = None
+
+        cacheable = is_cacheable(is_pdf_chat, ingest_version) and query_embedding is not None
+        if cacheable:
+            answer = answer_cache.lookup(pdf_id, query_embedding, ingest_version)
+            metrics.put('AnswerCacheHit', 0 if answer is None else 1)
+            if answer is not None:
+                return answer, fallbacks
+
+        start = time.perf_counter()
+        context = None
+        searched_locally = False
+        if use_local_backend and query_embedding is not None:
+            try:
+                context = await timer.run('LocalSearch', _local_search(query_embedding, pdf_id, ingest_version), SEARCH_TIMEOUT)
+                searched_locally = True
+            except Exception as e:
+                print(f"Local vector search failed, falling back to pgvector: {e!r}")
+                fallbacks.append('local_search')
+        if not searched_locally:
+            try:
+                if conn_task is None:
+                    conn_task = asyncio.ensure_future(timer.run('DbAcquire', _acquire(), DB_TIMEOUT))
+                conn = await conn_task
+                context = await timer.run('VectorQuery', _search(conn, user_query, query_embedding, search_pdf_id, retrieval_mode, search_client_id), SEARCH_TIMEOUT)
+            except Exception as e:
+                print(f"Database search failed: {e!r}")
+                fallbacks.append('search')
+                if is_pdf_chat and ingest_version and query_embedding is not None and not use_local_backend:
+                    # The exported matrix answers single-PDF chat without Postgres
+                    try:
+                        context = await timer.run('LocalSearch', _local_search(query_embedding, pdf_id, ingest_version), SEARCH_TIMEOUT)
+                    except Exception as local_error:
+                        print(f"Local vector search fallback failed: {local_error!r}")
+        context = context or ""
+        metrics.add('ContextBytes', len(context.encode('utf-8')), 'Bytes')
+
+        try:
+            answer = await timer.run('Completion', _complete(user_query, context, is_pdf_chat), COMPLETION_TIMEOUT)
+        except Exception as e:
+            print(f"Completion failed, answering with the retrieved passage: {e!r}")
+            fallbacks.append('completion')
+            return fallback_answer(context), fallbacks
+
+        # Answers produced on a fallback path are not cached
+        if cacheable and not fallbacks:
+            answer_cache.store(pdf_id, query_embedding, answer, time.perf_counter() - start, ingest_version)
+        return answer, fallbacks
+    finally:
+        if conn_task is not None:
+            if conn is None and not conn_task.done():
+                conn_task.cancel()
+            try:
+                conn = conn or await conn_task
+            except BaseException:
+                conn = None
+        if conn is not None:
+            await _state.pool.release(conn)
+
+def answer_query(user_query, is_pdf_chat, pdf_id, ingest_version, retrieval_backend='pgvector', retrieval_mode='vector', client_id=None):
+    """Run the pipeline on this thread's event loop; returns (answer, report)"""
+    loop = _event_loop()
+    timer = StepTimer()
+    answer, fallbacks = loop.run_until_complete(
+        _answer(user_query, is_pdf_chat, pdf_id, ingest_version, retrieval_backend, retrieval_mode, client_id, timer)
+    )
+    report = dict(timer.report(), fallbacks=fallbacks)
+    metrics.put('OverlapSavedMs', report['overlap_saved_ms'], 'Milliseconds')
+    metrics.add('QueryFallbacks', len(fallbacks))
+    return answer, report
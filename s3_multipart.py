@@ -0,0 +1,85 @@
+import math
+import os
+
+# S3 needs every part but the last to be at least 5 MiB, and allows at most 10,000 parts
+MIN_PART_SIZE = 5 * 1024 * 1024
+MAX_PARTS = 10000
+PART_SIZE = max(int(os.getenv('UPLOAD_PART_SIZE', 8 * 1024 * 1024)), MIN_PART_SIZE)
+UPLOAD_URL_EXPIRY = int(os.getenv('UPLOAD_URL_EXPIRY', 3600))
+
+def part_size_for(size, part_size=PART_SIZE):
+    """Smallest part size >= part_size that fits size bytes into MAX_PARTS parts"""
+    return max(part_size, math.ceil(size / MAX_PARTS))
+
+class MultipartUpload:
+    """Write bytes to an S3 object in parts, holding at most about one part in memory.
+
+    Objects smaller than one part are written with a single put_object instead.
+    """
+
+    def __init__(self, s3, bucket, key, part_size=PART_SIZE):
+        self.s3 = s3
+        self.bucket = bucket
+        self.key = key
+        self.part_size = part_size
+        self.upload_id = None
+        self.parts = []
+        self.size = 0
+        self._buffer = bytearray()
+
+    def _upload_part(self, data):
+        if self.upload_id is None:
+            self.upload_id = self.s3.create_multipart_upload(Bucket=self.bucket, Key=self.key)['UploadId']
+        part_number = len(self.parts) + 1
+        response = self.s3.upload_part(
+            Bucket=self.bucket, Key=self.key, UploadId=self.upload_id, PartNumber=part_number, Body=data
+        )
+        self.parts.append({'PartNumber': part_number, 'ETag': response['ETag']})
+
+    def write(self, data):
+        self._buffer += data
+        self.size += len(data)
+        # Parts only need a minimum size, so the whole buffer goes out without slicing copies
+        if len(self._buffer) >= self.part_size:
+            self._upload_part(self._buffer)
+            self._buffer = bytearray()
+
+    def close(self):
+        if self.upload_id is None:
+            self.s3.put_object(Bucket=self.bucket, Key=self.key, Body=bytes(self._buffer))
+        else:
+            if self._buffer:
+                self._upload_part(self._buffer)
+            self.s3.complete_multipart_upload(
+                Bucket=self.bucket, Key=self.key, UploadId=self.upload_id, MultipartUpload={'Parts': self.parts}
+            )
+        self._buffer = bytearray()
+        return self.size
+
+    def abort(self):
+        if self.upload_id is not None:
+            self.s3.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id)
+        self._buffer = bytearray()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+def presign_parts(s3, bucket, key, upload_id, part_count, expires_in=UPLOAD_URL_EXPIRY):
+    """One presigned PUT URL per part so clients upload straight to S3"""
+    return [
+        {
+            'part_number': part_number,
+            'url': s3.generate_presigned_url(
+                'upload_part',
+                Params={'Bucket': bucket, 'Key': key, 'UploadId': upload_id, 'PartNumber': part_number},
+                ExpiresIn=expires_in
+            )
+        }
+        for part_number in range(1, part_count + 1)
+    ]
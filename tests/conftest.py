@@ -0,0 +1,50 @@
+import io
+import os
+import re
+import sys
+import pytest
+
+# Modules live at the repository root, as they do in each Lambda package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+@pytest.fixture
+def db():
+    """A connection to the DB_* database with the schema applied; the test is skipped when none is configured"""
+    if not os.getenv('DB_HOST'):
+        pytest.skip('DB_HOST is not set')
+    import psycopg2
+    from db_connection import get_db_params
+    from db_schema import apply_schema
+    conn = psycopg2.connect(**get_db_params())
+    apply_schema(conn)
+    try:
+        yield conn
+    finally:
+        conn.rollback()
+        conn.close()
+
+class FakeS3:
+    """Just enough of an S3 client for the ingest handlers: whole-object writes and inclusive byte-range GETs"""
+
+    def __init__(self):
+        self.objects = {}
+
+    def upload_fileobj(self, fileobj, bucket, key):
+        self.objects[key] = fileobj.read()
+
+    def put_object(self, Bucket, Key, Body):
+        self.objects[Key] = Body.encode('utf-8') if isinstance(Body, str) else Body
+
+    def get_object(self, Bucket, Key, Range=None):
+        from botocore.exceptions import ClientError
+        if Key not in self.objects:
+            raise ClientError({'Error': {'Code': 'NoSuchKey', 'Message': Key}}, 'GetObject')
+        body = self.objects[Key]
+        if Range:
+            start, end = map(int, re.fullmatch(r'bytes=(\d+)-(\d+)', Range).groups())
+            body = body[start:end + 1]
+        return {'Body': io.BytesIO(body), 'ContentLength': len(body)}
+
+@pytest.fixture
+def s3():
+    return FakeS3()
@@ -0,0 +1,14 @@
+from answer_cache import SemanticAnswerCache, is_cacheable
+
+def test_only_single_pdf_answers_with_a_version_are_cacheable():
+    assert is_cacheable(True, '1700000000000')
+    assert not is_cacheable(False, '1700000000000')
+    assert not is_cacheable(False, None)
+    assert not is_cacheable(True, None)
+
+def test_new_ingest_version_invalidates_cached_answers():
+    cache = SemanticAnswerCache(threshold=0.9)
+    cache.store('pdf', [1.0, 0.0], 'old answer', 1.0, '1')
+    assert cache.lookup('pdf', [1.0, 0.01], '1') == 'old answer'
+    assert cache.lookup('pdf', [1.0, 0.01], '2') is None
+    assert cache.stats['invalidations'] == 1
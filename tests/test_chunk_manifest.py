@@ -0,0 +1,50 @@
+import json
+
+from chunk_manifest import ManifestWriter, index_key, read_slice, write_index
+
+def write_manifest(records):
+    manifest = ManifestWriter()
+    for record in records:
+        manifest.add(record)
+    return manifest
+
+def records(count):
+    # Non-ASCII text makes byte offsets differ from character offsets
+    return [{'chunk_index': index, 'text': f'chunk {index} — naïve café ' * (index % 4 + 1)} for index in range(count)]
+
+def test_slices_cover_every_chunk_with_inclusive_byte_ranges(s3):
+    manifest = write_manifest(records(10))
+    size = manifest.upload(s3, 'bucket', 'manifest.ndjson')
+    body = s3.objects['manifest.ndjson']
+    assert size == len(body)
+
+    slices = manifest.slices(4)
+    assert [(s['first_chunk'], s['chunk_count']) for s in slices] == [(0, 4), (4, 4), (8, 2)]
+    assert slices[0]['byte_start'] == 0
+    assert slices[-1]['byte_end'] == size - 1
+    for previous, current in zip(slices, slices[1:]):
+        assert current['byte_start'] == previous['byte_end'] + 1
+    for s in slices:
+        data = body[s['byte_start']:s['byte_end'] + 1]
+        assert data.endswith(b'\n')
+        assert data.count(b'\n') == s['chunk_count']
+
+def test_read_slice_round_trips_the_records(s3):
+    chunks = records(7)
+    manifest = write_manifest(chunks)
+    manifest.upload(s3, 'bucket', 'manifest.ndjson')
+    read = []
+    for s in manifest.slices(3):
+        part = read_slice(s3, 'bucket', 'manifest.ndjson', s['byte_start'], s['byte_end'])
+        assert [chunk['chunk_index'] for chunk in part] == list(range(s['first_chunk'], s['first_chunk'] + s['chunk_count']))
+        read.extend(part)
+    assert read == chunks
+
+def test_single_chunk_slices_and_index(s3):
+    manifest = write_manifest(records(3))
+    manifest.upload(s3, 'bucket', 'm.ndjson')
+    slices = manifest.slices(1)
+    assert len(slices) == 3
+    assert read_slice(s3, 'bucket', 'm.ndjson', slices[1]['byte_start'], slices[1]['byte_end']) == [records(3)[1]]
+    write_index(s3, 'bucket', 'm.ndjson', slices)
+    assert json.loads(s3.objects[index_key('m.ndjson')]) == {'manifest_key': 'm.ndjson', 'slices': slices}
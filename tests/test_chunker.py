@@ -0,0 +1,85 @@
+import os
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+
+import fitz
+import pytest
+
+import SplitPDF
+from chunker import chunk_pages
+from tokenizer import count_tokens
+
+def count_words(text):
+    return len(text.split())
+
+def sentence_pages(page_count, sentences_per_page, words_per_sentence=5):
+    """Pages of sentences whose words name their page, e.g. 'p3s1w0'"""
+    return [
+        (page, [(' '.join(f'p{page}s{sentence}w{word}' for word in range(words_per_sentence)) + '.', ' ')
+                for sentence in range(sentences_per_page)])
+        for page in range(1, page_count + 1)
+    ]
+
+@pytest.fixture(scope='module')
+def pdf_path(tmp_path_factory):
+    path = tmp_path_factory.mktemp('pdf') / 'document.pdf'
+    document = fitz.open()
+    for page_number in range(1, 13):
+        page = document.new_page()
+        lines = [f'Page {page_number} sentence {n} talks about topic {n * page_number}. It ends here!' for n in range(8)]
+        lines.append(f'- bullet point on page {page_number}')
+        page.insert_text((50, 60), '\n'.join(lines), fontsize=9)
+    document.save(path)
+    document.close()
+    return str(path)
+
+def test_parallel_pages_match_sequential(pdf_path):
+    sequential = list(SplitPDF.iter_pdf_pages(pdf_path, workers=1))
+    parallel = list(SplitPDF.iter_pdf_pages(pdf_path, workers=3, min_parallel_pages=1))
+    assert [page for page, _ in sequential] == list(range(1, 13))
+    assert parallel == sequential
+
+def test_parallel_token_chunks_match_sequential(pdf_path):
+    sequential = list(chunk_pages(SplitPDF.iter_pdf_pages(pdf_path, workers=1), 40, 10))
+    parallel = list(chunk_pages(SplitPDF.iter_pdf_pages(pdf_path, workers=4, min_parallel_pages=1), 40, 10))
+    assert len(sequential) > 1
+    assert parallel == sequential
+
+def test_parallel_character_chunks_match_sequential(pdf_path):
+    sequential = list(SplitPDF.pack_chunks(SplitPDF.iter_pdf_segments(pdf_path, workers=1), 300))
+    parallel = list(SplitPDF.pack_chunks(SplitPDF.iter_pdf_segments(pdf_path, workers=4, min_parallel_pages=1), 300))
+    assert len(sequential) > 1
+    assert parallel == sequential
+
+def test_chunks_respect_the_token_cap(pdf_path):
+    chunks = list(chunk_pages(SplitPDF.iter_pdf_pages(pdf_path, workers=1), 40, 10))
+    assert all(chunk.token_count <= 40 for chunk in chunks)
+    # A segment longer than the cap is cut rather than emitted whole
+    long_sentence = [(1, [('word ' * 500, ' ')])]
+    assert all(count_tokens(chunk.text) <= 40 for chunk in chunk_pages(long_sentence, 40))
+
+def test_consecutive_chunks_overlap_by_the_overlap_tokens():
+    chunks = list(chunk_pages(sentence_pages(3, 6), 20, 10, count=count_words))
+    assert len(chunks) > 2
+    for chunk in chunks:
+        assert count_words(chunk.text) == chunk.token_count <= 20
+    for previous, chunk in zip(chunks, chunks[1:]):
+        assert chunk.text.split()[:10] == previous.text.split()[-10:]
+    # Every sentence lands in at least one chunk, in order
+    words = [word for chunk in chunks for word in chunk.text.split()]
+    expected = [word for _, segments in sentence_pages(3, 6) for piece, _ in segments for word in piece.split()]
+    assert sorted(set(words), key=words.index) == expected
+
+def test_no_overlap_when_overlap_tokens_is_zero():
+    chunks = list(chunk_pages(sentence_pages(3, 6), 20, 0, count=count_words))
+    words = [word for chunk in chunks for word in chunk.text.split()]
+    assert len(words) == len(set(words)) == 3 * 6 * 5
+
+def test_page_spans_cover_the_pages_of_each_chunk():
+    chunks = list(chunk_pages(sentence_pages(4, 3), 20, 5, count=count_words))
+    for chunk in chunks:
+        pages = [int(word[1:word.index('s')]) for word in chunk.text.split()]
+        assert (chunk.page_start, chunk.page_end) == (min(pages), max(pages))
+    assert chunks[0].page_start == 1
+    assert chunks[-1].page_end == 4
+    assert any(chunk.page_start != chunk.page_end for chunk in chunks)
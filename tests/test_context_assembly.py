@@ -0,0 +1,71 @@
+import pytest
+
+import tokenizer
+from context_assembly import PASSAGE_SEPARATOR, assemble, strip_overlap
+
+@pytest.fixture(autouse=True)
+def word_tokens(monkeypatch):
+    """Count one token per word so budgets in these tests are exact"""
+    monkeypatch.setattr(tokenizer, 'count_tokens', lambda text: len(text.split()))
+    monkeypatch.setattr(tokenizer, 'split_tokens', lambda text, max_tokens: [' '.join(text.split()[:max_tokens])])
+
+def row(hit_rank, hit_distance, chunk_index, content, pdf_id='pdf'):
+    return {'hit_rank': hit_rank, 'hit_distance': hit_distance, 'pdf_id': pdf_id, 'chunk_index': chunk_index, 'content': content}
+
+def words(prefix, count):
+    return ' '.join(f'{prefix}{n}' for n in range(count))
+
+def test_chunks_past_the_budget_are_left_out():
+    rows = [row(1, 0, 10, words('a', 6)), row(2, 0, 20, words('b', 6)), row(3, 0, 30, words('c', 3))]
+    context = assemble(rows, token_budget=10)
+    # The second hit does not fit, the smaller third one still does
+    assert context.text == words('a', 6) + PASSAGE_SEPARATOR + words('c', 3)
+    assert (context.chunks, context.tokens) == (2, 9)
+
+def test_best_hit_over_budget_keeps_its_start():
+    context = assemble([row(1, 0, 10, words('a', 50))], token_budget=8)
+    assert context.text == words('a', 8)
+    assert context.tokens == 8
+
+def test_neighbours_are_stitched_in_chunk_order_and_passages_by_best_hit():
+    rows = [
+        row(1, 0, 20, 'hit one'), row(1, 1, 19, 'before one'), row(1, 1, 21, 'after one'),
+        row(2, 0, 5, 'hit two'), row(2, 1, 4, 'before two'), row(2, 1, 6, 'after two'),
+    ]
+    context = assemble(rows, token_budget=100)
+    assert context.text.split(PASSAGE_SEPARATOR) == [
+        'before one\nhit one\nafter one',
+        'before two\nhit two\nafter two',
+    ]
+    assert context.chunks == 6
+
+def test_neighbours_of_a_hit_that_did_not_fit_are_skipped():
+    rows = [
+        row(1, 0, 10, words('a', 5)),
+        row(2, 0, 30, words('b', 9)), row(2, 1, 31, words('c', 2)),
+        row(3, 1, 51, words('d', 2)),
+    ]
+    context = assemble(rows, token_budget=8)
+    assert context.text == words('a', 5)
+
+def test_chunks_shared_by_two_windows_are_sent_once():
+    rows = [row(1, 0, 10, 'first hit'), row(1, 1, 11, 'shared chunk'), row(2, 0, 12, 'second hit'), row(2, 1, 11, 'shared chunk')]
+    context = assemble(rows, token_budget=100)
+    assert context.text == 'first hit\nshared chunk\nsecond hit'
+    assert context.chunks == 3
+
+def test_identical_text_from_another_pdf_is_sent_once():
+    rows = [row(1, 0, 3, 'same words in both uploads', 'pdf-a'), row(2, 0, 3, 'same words in both uploads', 'pdf-b')]
+    assert assemble(rows, token_budget=100).text == 'same words in both uploads'
+
+def test_repeated_overlap_between_neighbours_is_removed():
+    overlap = 'the overlap sentence repeated by both chunks.'
+    first = 'The first chunk starts here. ' + overlap
+    second = overlap + ' The second chunk continues.'
+    context = assemble([row(1, 0, 7, first), row(1, 1, 8, second)], token_budget=100)
+    assert context.text == 'The first chunk starts here. the overlap sentence repeated by both chunks. The second chunk continues.'
+    assert context.text.count(overlap) == 1
+
+def test_short_coincidental_matches_are_not_stripped():
+    assert strip_overlap('ends with a b', 'a b starts here') == 'a b starts here'
+    assert strip_overlap('no shared text at all here', 'something else entirely here') == 'something else entirely here'
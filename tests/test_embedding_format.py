@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+
+import embedding_format
+
+METADATA = {'pdf_id': 'pdf', 'chunks': [{'chunk_index': index, 'text': f'chunk {index} ✓'} for index in range(3)]}
+
+def vectors(count=3, dimensions=5):
+    return np.random.default_rng(0).standard_normal((count, dimensions)).astype(np.float32)
+
+@pytest.mark.parametrize('dtype', ['float32', 'float16'])
+def test_encode_decode_round_trip(dtype):
+    original = vectors()
+    body = embedding_format.encode(METADATA, original.tolist(), dtype=dtype)
+    assert embedding_format.is_packed(body)
+    metadata, matrix = embedding_format.decode(body)
+    assert metadata == METADATA
+    assert matrix.shape == (3, 5)
+    assert matrix.dtype == np.dtype(dtype)
+    np.testing.assert_allclose(matrix, original, rtol=0 if dtype == 'float32' else 1e-3, atol=0 if dtype == 'float32' else 1e-3)
+
+def test_vectors_start_on_an_8_byte_boundary():
+    body = embedding_format.encode({'a': 'x' * 13}, vectors())
+    metadata, matrix = embedding_format.decode(body)
+    assert metadata == {'a': 'x' * 13}
+    assert (len(body) - matrix.nbytes) % 8 == 0
+
+def test_decoded_matrix_is_a_view_over_the_body():
+    body = embedding_format.encode(METADATA, vectors())
+    _, matrix = embedding_format.decode(body)
+    assert not matrix.flags.writeable
+    assert matrix.base is not None
+
+def test_batch_content_matches_the_json_layout():
+    original = vectors()
+    content = embedding_format.to_batch_content(embedding_format.encode(METADATA, original))
+    assert [chunk['chunk_index'] for chunk in content['chunks']] == [0, 1, 2]
+    np.testing.assert_array_equal(np.stack([chunk['embedding'] for chunk in content['chunks']]), original)
+
+def test_bad_magic_is_rejected():
+    body = bytearray(embedding_format.encode(METADATA, vectors()))
+    body[:4] = b'JSON'
+    assert not embedding_format.is_packed(bytes(body))
+    with pytest.raises(ValueError, match='Not a packed embedding batch'):
+        embedding_format.decode(bytes(body))
+
+def test_unknown_version_is_rejected():
+    body = bytearray(embedding_format.encode(METADATA, vectors()))
+    body[4] = embedding_format.VERSION + 1
+    with pytest.raises(ValueError, match='version=2'):
+        embedding_format.decode(bytes(body))
+
+def test_memmap_reads_the_same_matrix(tmp_path):
+    original = vectors()
+    path = tmp_path / 'batch.bin'
+    path.write_bytes(embedding_format.encode(METADATA, original, dtype='float16'))
+    metadata, matrix = embedding_format.open_memmap(str(path))
+    assert metadata == METADATA
+    np.testing.assert_allclose(matrix, original, atol=1e-3)
+    bad = tmp_path / 'bad.bin'
+    bad.write_bytes(b'XXXX' + path.read_bytes()[4:])
+    with pytest.raises(ValueError):
+        embedding_format.open_memmap(str(bad))
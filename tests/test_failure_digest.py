@@ -0,0 +1,82 @@
+import uuid
+import psycopg2
+import pytest
+import failure_digest
+from db_connection import get_db_params
+
+@pytest.fixture
+def pdf_id(db):
+    pdf_id = str(uuid.uuid4())
+    # Failures other PDFs have pending stay locked by a second session, so claim_due skips them
+    other = psycopg2.connect(**get_db_params())
+    with other.cursor() as cur:
+        cur.execute("SELECT 1 FROM failure_notifications WHERE pdf_id <> %s AND failures > 0 FOR UPDATE", (pdf_id,))
+    yield pdf_id
+    other.rollback()
+    other.close()
+    db.rollback()
+    with db.cursor() as cur:
+        cur.execute("DELETE FROM failure_notifications WHERE pdf_id = %s", (pdf_id,))
+    db.commit()
+
+def failures(*errors, stage='GenerateEmbeddings'):
+    return failure_digest.group([failure_digest.classify(error) for error in errors], stage)
+
+def test_group_counts_each_error_class_once_with_distinct_samples():
+    groups = failures({'Error': 'RateLimitError', 'Cause': 'a'}, {'Error': 'RateLimitError', 'Cause': 'a'},
+                      {'Error': 'RateLimitError', 'Cause': 'b'}, {'statusCode': 500, 'body': 'boom'})
+    assert groups == {
+        'GenerateEmbeddings: RateLimitError': {'count': 3, 'samples': ['a', 'b']},
+        'GenerateEmbeddings: HTTP 500': {'count': 1, 'samples': ['boom']}
+    }
+
+def test_failures_inside_the_window_wait_for_a_flush(db, pdf_id):
+    first = failure_digest.claim(db, pdf_id, 'run-1', failures({'Error': 'RateLimitError', 'Cause': 'a'}))
+    db.commit()
+    assert first == {'GenerateEmbeddings: RateLimitError': {'count': 1, 'samples': ['a']}}
+
+    # Within the window the next runs only add to the pending counts
+    assert failure_digest.claim(db, pdf_id, 'run-2', failures({'Error': 'RateLimitError', 'Cause': 'b'})) is None
+    db.commit()
+    assert failure_digest.claim(db, pdf_id, 'run-3', failures({'Error': 'RateLimitError', 'Cause': 'c'})) is None
+    db.commit()
+    assert failure_digest.claim_due(db, window_seconds=3600) is None
+    db.rollback()
+
+    # Once the window has closed the flush takes everything pending, newest execution first
+    due = failure_digest.claim_due(db, window_seconds=0)
+    db.commit()
+    assert due is not None
+    due_pdf_id, client_id, execution_id, groups = due
+    assert (due_pdf_id, client_id, execution_id) == (pdf_id, None, 'run-3')
+    assert groups == {'GenerateEmbeddings: RateLimitError': {'count': 2, 'samples': ['b', 'c']}}
+    with db.cursor() as cur:
+        cur.execute("SELECT count(*) FROM failure_notifications WHERE pdf_id = %s AND failures > 0", (pdf_id,))
+        assert cur.fetchone()[0] == 0
+    db.commit()
+
+def test_new_error_class_sends_everything_pending(db, pdf_id):
+    failure_digest.claim(db, pdf_id, 'run-1', failures({'Error': 'RateLimitError', 'Cause': 'a'}))
+    db.commit()
+    assert failure_digest.claim(db, pdf_id, 'run-2', failures({'Error': 'RateLimitError', 'Cause': 'b'})) is None
+    db.commit()
+    groups = failure_digest.claim(db, pdf_id, 'run-3', failures({'statusCode': 500, 'body': 'boom'}))
+    db.commit()
+    assert groups == {
+        'GenerateEmbeddings: RateLimitError': {'count': 1, 'samples': ['b']},
+        'GenerateEmbeddings: HTTP 500': {'count': 1, 'samples': ['boom']}
+    }
+    with db.cursor() as cur:
+        cur.execute("SELECT count(*) FROM failure_notifications WHERE pdf_id = %s AND failures > 0", (pdf_id,))
+        assert cur.fetchone()[0] == 0
+    db.commit()
+
+def test_rolled_back_flush_leaves_failures_pending(db, pdf_id):
+    failure_digest.claim(db, pdf_id, 'run-1', failures({'Error': 'RateLimitError', 'Cause': 'a'}))
+    db.commit()
+    failure_digest.claim(db, pdf_id, 'run-2', failures({'Error': 'RateLimitError', 'Cause': 'b'}))
+    db.commit()
+    assert failure_digest.claim_due(db, window_seconds=0)[0] == pdf_id
+    db.rollback()
+    assert failure_digest.claim_due(db, window_seconds=0)[3] == {'GenerateEmbeddings: RateLimitError': {'count': 1, 'samples': ['b']}}
+    db.commit()
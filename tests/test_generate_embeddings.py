@@ -0,0 +1,135 @@
+import os
+import types
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+
+import openai
+import pytest
+
+import GenerateEmbeddings
+import embedding_format
+from chunk_manifest import ManifestWriter
+
+class RateLimitError(Exception):
+    pass
+
+class StubEmbedding:
+    """openai.Embedding with a scripted rate limit; each vector encodes its text so order can be checked"""
+
+    def __init__(self, max_inputs=None):
+        self.max_inputs = max_inputs
+        self.calls = []
+
+    def create(self, input, model, dimensions):
+        self.calls.append(list(input))
+        if self.max_inputs is not None and len(input) > self.max_inputs:
+            raise RateLimitError('rate limited')
+        data = [{'index': index, 'embedding': [float(text.split()[-1])]} for index, text in enumerate(input)]
+        # The API does not promise to return items in input order
+        return {'data': data[::-1]}
+
+@pytest.fixture
+def stub(monkeypatch):
+    embedding = StubEmbedding()
+    monkeypatch.setattr(openai, 'Embedding', embedding, raising=False)
+    monkeypatch.setattr(openai, 'error', types.SimpleNamespace(RateLimitError=RateLimitError), raising=False)
+    monkeypatch.setattr(GenerateEmbeddings.time, 'sleep', lambda seconds: None)
+    monkeypatch.setattr(GenerateEmbeddings, 'count_tokens', lambda text: len(text.split()))
+    return embedding
+
+def texts(count, words=3):
+    return [' '.join(['word'] * (words - 1) + [str(index)]) for index in range(count)]
+
+def test_batches_stay_within_the_token_and_input_limits(stub):
+    items = [' '.join(['w'] * length) for length in (5, 4, 3, 8, 1, 1, 1, 1, 1, 12, 2)]
+    batches = GenerateEmbeddings.pack_batches(items, max_tokens=10, max_inputs=3)
+    assert [index for batch in batches for index in batch] == list(range(len(items)))
+    for batch in batches:
+        assert len(batch) <= 3
+        # A text over the budget on its own still gets a batch of its own
+        assert sum(len(items[index].split()) for index in batch) <= 10 or len(batch) == 1
+    assert [12] in [[len(items[index].split()) for index in batch] for batch in batches]
+
+def test_get_embeddings_uses_one_request_per_batch(stub):
+    items = texts(10)
+    embeddings = GenerateEmbeddings.get_embeddings(items)
+    assert embeddings == [[float(index)] for index in range(10)]
+    assert len(stub.calls) == 1
+
+def test_rate_limited_batch_is_split_in_half_and_keeps_order(stub):
+    stub.max_inputs = 2
+    items = texts(7)
+    assert GenerateEmbeddings.embed_batch(items) == [[float(index)] for index in range(7)]
+    # Every successful request was at most two inputs, taken in order
+    served = [call for call in stub.calls if len(call) <= 2]
+    assert [text for call in served for text in call] == items
+
+def test_single_rate_limited_input_is_not_split(stub):
+    stub.max_inputs = 0
+    with pytest.raises(RateLimitError):
+        GenerateEmbeddings.embed_batch(texts(1), max_retries=3)
+    assert len(stub.calls) == 3
+
+def test_persistent_rate_limit_gives_up(stub):
+    stub.max_inputs = 0
+    with pytest.raises(RateLimitError):
+        GenerateEmbeddings.embed_batch(texts(8), max_retries=2)
+    # Halving 8 -> 4 -> 2 -> 1 tries each size twice, then the single input fails
+    assert [len(call) for call in stub.calls] == [8, 8, 4, 4, 2, 2, 1, 1]
+
+def write_manifest(s3, texts_by_index):
+    manifest = ManifestWriter()
+    for index, text in enumerate(texts_by_index):
+        manifest.add({'text': text, 'chunk_index': index, 'pdf_id': 'pdf', 'client_id': 'client'})
+    manifest.upload(s3, 'bucket', 'chunks/manifest.ndjson')
+    return manifest.slices(3)
+
+def embed_slice(slice_):
+    return GenerateEmbeddings.process_batch({
+        'bucket': 'bucket', 'embeddings_dir': 'embeddings/', 'manifest_key': 'chunks/manifest.ndjson',
+        'byte_start': slice_['byte_start'], 'byte_end': slice_['byte_end']
+    })
+
+@pytest.fixture
+def batch_store(stub, s3, monkeypatch):
+    monkeypatch.setattr(GenerateEmbeddings, 's3', s3)
+    monkeypatch.setattr(GenerateEmbeddings, 'RESUME_ENABLED', True)
+    monkeypatch.setattr(GenerateEmbeddings, 'EMBEDDING_FORMAT', 'float32')
+    monkeypatch.setattr(GenerateEmbeddings, 'lookup_stored_chunks', lambda pdf_id, chunks: {})
+    return s3
+
+def stored_texts(s3, key):
+    metadata, _ = embedding_format.decode(s3.objects[key])
+    return [chunk['text'] for chunk in metadata['chunks']]
+
+def test_resume_skips_a_batch_embedded_from_the_same_slice(batch_store, stub):
+    slices = write_manifest(batch_store, texts(5))
+    first = embed_slice(slices[0])
+    assert 'resumed' not in first
+    calls = len(stub.calls)
+    again = embed_slice(slices[0])
+    assert again['resumed'] is True
+    assert again['embedding_key'] == first['embedding_key']
+    assert len(stub.calls) == calls
+
+def test_resume_embeds_again_after_a_rechunk(batch_store, stub):
+    slices = write_manifest(batch_store, texts(5))
+    key = embed_slice(slices[0])['embedding_key']
+    # The same PDF chunked with other settings: same manifest key and batch key, different chunks
+    rechunked = [f'{text} 9' for text in texts(4, words=6)]
+    slices = write_manifest(batch_store, rechunked)
+    result = embed_slice(slices[0])
+    assert 'resumed' not in result
+    assert result['embedding_key'] == key
+    assert stored_texts(batch_store, key) == rechunked[:3]
+    assert stub.calls[-1] == rechunked[:3]
+
+def test_resume_embeds_again_over_a_batch_without_a_source(batch_store, stub):
+    slices = write_manifest(batch_store, texts(3))
+    key = embed_slice(slices[0])['embedding_key']
+    metadata, matrix = embedding_format.decode(batch_store.objects[key])
+    del metadata['source']
+    batch_store.objects[key] = embedding_format.encode(metadata, matrix)
+    assert 'resumed' not in embed_slice(slices[0])
+    metadata, _ = embedding_format.decode(batch_store.objects[key])
+    assert metadata['source']['byte_end'] == slices[0]['byte_end']
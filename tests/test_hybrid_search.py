@@ -0,0 +1,48 @@
+import os
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+
+import numpy as np
+import pytest
+from psycopg2.extras import DictCursor
+
+from chunk_partitions import table_sql
+from context_assembly import context_sql
+from helper_functions import find_relevant_context
+from pg_copy import copy_rows
+from query_pipeline import TEXT_SEARCH_SQL
+
+TABLE = 'hybrid_search_test'
+PDF_ID = '00000000-0000-0000-0000-000000000001'
+CLIENT_ID = '00000000-0000-0000-0001-000000000001'
+TEXTS = ['Gradient descent updates the weights.', 'The XK-42 valve is rated for 300 bar.', 'Dropout regularises deep networks.']
+
+@pytest.fixture
+def chunk_table(db):
+    vectors = np.random.default_rng(0).standard_normal((len(TEXTS), 1024)).astype(np.float32)
+    with db.cursor() as cur:
+        cur.execute(f"DROP TABLE IF EXISTS {TABLE}")
+        cur.execute(table_sql(TABLE, partitioned=False))
+        copy_rows(cur, [(PDF_ID, index, 'test.pdf', text, vector, CLIENT_ID, True, 1, 1)
+                        for index, (text, vector) in enumerate(zip(TEXTS, vectors))], table=TABLE)
+    db.commit()
+    yield vectors
+    db.rollback()
+    with db.cursor() as cur:
+        cur.execute(f"DROP TABLE IF EXISTS {TABLE}")
+    db.commit()
+
+def test_hybrid_context_finds_a_keyword_match(db, chunk_table):
+    # The query embedding points at the first chunk, the query text only matches the second
+    with db.cursor(cursor_factory=DictCursor) as cur:
+        context = find_relevant_context('XK-42 valve', chunk_table[0].tolist(), cur, TABLE, PDF_ID, CLIENT_ID,
+                                        mode='hybrid', top_k=2, neighbours=0)
+    assert context is not None
+    assert TEXTS[1] in context.text
+
+def test_text_search_fallback_runs(db, chunk_table):
+    sql = context_sql(TABLE, TEXT_SEARCH_SQL.format(table=TABLE, pdf_filter="AND pdf_id = %(pdf_id)s"))
+    with db.cursor(cursor_factory=DictCursor) as cur:
+        cur.execute(sql, {'query': 'dropout networks', 'pdf_id': PDF_ID, 'limit': 3, 'neighbours': 0})
+        rows = cur.fetchall()
+    assert [row['content'] for row in rows] == [TEXTS[2]]
@@ -0,0 +1,35 @@
+import uuid
+import numpy as np
+from pg_copy import TextCopyStream, copy_rows
+
+DIMENSIONS = 1024
+
+def chunk_row(embedding, chunk_index=0, content='Tab\there, newline\nthere, back\\slash'):
+    return (str(uuid.uuid4()), chunk_index, 'test.pdf', content, embedding, str(uuid.uuid4()), True, 1, 2)
+
+def test_text_format_writes_ndarray_as_vector_literal():
+    embedding = np.linspace(-1, 1, DIMENSIONS, dtype=np.float32)
+    fields = TextCopyStream([chunk_row(embedding)]).read().rstrip('\n').split('\t')
+    vector = fields[4]
+    assert vector.startswith('[') and vector.endswith(']')
+    assert ' ' not in vector and '...' not in vector
+    assert np.allclose([float(value) for value in vector[1:-1].split(',')], embedding, atol=1e-6)
+    assert fields[3] == 'Tab\\there, newline\\nthere, back\\\\slash'
+
+def test_text_and_binary_copy_load_the_same_rows(db):
+    rng = np.random.default_rng(0)
+    embeddings = rng.standard_normal((3, DIMENSIONS)).astype(np.float32)
+    rows = [chunk_row(embedding, index) for index, embedding in enumerate(embeddings)]
+    rows[1] = rows[1][:4] + (embeddings[1].tolist(),) + rows[1][5:]
+    with db.cursor() as cur:
+        cur.execute("CREATE TEMP TABLE copy_text (LIKE pdf_chunks INCLUDING DEFAULTS)")
+        cur.execute("CREATE TEMP TABLE copy_binary (LIKE pdf_chunks INCLUDING DEFAULTS)")
+        assert copy_rows(cur, rows, table='copy_text', binary=False) == 3
+        assert copy_rows(cur, rows, table='copy_binary', binary=True) == 3
+        cur.execute("""
+            SELECT t.content = b.content, t.content_embedding <-> b.content_embedding
+            FROM copy_text t JOIN copy_binary b USING (chunk_index) ORDER BY chunk_index
+        """)
+        results = cur.fetchall()
+    assert len(results) == 3
+    assert all(same_content and distance < 1e-4 for same_content, distance in results)
@@ -0,0 +1,127 @@
+import json
+import os
+
+import pytest
+
+from local_runner import StateMachineRunner, load_definition
+
+DEFINITION = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'StateMachine.json')
+EXECUTION_INPUT = {
+    'bucket': 'bucket', 'key': 'PDF_Upload/pdf/doc.pdf', 'chunks_dir': 'chunks/', 'embeddings_dir': 'embeddings/',
+    'pdf_id': 'pdf', 'client_id': 'client', 'is_pdf_chat': True
+}
+SLICES = 5
+
+class RateLimitError(Exception):
+    pass
+
+class IncompleteEmbeddingsError(Exception):
+    pass
+
+class Handlers:
+    """Stub Lambdas that record every invocation; embed_failures maps a slice's byte_start to an exception"""
+
+    def __init__(self, embed_failures=None):
+        self.embed_failures = embed_failures or {}
+        self.calls = {}
+
+    def record(self, name, event):
+        self.calls.setdefault(name, []).append(event)
+
+    def split(self, event, context):
+        self.record('SplitPDF', event)
+        return {
+            'statusCode': 200, 'manifest_key': 'chunks/manifest.ndjson', 'chunk_count': SLICES * 10, 'bucket': event['bucket'],
+            'slices': [{'first_chunk': n * 10, 'chunk_count': 10, 'byte_start': n * 100, 'byte_end': n * 100 + 99} for n in range(SLICES)],
+            'pdf_id': event['pdf_id'], 'client_id': event['client_id'], 'is_pdf_chat': event['is_pdf_chat']
+        }
+
+    def embed(self, event, context):
+        self.record('GenerateEmbeddings', event)
+        if event['byte_start'] in self.embed_failures:
+            raise self.embed_failures[event['byte_start']]
+        return {'statusCode': 200, 'embedding_key': f"embeddings/embeddings_batch_{event['byte_start'] // 10}.bin", 'chunk_count': 10}
+
+    def report(self, event, context):
+        # Counts failures the way FailureNotification does for a Map result
+        self.record('FailureNotification', event)
+        results = event.get('results') or []
+        return {'statusCode': 200, 'failed_count': sum(1 for result in results if result.get('failed') or result.get('statusCode') != 200)}
+
+    def store(self, event, context):
+        self.record('StoreEmbeddings', event)
+        return {'statusCode': 200, 'chunk_count': event['chunk_count']}
+
+    def resources(self, **overrides):
+        return dict({'SplitPDF': self.split, 'GenerateEmbeddings': self.embed, 'FailureNotification': self.report,
+                     'StoreEmbeddings': self.store}, **overrides)
+
+def run(handlers, **overrides):
+    runner = StateMachineRunner(load_definition(DEFINITION), resources=handlers.resources(**overrides), wait_scale=0)
+    return runner.run(json.loads(json.dumps(EXECUTION_INPUT)), name='execution')
+
+def test_successful_run_stores_every_slice():
+    handlers = Handlers()
+    result = run(handlers)
+    assert result['status'] == 'SUCCEEDED', result['error']
+    # Each slice is embedded once, and the Map hands the results to the failure report in slice order
+    assert sorted(event['byte_start'] for event in handlers.calls['GenerateEmbeddings']) == [n * 100 for n in range(SLICES)]
+    map_result = result['output']['mapResult']
+    assert [item['embedding_key'] for item in map_result] == [f"embeddings/embeddings_batch_{n * 10}.bin" for n in range(SLICES)]
+    assert handlers.calls['FailureNotification'][0]['results'] == map_result
+    assert handlers.calls['FailureNotification'][0]['execution_id'] == 'execution'
+    assert result['output']['failureReport']['failed_count'] == 0
+    [store] = handlers.calls['StoreEmbeddings']
+    assert store['chunk_count'] == SLICES * 10
+    assert store['mode'] == 'bulk'
+
+def test_failed_slice_is_caught_and_stops_the_run():
+    handlers = Handlers({200: RateLimitError('Rate limit reached')})
+    result = run(handlers)
+    assert result['status'] == 'FAILED'
+    assert result['error']['Error'] == 'EmbeddingsFailed'
+    assert 'StoreEmbeddings' not in handlers.calls
+    # The failing slice was retried, then EmbeddingFailed took its place in the Map result
+    assert sum(1 for event in handlers.calls['GenerateEmbeddings'] if event['byte_start'] == 200) == 3
+    results = handlers.calls['FailureNotification'][0]['results']
+    assert len(results) == SLICES
+    assert results[2] == {'failed': True, 'error': {'Error': 'RateLimitError', 'Cause': 'Rate limit reached'}}
+    assert all(item['statusCode'] == 200 for index, item in enumerate(results) if index != 2)
+    assert result['states']['EmbeddingFailed']['count'] == 1
+
+def test_failure_report_error_stops_the_run():
+    handlers = Handlers()
+    def broken_report(event, context):
+        raise RuntimeError('SNS unavailable')
+    result = run(handlers, FailureNotification=broken_report)
+    assert result['status'] == 'FAILED'
+    assert result['error']['Error'] == 'EmbeddingsFailed'
+    assert 'StoreEmbeddings' not in handlers.calls
+
+@pytest.mark.parametrize('report', [{'statusCode': 200}, {'statusCode': 200, 'failed_count': 1}], ids=['no-count', 'failures'])
+def test_check_embedding_failures_only_passes_a_zero_count(report):
+    handlers = Handlers()
+    result = run(handlers, FailureNotification=lambda event, context: report)
+    assert result['status'] == 'FAILED'
+    assert result['error']['Error'] == 'EmbeddingsFailed'
+    assert result['states']['CheckEmbeddingFailures']['count'] == 1
+    assert 'StoreEmbeddings' not in handlers.calls
+
+def test_incomplete_embeddings_are_not_retried():
+    handlers = Handlers()
+    def incomplete(event, context):
+        handlers.record('StoreEmbeddings', event)
+        raise IncompleteEmbeddingsError('3 of 50 chunks of PDF pdf have no embedding')
+    result = run(handlers, StoreEmbeddings=incomplete)
+    assert result['status'] == 'SUCCEEDED'
+    assert len(handlers.calls['StoreEmbeddings']) == 1
+    [report] = [event for event in handlers.calls['FailureNotification'] if event.get('stage') == 'StoreEmbeddings']
+    assert report['error']['Error'] == 'IncompleteEmbeddingsError'
+
+def test_split_error_goes_to_the_failure_handler():
+    handlers = Handlers()
+    result = run(handlers, SplitPDF=lambda event, context: {'statusCode': 404, 'body': '"PDF file not found in S3"'})
+    assert result['status'] == 'SUCCEEDED'
+    assert 'GenerateEmbeddings' not in handlers.calls
+    [report] = handlers.calls['FailureNotification']
+    assert report['error'] == 'Error in SplitPDF: "PDF file not found in S3"'
@@ -0,0 +1,28 @@
+import base64
+import json
+import os
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+
+from uploadPDFToS3 import iter_base64_decoded, parse_upload_body
+
+def test_slices_decode_to_the_original_bytes():
+    data = os.urandom(1000)
+    encoded = base64.b64encode(data).decode('ascii')
+    assert b''.join(iter_base64_decoded(encoded, 0, len(encoded), chunk_chars=8)) == data
+
+def test_line_wrapped_base64_decodes_across_slices():
+    data = os.urandom(1000)
+    body = json.dumps({'client_id': 'c', 'file': base64.encodebytes(data).decode('ascii')})
+    fields, encoded, start, end = parse_upload_body(body)
+    assert fields == {'client_id': 'c'}
+    for chunk_chars in (7, 8, 77, 4096):
+        assert b''.join(iter_base64_decoded(encoded, start, end, chunk_chars)) == data
+
+def test_file_is_read_in_place_from_an_unescaped_body():
+    data = os.urandom(30)
+    body = json.dumps({'client_id': 'c', 'file': base64.b64encode(data).decode('ascii'), 'is_pdf_chat': True})
+    fields, encoded, start, end = parse_upload_body(body)
+    assert fields == {'client_id': 'c', 'is_pdf_chat': True}
+    assert encoded is body
+    assert b''.join(iter_base64_decoded(encoded, start, end, 8)) == data
@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+from chunk_partitions import partitions_sql, table_sql
+from pg_copy import copy_rows
+from vector_index import build_index, get_index_definition
+
+TABLE = 'vector_index_test'
+
+@pytest.fixture(params=[False, True], ids=['unpartitioned', 'partitioned'])
+def chunk_table(db, request):
+    partitioned = request.param
+    with db.cursor() as cur:
+        cur.execute(f"DROP TABLE IF EXISTS {TABLE}")
+        cur.execute(table_sql(TABLE, partitioned=partitioned))
+        if partitioned:
+            cur.execute(partitions_sql(TABLE, partitions=4))
+        rng = np.random.default_rng(0)
+        rows = [
+            (f"00000000-0000-0000-0000-{index % 5:012d}", index, 'test.pdf', f"chunk {index}", vector,
+             f"00000000-0000-0000-0001-{index % 3:012d}", True, 1, 1)
+            for index, vector in enumerate(rng.standard_normal((200, 1024)).astype(np.float32))
+        ]
+        copy_rows(cur, rows, table=TABLE)
+    db.commit()
+    yield partitioned
+    db.rollback()
+    with db.cursor() as cur:
+        cur.execute(f"DROP TABLE IF EXISTS {TABLE}")
+    db.commit()
+
+def index_names(cur):
+    cur.execute("""
+        SELECT c.relname, i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+        WHERE c.relname LIKE %s ORDER BY 1
+    """, (f"{TABLE}%embedding_idx%",))
+    return cur.fetchall()
+
+def test_rebuild_swaps_in_a_valid_index_under_the_final_names(db, chunk_table):
+    index_name = f"{TABLE}_embedding_idx"
+    build_index(db, 200, 'hnsw', table=TABLE, index_name=index_name, quantization='none')
+    build_index(db, 200, 'ivfflat', table=TABLE, index_name=index_name, quantization='none')
+    assert db.autocommit is False
+    with db.cursor() as cur:
+        assert 'USING ivfflat' in get_index_definition(cur, index_name)
+        names = index_names(cur)
+    expected = [index_name] + ([f"{TABLE}_p{remainder:02d}_embedding_idx" for remainder in range(4)] if chunk_table else [])
+    assert names == [(name, True) for name in sorted(expected)]
@@ -0,0 +1,24 @@
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding("cl100k_base")
+except Exception:
+    # tiktoken is optional and needs its BPE file, so fall back to an estimate
+    _encoding = None
+
+# Characters per token assumed when tiktoken is unavailable
+CHARS_PER_TOKEN = 4
+
+def count_tokens(text: str) -> int:
+    """Count model tokens, falling back to a rough estimate without tiktoken"""
+    if _encoding is not None:
+        return len(_encoding.encode(text))
+    return len(text) // CHARS_PER_TOKEN + 1
+
+def split_tokens(text: str, max_tokens: int) -> list:
+    """Cut text into consecutive pieces of at most max_tokens tokens each"""
+    if _encoding is not None:
+        tokens = _encoding.encode(text)
+        return [_encoding.decode(tokens[start:start + max_tokens]) for start in range(0, len(tokens), max_tokens)]
+    # Keep each piece within count_tokens' estimate of max_tokens
+    step = max(1, (max_tokens - 1) * CHARS_PER_TOKEN)
+    return [text[start:start + step] for start in range(0, len(text), step)]
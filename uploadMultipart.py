@@ -0,0 +1,49 @@
+import hashlib
+import json
+import os
+import sys
+import urllib.request
+
+# Upload a PDF through presigned multipart URLs instead of base64 in the request body:
+#   python uploadMultipart.py <upload API URL> <client_id> [pdf path]
+api_url = sys.argv[1]
+client_id = sys.argv[2]
+pdf_file_path = sys.argv[3] if len(sys.argv) > 3 else "./deepLearning.pdf"
+is_pdf_chat = True
+
+def post(body):
+    request = urllib.request.Request(
+        api_url, data=json.dumps(body).encode('utf-8'), headers={'Content-Type': 'application/json'}, method='POST'
+    )
+    with urllib.request.urlopen(request) as response:
+        return json.loads(response.read())
+
+# Hash the file without loading it into memory
+digest = hashlib.sha256()
+with open(pdf_file_path, "rb") as pdf_file:
+    for block in iter(lambda: pdf_file.read(1024 * 1024), b""):
+        digest.update(block)
+
+fields = {
+    'client_id': client_id,
+    'is_pdf_chat': is_pdf_chat,
+    'content_sha256': digest.hexdigest(),
+    'size': os.path.getsize(pdf_file_path)
+}
+initiated = post(dict(fields, action='initiate_upload'))
+if initiated['status'] != 'upload':
+    # Already indexed or being indexed: nothing to upload
+    print(f"{initiated['message']} pdf_id: {initiated['pdf_id']}")
+    sys.exit(0)
+
+# PUT each part straight to S3 and keep the ETags for completion
+parts = []
+with open(pdf_file_path, "rb") as pdf_file:
+    for part in initiated['parts']:
+        data = pdf_file.read(initiated['part_size'])
+        with urllib.request.urlopen(urllib.request.Request(part['url'], data=data, method='PUT')) as response:
+            parts.append({'part_number': part['part_number'], 'etag': response.headers['ETag']})
+        print(f"Uploaded part {part['part_number']} of {len(initiated['parts'])}")
+
+completed = post(dict(fields, action='complete_upload', upload_id=initiated['upload_id'], parts=parts))
+print(f"{completed['message']} pdf_id: {completed['pdf_id']}")
@@ -1,8 +1,14 @@
 import json
 import base64
+import math
+import re
 import boto3
-import uuid
+import psycopg2
 from botocore.exceptions import ClientError
+from db_connection import connection
+import pdf_registry
+import metrics
+from s3_multipart import MultipartUpload, part_size_for, presign_parts
 
 s3_client = boto3.client('s3')
 stepfunctions_client = boto3.client('stepfunctions')
@@ -14,34 +20,134 @@ STATE_MACHINE_ARN = 'arn:aws:states:us-east-1:510343462926:stateMachine:PDFChat_
 BOT_NAME = 'PDFChatAgent'
 BOT_ALIAS = 'pdfchatagent'
 
-def lambda_handler(event, context):
+# Base64 characters decoded per step: a multiple of 4, so every slice decodes on its own
+DECODE_CHUNK_CHARS = 4 * 1024 * 1024
+FILE_FIELD_PATTERN = re.compile(r'"file"\s*:\s*"')
+SHA256_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+
+CORS_HEADERS = {
+    'Content-Type': 'application/json',
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Allow-Methods': 'OPTIONS,POST,GET',
+    'Access-Control-Allow-Headers': 'Content-Type'
+}
+
+def response(status_code, body):
+    return {
+        'statusCode': status_code,
+        'headers': CORS_HEADERS,
+        'body': json.dumps(body)
+    }
+
+def update_lex_session(client_id, input_text, session_attributes, default_message):
     try:
-        print("Event:", event)  # Log the event for debugging
-        # Parse the body of the request
-        body = json.loads(event['body'])
-        print("Parsed Body:", body)  # Log the parsed body for debugging
-
-        # Extract information from the new body format
-        client_id = body['client_id']
-        is_pdf_chat = body.get('is_pdf_chat', False)
-        pdf_id = body.get('pdf_id') or str(uuid.uuid4())
-        file_content = base64.b64decode(body['file'])
-        file_name = f"{client_id}_{pdf_id}.pdf"
-
-        # Create a unique directory for the file
-        unique_dir = f"{FOLDER_NAME}{pdf_id}/"
-        chunks_dir = f"{unique_dir}chunks/"
-        embeddings_dir = f"{unique_dir}embeddings/"
-        
-        # Construct the full S3 object path with the folder
-        s3_object_path = f"{unique_dir}{file_name}"
-        
-        # Upload the file to S3
-        s3_client.put_object(Bucket=BUCKET_NAME, Key=s3_object_path, Body=file_content)
-        
-        # Start the state machine execution
+        lex_response = lex_client.post_text(
+            botName=BOT_NAME,
+            botAlias=BOT_ALIAS,
+            userId=client_id,
+            inputText=input_text,
+            sessionAttributes=session_attributes
+        )
+        print("Lex Response:", lex_response)  # Log Lex response for debugging
+        return lex_response.get('message', default_message)  # Get the message from Lex response
+    except ClientError as lex_error:
+        print("Lex ClientError:", lex_error)  # Log Lex ClientError for debugging
+        # Continue with the response even if Lex interaction fails
+        return default_message
+
+def already_ingested_response(client_id, pdf_id, is_pdf_chat, claim):
+    """Answer a re-upload without running split, embed and store again"""
+    if claim['status'] == pdf_registry.READY:
+        session_attributes = {
+            'pdf_id': pdf_id,
+            'client_id': client_id,
+            'is_pdf_chat': str(is_pdf_chat).lower(),
+            'processing_complete': 'true'
+        }
+        if claim['ingest_version']:
+            session_attributes['ingest_version'] = claim['ingest_version']
+        message = 'PDF already processed.'
+        lex_message = update_lex_session(
+            client_id, 'notify_pdf_processing_complete', session_attributes,
+            'PDF processing complete. You can now ask questions about the document.'
+        )
+    else:
+        message = 'PDF is already being processed.'
+        lex_message = message
+    print(f"Skipping pipeline for PDF: {pdf_id} ({claim['status']})")
+    return response(200, {
+        'message': message,
+        'status': claim['status'],
+        'pdf_id': pdf_id,
+        'chunk_count': claim['chunk_count'],
+        'lex_message': lex_message
+    })
+
+def parse_upload_body(raw_body):
+    """Parse the request body without copying the base64 file out of it.
+
+    Returns (fields, encoded, start, end): every field except 'file', and where the base64 text lives.
+    """
+    match = FILE_FIELD_PATTERN.search(raw_body)
+    if match:
+        start = match.end()
+        end = raw_body.find('"', start)
+        # Base64 never needs JSON escapes, so a backslash means the body needs a real parse
+        if end != -1 and raw_body.find('\\', start, end) == -1:
+            fields = json.loads(raw_body[:start] + raw_body[end:])
+            if fields.get('file') == '':
+                del fields['file']
+                return fields, raw_body, start, end
+    fields = json.loads(raw_body)
+    encoded = fields.pop('file', None)
+    return fields, encoded, 0, len(encoded or '')
+
+def iter_base64_decoded(encoded, start, end, chunk_chars=DECODE_CHUNK_CHARS):
+    """Decode encoded[start:end] a slice at a time so only one decoded slice is in memory"""
+    carry = ''
+    for offset in range(start, end, chunk_chars):
+        # Line-wrapped (MIME) base64 has breaks anywhere, so decode whole 4-character quanta and carry the rest
+        text = carry + ''.join(encoded[offset:min(offset + chunk_chars, end)].split())
+        cut = len(text) - len(text) % 4
+        carry = text[cut:]
+        if cut:
+            yield base64.b64decode(text[:cut])
+    if carry:
+        yield base64.b64decode(carry)
+
+def object_key(pdf_id, client_id):
+    return f"{FOLDER_NAME}{pdf_id}/{client_id}_{pdf_id}.pdf"
+
+def claim_upload(client_id, pdf_id, content_hash):
+    # The same client uploading the same bytes gets the same pdf_id
+    pdf_id = pdf_id or pdf_registry.content_pdf_id(client_id, content_hash)
+    with connection() as conn, metrics.span('ClaimIngest'):
+        claim = pdf_registry.claim_ingest(conn, pdf_id, client_id, content_hash)
+    metrics.add('AlreadyIngested', 0 if claim['status'] == pdf_registry.STARTED else 1)
+    return pdf_id, claim
+
+def release_claim(pdf_id):
+    """Mark a claimed PDF failed, so a retry claims it again instead of waiting out the lease"""
+    try:
+        with connection() as conn:
+            with conn.cursor() as cur:
+                pdf_registry.mark_failed(cur, pdf_id)
+            conn.commit()
+    except psycopg2.Error as e:
+        # The lease still expires, so the PDF can be retried later either way
+        print(f"Could not mark PDF {pdf_id} failed: {e}")
+
+def start_processing(client_id, pdf_id, is_pdf_chat, content_hash, s3_object_path, execution_name=None):
+    # Intermediate objects are scoped to the file's content
+    unique_dir = f"{FOLDER_NAME}{pdf_id}/"
+    chunks_dir = f"{unique_dir}{content_hash[:16]}/chunks/"
+    embeddings_dir = f"{unique_dir}{content_hash[:16]}/embeddings/"
+    
+    # Start the state machine execution; a repeated name with the same input returns the existing execution
+    with metrics.span('StartExecution'):
         stepfunctions_response = stepfunctions_client.start_execution(
             stateMachineArn=STATE_MACHINE_ARN,
+            **({'name': execution_name} if execution_name else {}),
             input=json.dumps({
                 'bucket': BUCKET_NAME,
                 'key': s3_object_path,
@@ -52,65 +158,168 @@ def lambda_handler(event, context):
                 'client_id': client_id
             })
         )
+    
+    # Interact with Lex bot to set initial session attributes
+    lex_message = update_lex_session(
+        client_id, 'start_pdf_processing',
+        {
+            'pdf_id': pdf_id,
+            'client_id': client_id,
+            'is_pdf_chat': str(is_pdf_chat).lower(),
+            'processing_complete': 'false'
+        },
+        "PDF processing started."
+    )
+    
+    return response(200, {
+        'message': 'File uploaded successfully and state machine started.',
+        'status': pdf_registry.STARTED,
+        'executionArn': stepfunctions_response['executionArn'],
+        'pdf_id': pdf_id,
+        'lex_message': lex_message
+    })
+
+def upload_base64(fields, encoded, start, end):
+    """The original endpoint: a base64 file inside the JSON body, streamed to S3 in parts"""
+    client_id = fields['client_id']
+    is_pdf_chat = fields.get('is_pdf_chat', False)
+    if encoded is None:
+        raise ValueError("'file' is required")
+    
+    # First pass only hashes, so a PDF that is already indexed is never uploaded again
+    with metrics.span('Hash'):
+        content_hash = pdf_registry.stream_sha256(iter_base64_decoded(encoded, start, end))
+    
+    pdf_id, claim = claim_upload(client_id, fields.get('pdf_id'), content_hash)
+    if claim['status'] != pdf_registry.STARTED:
+        return already_ingested_response(client_id, pdf_id, is_pdf_chat, claim)
+    
+    try:
+        # Second pass decodes again and uploads one part at a time
+        s3_object_path = object_key(pdf_id, client_id)
+        decoded_size = (end - start) * 3 // 4
+        with metrics.span('S3Upload'), MultipartUpload(s3_client, BUCKET_NAME, s3_object_path, part_size_for(decoded_size)) as upload:
+            for data in iter_base64_decoded(encoded, start, end):
+                upload.write(data)
+        metrics.add('UploadBytes', upload.size, 'Bytes')
+        print(f"Uploaded {upload.size} bytes to {s3_object_path} in {max(len(upload.parts), 1)} part(s)")
         
-        lex_message = "PDF processing started."  # Default message
-        
-        # Interact with Lex bot to set initial session attributes
-        try:
-            lex_response = lex_client.post_text(
-                botName=BOT_NAME,
-                botAlias=BOT_ALIAS,
-                userId=client_id,
-                inputText='start_pdf_processing',
-                sessionAttributes={
-                    'pdf_id': pdf_id,
-                    'client_id': client_id,
-                    'is_pdf_chat': str(is_pdf_chat).lower(),
-                    'processing_complete': 'false'
-                }
-            )
-            print("Lex Response:", lex_response)  # Log Lex response for debugging
-            lex_message = lex_response.get('message', lex_message)  # Get the message from Lex response
-        except ClientError as lex_error:
-            print("Lex ClientError:", lex_error)  # Log Lex ClientError for debugging
-            # Continue with the response even if Lex interaction fails
-        
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'OPTIONS,POST,GET',
-                'Access-Control-Allow-Headers': 'Content-Type'
-            },
-            'body': json.dumps({
-                'message': 'File uploaded successfully and state machine started.',
-                'executionArn': stepfunctions_response['executionArn'],
-                'pdf_id': pdf_id,
-                'lex_message': lex_message
-            })
-        }
+        return start_processing(client_id, pdf_id, is_pdf_chat, content_hash, s3_object_path)
+    except Exception:
+        release_claim(pdf_id)
+        raise
+
+def initiate_upload(fields):
+    """Presigned mode: hand out one S3 URL per part; the file never passes through Lambda"""
+    client_id = fields['client_id']
+    is_pdf_chat = fields.get('is_pdf_chat', False)
+    content_hash = fields['content_sha256'].lower()
+    if not SHA256_PATTERN.match(content_hash):
+        raise ValueError("'content_sha256' must be a hex SHA-256 digest")
+    size = int(fields['size'])
+    
+    pdf_id, claim = claim_upload(client_id, fields.get('pdf_id'), content_hash)
+    if claim['status'] != pdf_registry.STARTED:
+        return already_ingested_response(client_id, pdf_id, is_pdf_chat, claim)
+    
+    try:
+        s3_object_path = object_key(pdf_id, client_id)
+        part_size = part_size_for(size)
+        upload_id = s3_client.create_multipart_upload(
+            Bucket=BUCKET_NAME, Key=s3_object_path, ContentType='application/pdf'
+        )['UploadId']
+        with connection() as conn:
+            pdf_registry.attach_upload(conn, pdf_id, upload_id)
+        parts = presign_parts(s3_client, BUCKET_NAME, s3_object_path, upload_id, max(1, math.ceil(size / part_size)))
+    except Exception:
+        release_claim(pdf_id)
+        raise
+    metrics.add('PresignedParts', len(parts))
+    print(f"Initiated multipart upload for PDF: {pdf_id} with {len(parts)} part(s)")
+    
+    return response(200, {
+        'message': 'Upload each part to its URL, then call complete_upload with the ETags.',
+        'status': 'upload',
+        'pdf_id': pdf_id,
+        'upload_id': upload_id,
+        'part_size': part_size,
+        'parts': parts
+    })
+
+def complete_multipart(s3_object_path, upload_id, parts):
+    try:
+        s3_client.complete_multipart_upload(
+            Bucket=BUCKET_NAME,
+            Key=s3_object_path,
+            UploadId=upload_id,
+            MultipartUpload={
+                'Parts': [{'PartNumber': int(part['part_number']), 'ETag': part['etag']} for part in parts]
+            }
+        )
+    except ClientError as e:
+        # A retried completion finds the upload already assembled into the object
+        if e.response.get('Error', {}).get('Code') != 'NoSuchUpload':
+            raise
+        s3_client.head_object(Bucket=BUCKET_NAME, Key=s3_object_path)
+
+def uploaded_sha256(s3_object_path):
+    """Hash the assembled object in S3 rather than trusting the digest the client sent"""
+    body = s3_client.get_object(Bucket=BUCKET_NAME, Key=s3_object_path)['Body']
+    with metrics.span('VerifyHash'):
+        return pdf_registry.stream_sha256(body.iter_chunks(pdf_registry.HASH_BLOCK_BYTES))
+
+def complete_upload(fields):
+    """Presigned mode: assemble the uploaded parts, check them against the claim and start processing"""
+    client_id = fields['client_id']
+    is_pdf_chat = fields.get('is_pdf_chat', False)
+    upload_id = fields['upload_id']
+    content_hash = fields['content_sha256'].lower()
+    pdf_id = fields.get('pdf_id') or pdf_registry.content_pdf_id(client_id, content_hash)
+    s3_object_path = object_key(pdf_id, client_id)
+    
+    # Only the upload that holds a live claim on the PDF may start its pipeline
+    with connection() as conn, metrics.span('ClaimIngest'):
+        claim = pdf_registry.renew_upload_claim(conn, pdf_id, client_id, upload_id)
+    if claim['status'] == pdf_registry.READY:
+        return already_ingested_response(client_id, pdf_id, is_pdf_chat, claim)
+    if claim['status'] != pdf_registry.STARTED:
+        return response(409, 'No live upload claim for this upload_id; call initiate_upload again.')
+    
+    complete_multipart(s3_object_path, upload_id, fields['parts'])
+    uploaded_hash = uploaded_sha256(s3_object_path)
+    if uploaded_hash != claim['content_hash']:
+        s3_client.delete_object(Bucket=BUCKET_NAME, Key=s3_object_path)
+        release_claim(pdf_id)
+        print(f"Uploaded file for PDF {pdf_id} hashes to {uploaded_hash}, not the claimed {claim['content_hash']}")
+        return response(400, "The uploaded file does not match 'content_sha256'.")
+    
+    # Named after the upload, so a retried completion cannot start a second execution
+    execution_name = f"{pdf_id}-{pdf_registry.content_sha256(upload_id.encode('utf-8'))[:16]}"
+    return start_processing(client_id, pdf_id, is_pdf_chat, uploaded_hash, s3_object_path, execution_name)
+
+@metrics.instrument('uploadPDFToS3')
+def lambda_handler(event, context):
+    try:
+        # Log the event without the body, which may hold a whole base64 PDF
+        print("Event:", {key: value for key, value in event.items() if key != 'body'})
+        raw_body = event['body']
+        fields, encoded, start, end = parse_upload_body(raw_body)
+        metrics.add('RequestBytes', len(raw_body), 'Bytes')
+        print("Parsed Body:", fields, f"(file: {end - start} base64 characters)")  # Log the parsed body for debugging
+
+        # 'upload' (default) takes the file in the body, the other actions drive a presigned multipart upload
+        action = fields.get('action', 'upload')
+        if action == 'initiate_upload':
+            return initiate_upload(fields)
+        if action == 'complete_upload':
+            return complete_upload(fields)
+        return upload_base64(fields, encoded, start, end)
     except ClientError as e:
         print("ClientError:", e)  # Log ClientError for debugging
-        return {
-            'statusCode': 500,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'OPTIONS,POST,GET',
-                'Access-Control-Allow-Headers': 'Content-Type'
-            },
-            'body': json.dumps(f'Error uploading file: {e}')
-        }
+        return response(500, f'Error uploading file: {e}')
+    except psycopg2.Error as e:
+        print("Database error:", e)  # Log database errors for debugging
+        return response(500, f'Error registering upload: {e}')
     except Exception as e:
         print("Exception:", e)  # Log Exception for debugging
-        return {
-            'statusCode': 400,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'OPTIONS,POST,GET',
-                'Access-Control-Allow-Headers': 'Content-Type'
-            },
-            'body': json.dumps(f'Invalid input: {e}')
-        }
\ No newline at end of file
+        return response(400, f'Invalid input: {e}')
\ No newline at end of file
@@ -0,0 +1,277 @@
+import math
+import os
+import re
+import sys
+
+# Index type and distance metric shared by index builds and chat queries
+INDEX_METHOD = os.getenv('VECTOR_INDEX_METHOD', 'hnsw')  # 'hnsw' or 'ivfflat'
+DISTANCE_METRIC = os.getenv('VECTOR_DISTANCE', 'cosine')  # 'cosine', 'l2' or 'ip'
+TARGET_RECALL = float(os.getenv('VECTOR_TARGET_RECALL', 0.95))
+INDEX_NAME = 'pdf_chunks_embedding_idx'
+MAINTENANCE_WORK_MEM = os.getenv('VECTOR_INDEX_BUILD_MEMORY', '512MB')
+# Let bulk_ingest.py build or resize the index after a backfill; disable to manage it out of band.
+# The per-PDF ingest Lambdas never build it: run python vector_index.py --build on a schedule instead.
+AUTO_BUILD = os.getenv('VECTOR_INDEX_AUTO_BUILD', 'true').lower() == 'true'
+# 'halfvec' or 'binary' index a compact copy of each embedding; candidates from it are re-ranked at full precision
+QUANTIZATION = os.getenv('VECTOR_QUANTIZATION', 'none')  # 'none', 'halfvec' or 'binary'
+RERANK_CANDIDATES = int(os.getenv('VECTOR_RERANK_CANDIDATES', 40))
+DIMENSIONS = 1024  # content_embedding is VECTOR(1024)
+
+OPERATORS = {'cosine': '<=>', 'l2': '<->', 'ip': '<#>'}
+OPCLASSES = {'cosine': 'vector_cosine_ops', 'l2': 'vector_l2_ops', 'ip': 'vector_ip_ops'}
+HALFVEC_OPCLASSES = {'cosine': 'halfvec_cosine_ops', 'l2': 'halfvec_l2_ops', 'ip': 'halfvec_ip_ops'}
+
+# Target recall -> hnsw.ef_search, and -> fraction of ivfflat lists to probe
+EF_SEARCH_BY_RECALL = [(0.90, 40), (0.95, 80), (0.98, 160), (0.99, 256), (1.0, 1000)]
+PROBE_FRACTION_BY_RECALL = [(0.90, 0.02), (0.95, 0.05), (0.98, 0.1), (0.99, 0.2), (1.0, 1.0)]
+
+class SequentialScanError(Exception):
+    """The chat query plan scans pdf_chunks sequentially instead of using an index"""
+
+def distance_operator(metric=DISTANCE_METRIC):
+    return OPERATORS[metric]
+
+def index_expression(quantization=QUANTIZATION, metric=DISTANCE_METRIC):
+    """(expression, opclass) the ANN index is built on"""
+    if quantization == 'halfvec':
+        return f"(content_embedding::halfvec({DIMENSIONS}))", HALFVEC_OPCLASSES[metric]
+    if quantization == 'binary':
+        # Hamming distance between sign bits; the exact re-rank restores the configured metric
+        return f"(binary_quantize(content_embedding)::bit({DIMENSIONS}))", 'bit_hamming_ops'
+    return 'content_embedding', OPCLASSES[metric]
+
+def quantized_distance(quantization=QUANTIZATION, metric=DISTANCE_METRIC):
+    """ORDER BY expression served by the quantized index; it must repeat the index expression exactly"""
+    expression, _ = index_expression(quantization, metric)
+    if quantization == 'binary':
+        return f"{expression} <~> binary_quantize(%(embedding)s::vector)"
+    return f"{expression} {distance_operator(metric)} %(embedding)s::vector::halfvec({DIMENSIONS})"
+
+def candidate_rows(table, where, columns, quantization=QUANTIZATION):
+    """FROM item ranked by the exact distance: the table itself, or a shortlist taken off the quantized index"""
+    if quantization == 'none':
+        return f"{table} {where}"
+    return f"""(
+            SELECT {columns}, content_embedding
+            FROM {table}
+            {where}
+            ORDER BY {quantized_distance(quantization)}
+            LIMIT %(rerank_candidates)s
+        ) AS shortlist"""
+
+def candidate_count(limit, quantization=QUANTIZATION, candidates=RERANK_CANDIDATES):
+    """Rows the index scan has to return for a query that keeps limit rows"""
+    return limit if quantization == 'none' else max(limit, candidates)
+
+def nearest_chunks_sql(table, filter_column=None, columns='content', quantization=QUANTIZATION, by_tenant=False):
+    """Nearest-neighbour query ordered by the operator the index was built for.
+
+    Quantized modes walk the compact index for candidate_count rows and re-rank them against the
+    full-precision content_embedding, so only the shortlist is read at full size. by_tenant adds the
+    client_id partition key, so the planner prunes to that tenant's partition and its index.
+    """
+    conditions = (["client_id = %(client_id)s"] if by_tenant else []) + ([f"{filter_column} = %(filter)s"] if filter_column else [])
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    return f"""
+        SELECT {columns}
+        FROM {candidate_rows(table, where, columns, quantization)}
+        ORDER BY content_embedding {distance_operator()} %(embedding)s::vector
+        LIMIT %(limit)s;
+    """
+
+def nearest_chunks_params(embedding, limit=1, filter_value=None, quantization=QUANTIZATION, candidates=RERANK_CANDIDATES,
+                          client_id=None):
+    """Parameters for nearest_chunks_sql; embedding is a pgvector literal"""
+    return {
+        'embedding': embedding,
+        'filter': filter_value,
+        'client_id': client_id,
+        'limit': limit,
+        'rerank_candidates': candidate_count(limit, quantization, candidates)
+    }
+
+def index_parameters(method, row_count):
+    if method == 'ivfflat':
+        # pgvector guidance: rows / 1000 lists up to 1M rows, sqrt(rows) after that
+        lists = row_count // 1000 if row_count <= 1000000 else int(math.sqrt(row_count))
+        return {'lists': max(lists, 1)}
+    if row_count <= 1000000:
+        return {'m': 16, 'ef_construction': 64}
+    return {'m': 24, 'ef_construction': 128}
+
+def _lookup(table, target):
+    for threshold, value in table:
+        if target <= threshold:
+            return value
+    return table[-1][1]
+
+def get_index_definition(cur, index_name=INDEX_NAME):
+    cur.execute("SELECT indexdef FROM pg_indexes WHERE indexname = %s", (index_name,))
+    row = cur.fetchone()
+    return row[0] if row else None
+
+def ivfflat_lists(index_definition):
+    match = re.search(r"lists\s*=\s*'?(\d+)", index_definition or '')
+    return int(match.group(1)) if match else None
+
+def needs_rebuild(index_definition, method, metric, row_count, quantization=QUANTIZATION):
+    if index_definition is None:
+        return True
+    if f"USING {method}" not in index_definition or index_expression(quantization, metric)[1] not in index_definition:
+        return True
+    if method == 'ivfflat':
+        # ivfflat lists are trained at build time, so rebuild once the table outgrows them
+        lists = ivfflat_lists(index_definition) or 1
+        return index_parameters(method, row_count)['lists'] >= 4 * lists
+    return False
+
+def _partition_index_name(index_name, table, partition):
+    """pdf_chunks_embedding_idx on pdf_chunks_p03 -> pdf_chunks_p03_embedding_idx"""
+    suffix = index_name[len(table):] if index_name.startswith(table) else f"_{index_name}"
+    return f"{partition}{suffix}"
+
+def build_index(conn, row_count, method=INDEX_METHOD, metric=DISTANCE_METRIC, table='pdf_chunks', index_name=INDEX_NAME,
+                quantization=QUANTIZATION):
+    """(Re)build the ANN index with parameters sized to the current row count.
+
+    The new index is built CONCURRENTLY under a temporary name while writes and queries keep using the old one,
+    then swapped in by a drop and rename in one short transaction. A partitioned table gets an index on the parent
+    alone, with a concurrent build on each partition attached to it.
+    """
+    params = index_parameters(method, row_count)
+    with_clause = ', '.join(f"{key} = {value}" for key, value in params.items())
+    expression, opclass = index_expression(quantization, metric)
+    definition = f"USING {method} ({expression} {opclass}) WITH ({with_clause})"
+    building = f"{index_name}_new"
+    conn.commit()
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction block
+    autocommit = conn.autocommit
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cur:
+            cur.execute(f"SET maintenance_work_mem = '{MAINTENANCE_WORK_MEM}'")
+            cur.execute("SELECT inhrelid::regclass::text FROM pg_inherits WHERE inhparent = %s::regclass ORDER BY 1", (table,))
+            partitions = [row[0] for row in cur.fetchall()]
+            # An interrupted build leaves an invalid index behind under the temporary name
+            cur.execute(f"DROP INDEX IF EXISTS {building}")
+            if partitions:
+                cur.execute(f"CREATE INDEX {building} ON ONLY {table} {definition}")
+                for partition in partitions:
+                    partition_building = f"{_partition_index_name(index_name, table, partition)}_new"
+                    cur.execute(f"DROP INDEX IF EXISTS {partition_building}")
+                    cur.execute(f"CREATE INDEX CONCURRENTLY {partition_building} ON {partition} {definition}")
+                    cur.execute(f"ALTER INDEX {building} ATTACH PARTITION {partition_building}")
+            else:
+                cur.execute(f"CREATE INDEX CONCURRENTLY {building} ON {table} {definition}")
+            cur.execute(f"ANALYZE {table}")
+            cur.execute("RESET maintenance_work_mem")
+    finally:
+        conn.autocommit = autocommit
+    with conn.cursor() as cur:
+        # Dropping the old index also drops its partition indexes, which frees their names for the new ones
+        cur.execute(f"DROP INDEX IF EXISTS {index_name}")
+        cur.execute(f"ALTER INDEX {building} RENAME TO {index_name}")
+        for partition in partitions:
+            partition_index = _partition_index_name(index_name, table, partition)
+            cur.execute(f"ALTER INDEX {partition_index}_new RENAME TO {partition_index}")
+    conn.commit()
+    print(f"Built {method} index {index_name} ({quantization} quantization) for {row_count} rows with {params}")
+
+def ensure_index(conn, method=INDEX_METHOD, metric=DISTANCE_METRIC, table='pdf_chunks', quantization=QUANTIZATION):
+    """Build the index once there is data, rebuild when it no longer fits; run out of band, not per PDF"""
+    with conn.cursor() as cur:
+        # The planner estimate avoids a full count on large tables; it is unset until the first ANALYZE.
+        # A partitioned table has no estimate of its own, so add up its partitions'.
+        cur.execute("""
+            SELECT coalesce(sum(greatest(child.reltuples, 0)), 0)::bigint, count(*)
+            FROM pg_inherits JOIN pg_class child ON child.oid = inhrelid
+            WHERE inhparent = %s::regclass
+        """, (table,))
+        row_count, partitions = cur.fetchone()
+        if not partitions:
+            cur.execute("SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass", (table,))
+            row_count = cur.fetchone()[0]
+        if row_count <= 0:
+            cur.execute(f"SELECT count(*) FROM {table}")
+            row_count = cur.fetchone()[0]
+        index_definition = get_index_definition(cur)
+    conn.commit()
+    # Every partition gets its own index, so size them by the rows in one partition
+    row_count = -(-row_count // max(partitions, 1))
+    if row_count and needs_rebuild(index_definition, method, metric, row_count, quantization):
+        build_index(conn, row_count, method, metric, table, quantization=quantization)
+        return True
+    return False
+
+_ivfflat_lists_cache = {}
+
+def search_settings(limit=1, target_recall=TARGET_RECALL, method=INDEX_METHOD, lists=1, quantization=QUANTIZATION,
+                    candidates=RERANK_CANDIDATES):
+    """{setting: value} for hnsw.ef_search or ivfflat.probes at a target recall"""
+    if method == 'hnsw':
+        # The index scan has to reach the whole re-rank shortlist, not just the rows kept
+        scan_rows = candidate_count(limit, quantization, candidates)
+        return {'hnsw.ef_search': max(_lookup(EF_SEARCH_BY_RECALL, target_recall), scan_rows)}
+    return {'ivfflat.probes': max(1, math.ceil(lists * _lookup(PROBE_FRACTION_BY_RECALL, target_recall)))}
+
+def set_search_params(cur, limit=1, target_recall=TARGET_RECALL, method=INDEX_METHOD):
+    """Set hnsw.ef_search / ivfflat.probes for the current transaction from a target recall"""
+    lists = 1
+    if method != 'hnsw':
+        if INDEX_NAME not in _ivfflat_lists_cache:
+            _ivfflat_lists_cache[INDEX_NAME] = ivfflat_lists(get_index_definition(cur)) or 1
+        lists = _ivfflat_lists_cache[INDEX_NAME]
+    settings = search_settings(limit, target_recall, method, lists)
+    for setting, value in settings.items():
+        cur.execute(f"SET LOCAL {setting} = {int(value)}")
+    return settings
+
+def _plan_nodes(plan):
+    yield plan
+    for child in plan.get('Plans', []):
+        yield from _plan_nodes(child)
+
+def check_query_plan(cur, sql, params, table='pdf_chunks'):
+    """Run EXPLAIN on a query and raise SequentialScanError if it scans the table sequentially"""
+    cur.execute("EXPLAIN (FORMAT JSON) " + sql, params)
+    row = cur.fetchone()
+    plan = row[0][0]['Plan']
+    nodes = list(_plan_nodes(plan))
+    for node in nodes:
+        # Partitions of table are named {table}_pNN
+        relation = node.get('Relation Name') or ''
+        if node.get('Node Type') == 'Seq Scan' and (relation == table or relation.startswith(f"{table}_p")):
+            raise SequentialScanError(f"Chat query falls back to a sequential scan on {relation}")
+    return [node.get('Index Name') for node in nodes if node.get('Index Name')]
+
+def check_chat_query_plan(cur, pdf_id=None, limit=1):
+    """EXPLAIN both chat retrieval queries (cross-PDF and single PDF) against a stored embedding"""
+    cur.execute("SELECT content_embedding::text, pdf_id, client_id FROM pdf_chunks WHERE pdf_id = coalesce(%s, pdf_id) LIMIT 1", (pdf_id,))
+    row = cur.fetchone()
+    if row is None:
+        raise ValueError("pdf_chunks is empty, load data before checking the query plan")
+    embedding, sample_pdf_id, client_id = row[0], row[1], row[2]
+    set_search_params(cur, limit)
+    return {
+        'all_pdfs': check_query_plan(cur, nearest_chunks_sql('pdf_chunks'), nearest_chunks_params(embedding, limit)),
+        'single_pdf': check_query_plan(
+            cur, nearest_chunks_sql('pdf_chunks', 'pdf_id', by_tenant=True),
+            nearest_chunks_params(embedding, limit, sample_pdf_id, client_id=client_id)
+        )
+    }
+
+if __name__ == '__main__':
+    # python vector_index.py --build | --check-plan [pdf_id]
+    from db_connection import connection
+    with connection() as conn:
+        if '--build' in sys.argv:
+            ensure_index(conn)
+        else:
+            pdf_id = sys.argv[2] if len(sys.argv) > 2 else None
+            with conn.cursor() as cur:
+                try:
+                    indexes = check_chat_query_plan(cur, pdf_id)
+                except SequentialScanError as e:
+                    print(f"FAIL: {e}")
+                    sys.exit(1)
+            print(f"OK: chat queries use indexes {indexes}")